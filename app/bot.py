@@ -1,30 +1,40 @@
 import asyncio
 import logging
+import signal
 import sys
 import os
-from datetime import datetime
 
 import sentry_sdk
 from aiogram import Bot, Dispatcher, Router, F
 from aiogram.enums import ParseMode
 from aiogram.filters import CommandStart, Command
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import (
-    BotCommand, Message, FSInputFile, 
-    InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
-)
+from aiogram.types import BotCommand, Message, CallbackQuery
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from aiohttp import web
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-import re
-from bs4 import BeautifulSoup
 from aiogram.client.default import DefaultBotProperties
-from pathlib import Path
 
 from app.config import settings
 from app.utils import cleanup
+from app.services import job_queue
+from app.services.jobs import jobs
+from app.services.pipeline import (
+    analyse_document, cancel_job, drain, draining, lease_heartbeat, notify_queued,
+    reject_invalid_document, resume_interrupted, retry_job, runner_lease, spawn_background,
+)
+from app.services.state_store import build_fsm_storage, leases
+from app.handlers.reports import setup_report_routes
+from app.handlers.debug import setup_debug_routes
+from app.handlers.metrics import setup_metrics_routes
+from app.handlers.admin import setup_admin_routes
+from app.handlers.instrumentation import poll_pending_updates, setup_instrumentation
+from app.utils.executor import prewarm_process_pool, shutdown_executors
+from app.utils.loop_monitor import monitor_loop_lag
+from app.utils.messaging import safe_edit_message, safe_send_message
+from app.utils.telegram_outbox import outbox
+from app.worker import WorkerPool
 
 # Configure logging
 logging.basicConfig(
@@ -52,38 +62,13 @@ if settings.SENTRY_DSN:
 
 # We'll instantiate the Bot later, after setting up the event loop (see __main__ block)
 bot: Bot | None = None
-dp = Dispatcher(storage=MemoryStorage())
+# FSM state lives in the shared state store, so it survives restarts and replicas agree on it
+dp = Dispatcher(storage=build_fsm_storage())
 
 # Setup main router
 main_router = Router()
 
 
-# Helper function to safely send messages in a task
-async def safe_send_message(message: Message, text: str, **kwargs):
-    """Send a Telegram message with basic retry logic (no extra tasks)."""
-    try:
-        return await message.answer(text, **kwargs)
-    except Exception as e:
-        logger.warning(f"safe_send_message error: {e} – retrying once")
-        await asyncio.sleep(0.5)
-        try:
-            return await message.answer(text, **kwargs)
-        except Exception as e2:
-            logger.error(f"safe_send_message failed again: {e2}")
-            return None
-
-
-# Helper function to safely delete a message
-async def safe_delete_message(message: Message):
-    """Delete a Telegram message with basic error handling."""
-    if message is None:
-        return
-    try:
-        await message.delete()
-    except Exception as e:
-        logger.warning(f"safe_delete_message error: {e}")
-
-
 @main_router.message(CommandStart())
 async def command_start(message: Message):
     await safe_send_message(
@@ -148,6 +133,20 @@ async def about_command(message: Message):
     )
 
 
+@main_router.message(Command("cancel"))
+async def cancel_command(message: Message):
+    job = jobs.for_user(message.from_user.id)
+    if job is not None:
+        await safe_send_message(message, await cancel_job(job))
+    elif await jobs.request_cancel(message.from_user.id):
+        # Running in another bot process, which picks the request up on its next heartbeat
+        await safe_send_message(message, "🛑 Отменяю анализ...")
+    elif settings.WORKERS and await job_queue.cancel_queued(str(message.from_user.id)):
+        await safe_send_message(message, "🛑 Анализ отменён, файл убран из очереди.")
+    else:
+        await safe_send_message(message, "Сейчас нет запущенного анализа.")
+
+
 # Add a simple echo handler to test basic functionality
 @main_router.message(F.text)
 async def echo_message(message: Message):
@@ -177,408 +176,57 @@ class ChatProcessingStates(StatesGroup):
 upload_router = Router()
 
 
-# Function to extract key insights from HTML report for Telegram
-async def extract_insights_for_telegram(html_content: str) -> str:
-    """Extract key insights from HTML report for Telegram message"""
-    # Using BeautifulSoup to parse HTML
-    soup = BeautifulSoup(html_content, 'html.parser')
-    
-    # Initialize a result string with header
-    insights = "<b>🔍 Краткий анализ отношений:</b>\n\n"
-    
-    # Try to get the main insights
-    try:
-        # Extract overview section (first paragraph)
-        overview = soup.find('h2', text=re.compile('Общий обзор', re.IGNORECASE))
-        if overview and overview.find_next('p'):
-            first_paragraph = overview.find_next('p').text.strip()
-            insights += f"<b>Общий обзор:</b> {first_paragraph[:200]}...\n\n"
-        
-        # Extract communication patterns
-        patterns = soup.find('h2', text=re.compile('Паттерны общения', re.IGNORECASE))
-        if patterns and patterns.find_next('p'):
-            pattern_text = patterns.find_next('p').text.strip()
-            insights += f"<b>Паттерны общения:</b> {pattern_text[:200]}...\n\n"
-        
-        # Extract emotional analysis
-        emotions = soup.find('h2', text=re.compile('Анализ эмоций', re.IGNORECASE))
-        if emotions and emotions.find_next('p'):
-            emotion_text = emotions.find_next('p').text.strip()
-            insights += f"<b>Эмоциональный анализ:</b> {emotion_text[:200]}...\n\n"
-        
-        # Extract top recommendations (first 3)
-        recommendations = soup.find('h2', text=re.compile('Рекомендации', re.IGNORECASE))
-        if recommendations:
-            rec_items = recommendations.find_next_siblings('div', class_='recommendation')[:3]
-            if rec_items:
-                insights += "<b>Ключевые рекомендации:</b>\n"
-                for i, rec in enumerate(rec_items, 1):
-                    rec_text = rec.text.strip()
-                    insights += f"{i}. {rec_text[:100]}...\n"
-        
-        # Extract key quotes (first 2)
-        quotes = soup.find_all('div', class_='quote')[:2]
-        if quotes:
-            insights += "\n<b>Ключевые цитаты:</b>\n"
-            for quote in quotes:
-                quote_text = quote.find('p').text.strip()
-                author = quote.find('p', class_='quote-author')
-                if author:
-                    insights += f"• <i>«{quote_text}»</i> — {author.text.strip()}\n"
-                else:
-                    insights += f"• <i>«{quote_text}»</i>\n"
-    
-    except Exception as e:
-        logger.error(f"Error extracting insights: {e}")
-        insights += "Не удалось извлечь подробные выводы. Пожалуйста, обратитесь к полному отчету."
-    
-    return insights
-
-
-# Helper function to safely edit a message
-async def safe_edit_message(message: Message, text: str, **kwargs):
-    try:
-        return await message.edit_text(text, **kwargs)
-    except Exception as e:
-        logger.warning(f"safe_edit_message error: {e} – retrying once")
-        await asyncio.sleep(0.5)
-        try:
-            return await message.edit_text(text, **kwargs)
-        except Exception as e2:
-            logger.error(f"safe_edit_message failed again: {e2}")
-            return None
-
-
 @upload_router.message(F.document)
 async def handle_document(message: Message):
-    """Handle document uploads and process valid text or HTML files"""
-    logger.info(f"[TIMEOUT-FIX] Document handler started for user {message.from_user.id}: {getattr(message.document, 'file_name', 'Unknown')}")
-    
-    # Check if document exists
-    if not message.document:
-        logger.warning(f"[TIMEOUT-FIX] Document not found in message from user {message.from_user.id}")
-        await safe_send_message(message, "⚠️ Документ не найден. Пожалуйста, отправьте текстовый файл или HTML-экспорт чата.")
-        return
-    
-    # Log document details
-    logger.info(f"[TIMEOUT-FIX] Document details: name={message.document.file_name}, size={message.document.file_size}, mime={message.document.mime_type}")
-    
-    # Check MIME type or fallback to file extension for Telegram exports, which often lack correct MIME
-    valid_mime_types = ["text/plain", "text/html", "application/octet-stream"]
-    valid_extensions = [".txt", ".html", ".htm"]
-
-    file_extension = Path(message.document.file_name or "").suffix.lower()
-
-    if (message.document.mime_type not in valid_mime_types) and (file_extension not in valid_extensions):
-        logger.warning(
-            f"[TIMEOUT-FIX] Invalid file type: mime={message.document.mime_type}, ext={file_extension} from user {message.from_user.id}"
-        )
+    """Handle document uploads: analyse them here, or queue them for the worker processes"""
+    if draining():
         await safe_send_message(
-            message,
-            "⚠️ Неверный формат файла. Пожалуйста, отправьте текстовый файл (.txt) или HTML-экспорт чата (.html)."
+            message, "🔄 Бот перезапускается. Пожалуйста, отправьте файл ещё раз через минуту."
         )
         return
-    
-    # Check file size
-    if message.document.file_size > settings.MAX_FILE_SIZE:
-        logger.warning(f"[TIMEOUT-FIX] File too large: {message.document.file_size} bytes from user {message.from_user.id}")
-        await safe_send_message(
-            message,
-            f"⚠️ Файл слишком большой. Максимальный размер {settings.MAX_FILE_SIZE // (1024 * 1024)} МБ."
-        )
+    if not settings.WORKERS:
+        await analyse_document(message)
         return
-    
-    # All checks passed, let's download and process the file
-    logger.info(f"[TIMEOUT-FIX] File validation passed, proceeding to download and process file from user {message.from_user.id}")
-    
-    try:
-        # Send acknowledgment message - THIS USED TO FAIL WITH TIMEOUT ERROR
-        logger.info("[TIMEOUT-FIX] About to send acknowledgment message using safe_send_message")
-        ack_message = await safe_send_message(message, "✅ Ваш файл получен. Начинаю анализ...")
-        logger.info("[TIMEOUT-FIX] Acknowledgment message sent successfully")
-        
-        # Process the file by importing here to avoid circular imports
-        from app.services.chunker import split_chat
-        from app.services.llm_primary import process_chunks
-        from app.services.llm_meta import generate_meta_report
-        from app.services.render import render_to_pdf
-        from app.utils.logging_utils import log_cost
-        import uuid
-        import openai
-        
-        # Generate unique IDs for the files
-        file_id = str(uuid.uuid4())
-        logger.info(f"Generated file ID: {file_id}")
-        
-        # Set the appropriate file extension based on mime type
-        file_extension = ".html" if message.document.mime_type == "text/html" else ".txt"
-        upload_file_path = settings.UPLOAD_DIR / f"{file_id}{file_extension}"
-        report_file_path = settings.REPORT_DIR / f"{file_id}.pdf"
-        html_file_path = settings.REPORT_DIR / f"{file_id}_report.html"
-        
-        logger.info(f"File paths: upload={upload_file_path}, report={report_file_path}, html={html_file_path}")
-        
-        # Download the file
-        logger.info("Starting file download")
-        try:
-            file_path = await bot.download(message.document, destination=upload_file_path)
-            logger.info(f"File downloaded successfully to {file_path}")
-            
-            # Verify file was downloaded correctly
-            if os.path.exists(upload_file_path):
-                file_size = os.path.getsize(upload_file_path)
-                logger.info(f"Downloaded file size: {file_size} bytes")
-                if file_size == 0:
-                    logger.error("Downloaded file is empty")
-                    await safe_send_message(message, "❌ Ошибка: загруженный файл пуст. Пожалуйста, проверьте файл и попробуйте снова.")
-                    return
-            else:
-                logger.error(f"File not found after download: {upload_file_path}")
-                await safe_send_message(message, "❌ Ошибка при сохранении файла. Пожалуйста, попробуйте снова.")
-                return
-        except Exception as download_error:
-            logger.exception(f"Error downloading file: {download_error}")
-            await safe_send_message(message, "❌ Ошибка при загрузке файла. Пожалуйста, попробуйте снова.")
-            return
-        
-        # Let the user know we're processing and all data is anonymized
-        logger.info("Sending status message")
-        status_message = await safe_send_message(
-            message,
-            "🔍 <b>Анализирую чат...</b>\n\n"
-            "⚠️ <b>Важно:</b> Все личные данные в чате анонимизируются при обработке. "
-            "Имена заменяются общими идентификаторами, а чувствительная информация не сохраняется. "
-            "Ваша конфиденциальность важна для нас.\n\n"
-            "Это может занять минуту или две."
-        )
-        
-        # Split the chat into chunks
-        logger.info(f"Splitting chat from file {upload_file_path}")
-        chunks = split_chat(upload_file_path)
-        num_chunks = len(chunks)
-        logger.info(f"Split chat into {num_chunks} chunks")
-        
-        if num_chunks == 0:
-            logger.warning(f"No chunks extracted from file {upload_file_path}")
-            await safe_send_message(message, "⚠️ Не удалось обработать файл. Возможно, он пуст или имеет неправильный формат?")
-            os.unlink(upload_file_path)
-            return
-        
-        # Progress bar helper
-        def _build_progress_bar(done: int, total: int, bar_len: int = 20) -> str:
-            """Return a unicode progress bar string."""
-            filled = int(bar_len * done / total) if total else 0
-            bar = "█" * filled + "░" * (bar_len - filled)
-            return f"[{bar}] {done}/{total}"
-
-        # Initial progress message
-        await safe_edit_message(
-            status_message,
-            f"🔄 <b>Обрабатываю фрагменты данных чата</b> 0/{num_chunks}\n{_build_progress_bar(0, num_chunks)}",
-            parse_mode=ParseMode.HTML,
-        )
 
-        # Throttle progress updates to avoid Telegram flood & race conditions
-        progress_lock = asyncio.Lock()
-        _last_update_ts: float = 0.0  # nonlocal for closure
-
-        async def _progress_callback(done: int, total: int):
-            nonlocal _last_update_ts
-            # Update no more than once per second
-            now = asyncio.get_event_loop().time()
-            if now - _last_update_ts < 1:
-                return
-            _last_update_ts = now
-
-            async with progress_lock:
-                await safe_edit_message(
-                    status_message,
-                    f"🔄 <b>Обрабатываю фрагменты данных чата</b> {done}/{total}\n{_build_progress_bar(done, total)}",
-                    parse_mode=ParseMode.HTML,
-                )
-
-        analysis_results, primary_tokens = await process_chunks(chunks, progress_callback=_progress_callback)
-        logger.info(f"Successfully processed {len(analysis_results)} chunk results")
-        
-        # Generate meta report with GPT-4
-        logger.info(f"Starting meta report generation with {settings.META_MODEL}")
-        await safe_edit_message(status_message, "✨ Создаю психологические выводы и генерирую отчет...")
-        
-        try:
-            total_messages = sum(len(chunk) for chunk in chunks)
-            html_content, meta_tokens = await generate_meta_report(analysis_results, total_messages)
-            logger.info("Successfully generated meta report HTML content")
-            
-            # Save HTML content to file
-            logger.info(f"Saving HTML content to {html_file_path}")
-            with open(html_file_path, "w", encoding="utf-8") as f:
-                f.write(html_content)
-            
-            # Render HTML to PDF
-            logger.info(f"Rendering HTML to PDF at {report_file_path}")
-            pdf_url = await render_to_pdf(html_file_path, report_file_path)
-            
-            # Generate a public URL for the PDF
-            report_url = f"{settings.WEBHOOK_HOST}/reports/{os.path.basename(report_file_path)}" if settings.WEBHOOK_HOST else f"file://{report_file_path}"
-            logger.info(f"Report URL: {report_url}")
-            
-            # Calculate and log approximate cost
-            # primary_tokens are from GPT35_MODEL, meta_tokens are from META_MODEL (GPT-4-Turbo)
-            # Ensure costs are per token, not per 1K tokens, or adjust calculation.
-            # Current config vars are COST_PER_1K_TOKENS_*
-            cost_primary = (primary_tokens / 1000) * settings.COST_PER_1K_TOKENS_GPT35_TURBO
-            
-            # For meta_tokens, we need to know if it includes prompt and completion tokens to use separate costs.
-            # Assuming meta_tokens is total tokens from the call. 
-            # A more precise way: get prompt_tokens and completion_tokens from usage.
-            # For simplicity, if meta_tokens is total, use a weighted average or dominant cost (e.g. input).
-            # Let's assume meta_tokens refers to total tokens from the GPT-4 call.
-            # We'll use separate input/output costs if available from response, else approximate.
-            # The generate_meta_report currently returns total_tokens from usage.
-            # We need to decide how to split this for costing if using separate input/output rates.
-            # For now, let's use an average or assume input cost dominates if usage isn't split here.
-            # As a simplification, if response.usage has prompt_tokens and completion_tokens, use them.
-            # However, generate_meta_report only returns `tokens_used_meta`. 
-            # We will assume this is total and use a combined/average logic if we don't get a breakdown.
-            # For a single call, it is better to use the specific input/output costs from the API response if possible.
-            # The `generate_meta_report` should ideally return (html, prompt_tokens, completion_tokens)
-            # For now, treating `meta_tokens` as total and using a simplified approach:
-            # This example assumes meta_tokens could be split or an average cost is applied.
-            # If meta_tokens is total, and we have input/output cost, we can't precisely apply them without the split.
-            # Let's assumeCOST_PER_1K_TOKENS_GPT4_TURBO_INPUT is representative for the bulk of meta_tokens or an average.
-            # A better way is to get input and output tokens from the response in generate_meta_report.
-            # Given the current structure, where generate_meta_report returns `tokens_used_meta` (total):
-            # It's hard to apply separate input/output costs accurately here.
-            # Option 1: Assume an average cost for GPT-4 Turbo for `meta_tokens`.
-            # (settings.COST_PER_1K_TOKENS_GPT4_TURBO_INPUT + settings.COST_PER_1K_TOKENS_GPT4_TURBO_OUTPUT) / 2
-            avg_gpt4_turbo_cost_per_1k = (settings.COST_PER_1K_TOKENS_GPT4_TURBO_INPUT + settings.COST_PER_1K_TOKENS_GPT4_TURBO_OUTPUT) / 2.0
-            cost_meta = (meta_tokens / 1000) * avg_gpt4_turbo_cost_per_1k
-
-            approx_total_cost = cost_primary + cost_meta
-            await log_cost(str(message.from_user.id), num_chunks, approx_total_cost)
-            
-            # Extract insights for Telegram message
-            logger.info("Extracting insights for Telegram message")
-            telegram_insights = await extract_insights_for_telegram(html_content)
-            
-            # Send success message with download option
-            
-            # If we're in local mode without a webhook, just send the file directly
-            if not settings.WEBHOOK_HOST:
-                logger.info("Running in local mode, sending file directly")
-                await safe_delete_message(status_message)
-                
-                # First send insights as HTML message
-                logger.info("Sending insights message")
-                await safe_send_message(
-                    message,
-                    telegram_insights,
-                    parse_mode=ParseMode.HTML
-                )
-                
-                # Then send the full report as a document
-                logger.info("Sending report document")
-                await safe_send_message(
-                    message,
-                    "Отправляю полный отчет..."
-                )
-                
-                # Use safe task for document sending
-                async def _send_document():
-                    logger.info("[TIMEOUT-FIX] Inside _send_document task")
-                    try:
-                        result = await message.answer_document(
-                            FSInputFile(report_file_path),
-                            caption="Ваш полный отчет Chat X-Ray готов. Этот файл будет доступен в течение 72 часов."
-                        )
-                        logger.info("[TIMEOUT-FIX] Document sent successfully")
-                        return result
-                    except Exception as inner_e:
-                        logger.error(f"[TIMEOUT-FIX] Error in document sending task: {inner_e}")
-                        return None
-                
-                logger.info("[TIMEOUT-FIX] Creating task for document sending")
-                await asyncio.create_task(_send_document())
-                logger.info("[TIMEOUT-FIX] Document sending task completed")
-            else:
-                # In production with webhook, send insights and a link
-                logger.info("Running in webhook mode, sending link to report")
-                await safe_delete_message(status_message)
-                
-                # First send insights as HTML message
-                logger.info("Sending insights message")
-                await safe_send_message(
-                    message,
-                    telegram_insights,
-                    parse_mode=ParseMode.HTML
-                )
-                
-                # Then send the link to full report
-                logger.info("Creating download button with URL")
-                download_markup = InlineKeyboardMarkup(
-                    inline_keyboard=[
-                        [InlineKeyboardButton(
-                            text="📊 Скачать полный отчет",
-                            url=report_url
-                        )]
-                    ]
-                )
-                
-                logger.info("Sending download button message")
-                await safe_send_message(
-                    message,
-                    "📋 Для получения полного отчета нажмите на кнопку ниже:",
-                    reply_markup=download_markup
-                )
-            
-            # Add metadata to track file expiration
-            logger.info("Adding file expiration metadata")
-            expiration_time = datetime.now().timestamp() + (settings.REPORT_RETENTION_HOURS * 3600)
-            with open(f"{report_file_path}.meta", "w") as f:
-                f.write(str(expiration_time))
-            
-            # Delete the original upload file metadata
-            upload_expiration_time = datetime.now().timestamp() + (settings.UPLOAD_RETENTION_HOURS * 3600)
-            with open(f"{upload_file_path}.meta", "w") as f:
-                f.write(str(upload_expiration_time))
-            
-            logger.info(f"Successfully completed processing file for user {message.from_user.id}")
-            
-        except openai.RateLimitError as e:
-            logger.error(f"Rate limit error during meta analysis: {e}")
-            await safe_edit_message(
-                status_message,
-                "⚠️ Мы достигли ограничения запросов при создании отчета.\n\n"
-                "Это обычно происходит при обработке очень больших чатов или в периоды пиковой нагрузки.\n\n"
-                "Пожалуйста, попробуйте загрузить файл меньшего размера или повторите попытку через несколько минут."
-            )
-            
-        except Exception as e:
-            logger.exception(f"Error in meta analysis: {e}")
-            await safe_edit_message(
-                status_message,
-                "❌ Произошла ошибка при создании отчета.\n\n"
-                f"Детали ошибки: {str(e)}\n\n"
-                "Пожалуйста, попробуйте еще раз или обратитесь в поддержку, если проблема не исчезнет."
-            )
-            
-    except Exception as e:
-        logger.exception(f"Error processing file: {e}")
-        if settings.SENTRY_DSN:
-            sentry_sdk.capture_exception(e)
-        
+    if await reject_invalid_document(message):
+        return
+    queue_id, ahead = await job_queue.enqueue(
+        message.model_dump_json(exclude_none=True), str(message.from_user.id), message.chat.id
+    )
+    logger.info(f"Queued upload {queue_id} from user {message.from_user.id} ({ahead} ahead)")
+    if ahead >= settings.WORKERS * settings.WORKER_CONCURRENCY:
+        # Every worker slot is taken; otherwise the worker's own status message follows right away
         await safe_send_message(
             message,
-            "❌ Извините, произошла ошибка при обработке вашего файла. Пожалуйста, попробуйте позже."
+            f"⏳ Файл получен. Перед вами в очереди анализов: {ahead}, начну, как только освободится место.",
         )
-        
-        # Make sure to clean up any files if there was an error
-        if 'upload_file_path' in locals() and os.path.exists(upload_file_path):
-            try:
-                os.unlink(upload_file_path)
-                logger.info(f"Cleaned up upload file after error: {upload_file_path}")
-            except Exception as cleanup_error:
-                logger.error(f"Error cleaning up file: {cleanup_error}")
+
+
+@upload_router.callback_query(F.data.startswith("cancel:"))
+async def cancel_button(callback: CallbackQuery):
+    job_id = callback.data.split(":", 1)[1]
+    job = jobs.get(job_id)
+    if job is None or job.user_id != callback.from_user.id:
+        if await jobs.request_cancel(callback.from_user.id, job_id):
+            await callback.answer("Отменяю...")
+        else:
+            await callback.answer("Этот анализ уже завершён.")
+        return
+    await callback.answer("Отменяю...")
+    text = await cancel_job(job)
+    if callback.message:
+        await safe_edit_message(callback.message, text)
+
+
+@upload_router.callback_query(F.data.startswith("retry:"))
+async def retry_button(callback: CallbackQuery):
+    job_id = callback.data.split(":", 1)[1]
+    if draining():
+        await callback.answer("Бот перезапускается, попробуйте через минуту.")
+    elif await retry_job(callback.bot, job_id, callback.from_user.id):
+        await callback.answer("Повторяю анализ...")
+    else:
+        await callback.answer("Этот анализ уже выполняется или больше недоступен.")
 
 
 # Health check endpoint
@@ -607,6 +255,7 @@ async def main():
     # -------------------------------------------------
     dp.include_router(main_router)
     dp.include_router(upload_router)
+    setup_instrumentation(dp)
 
     # -------------------------------------------------
     # 3. Start background scheduler for cleanup
@@ -626,6 +275,17 @@ async def main():
     )
     scheduler.start()
 
+    # Load WeasyPrint, fonts and the report stylesheet before the first report needs them
+    from app.services.render import pdf_renderer
+    spawn_background(pdf_renderer.prewarm())
+
+    # Parsing runs in the analysis workers when there are any
+    if not settings.WORKERS:
+        spawn_background(prewarm_process_pool())
+
+    # Log and count anything that blocks the event loop
+    spawn_background(monitor_loop_lag())
+
     # -------------------------------------------------
     # 4. Determine operation mode (webhook vs polling)
     # -------------------------------------------------
@@ -633,6 +293,9 @@ async def main():
         settings.WEBHOOK_URL or os.environ.get("PORT") or os.environ.get("RENDER_EXTERNAL_URL")
     )
 
+    # Job ownership shared with other bot processes
+    spawn_background(lease_heartbeat(is_webhook_mode, runner=not settings.WORKERS))
+
     logger.info(f"Bot startup mode: {'webhook' if is_webhook_mode else 'polling'}")
 
     # Build/adjust webhook URL dynamically when running on Render.com
@@ -640,49 +303,93 @@ async def main():
         settings.WEBHOOK_URL = f"{os.environ['RENDER_EXTERNAL_URL']}{settings.WEBHOOK_PATH}"
         logger.info(f"Constructed webhook URL: {settings.WEBHOOK_URL}")
 
-    # -------------------------------------------------
-    # 4a. WEBHOOK MODE  – aiohttp web-server
-    # -------------------------------------------------
-    if is_webhook_mode:
-        # Tell Telegram to use the webhook
-        await bot.set_webhook(settings.WEBHOOK_URL, drop_pending_updates=True)
-
-        # Build aiohttp Application and register aiogram handler on given path
-        app = web.Application()
-
-        # Use Aiogram's built-in helper to register a proper request handler
-        SimpleRequestHandler(dp, bot).register(app, path=settings.WEBHOOK_PATH)
-
-        # Extra endpoints
-        app.router.add_get("/", health_check)
-        app.router.add_get("/health", health_check)
-        app.router.add_static(
-            "/reports/", path=str(settings.REPORT_DIR), name="reports"
-        )
-
-        # Launch web-server using the *current* event-loop.
-        runner = web.AppRunner(app)
-        await runner.setup()
-        site = web.TCPSite(runner, host=settings.HOST, port=settings.PORT)
-        await site.start()
-        logger.info(f"Webhook server started on {settings.HOST}:{settings.PORT}")
+    # Analysis worker processes take uploads from the job queue (WORKERS > 0);
+    # without them, this process resumes the jobs the last shutdown interrupted
+    worker_pool = None
+    if settings.WORKERS:
+        worker_pool = WorkerPool(settings.WORKERS)
+        worker_pool.start()
+        spawn_background(worker_pool.supervise())
+        logger.info(f"Started {settings.WORKERS} analysis workers")
+    else:
+        spawn_background(resume_interrupted(bot))
 
-        # Block forever (until Ctrl-C / container stop)
-        await asyncio.Event().wait()
+    # SIGTERM (container stop) and Ctrl-C start a graceful drain instead of killing jobs
+    stop_requested = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop_requested.set)
+        except NotImplementedError:
+            pass  # Windows: KeyboardInterrupt still ends the bot, without the drain
 
-    # -------------------------------------------------
-    # 4b. LONG-POLLING MODE
-    # -------------------------------------------------
-    else:
-        logger.info("Starting long-polling")
-        await bot.delete_webhook(drop_pending_updates=True)
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    runner = None
+    try:
+        # -------------------------------------------------
+        # 4a. WEBHOOK MODE  – aiohttp web-server
+        # -------------------------------------------------
+        if is_webhook_mode:
+            # Tell Telegram to use the webhook. Replicas share it: only the first one up
+            # drops the stale backlog, later ones must not drop updates meant for their peers
+            first_replica = await leases.acquire("webhook", settings.INSTANCE_ID, settings.LEASE_TTL_SECONDS)
+            await bot.set_webhook(settings.WEBHOOK_URL, drop_pending_updates=first_replica)
+
+            # Build aiohttp Application and register aiogram handler on given path
+            app = web.Application()
+
+            # Use Aiogram's built-in helper to register a proper request handler
+            SimpleRequestHandler(dp, bot).register(app, path=settings.WEBHOOK_PATH)
+
+            # Extra endpoints
+            app.router.add_get("/", health_check)
+            app.router.add_get("/health", health_check)
+            setup_report_routes(app)
+            setup_debug_routes(app)
+            setup_metrics_routes(app)
+            setup_admin_routes(app)
+
+            # Launch web-server using the *current* event-loop.
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, host=settings.HOST, port=settings.PORT)
+            await site.start()
+            logger.info(f"Webhook server started on {settings.HOST}:{settings.PORT}")
+
+            # Telegram-side queue depth of updates not yet delivered to us
+            spawn_background(poll_pending_updates(bot))
+
+            # Serve until Ctrl-C / container stop
+            await stop_requested.wait()
+            logger.info("Stop requested, draining")
+
+        # -------------------------------------------------
+        # 4b. LONG-POLLING MODE
+        # -------------------------------------------------
+        else:
+            logger.info("Starting long-polling")
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
 
     # -------------------------------------------------
-    # 5. Graceful shutdown  (falls through when poll/webhook exits)
+    # 5. Graceful shutdown  (when poll/webhook exits or is interrupted)
     # -------------------------------------------------
-    scheduler.shutdown(wait=False)
-    await bot.session.close()
+    finally:
+        # New uploads are turned away from here on (the webhook keeps serving
+        # meanwhile); running jobs get the grace period, the rest resumes after
+        # the restart
+        await drain(settings.SHUTDOWN_GRACE_SECONDS)
+        if worker_pool is None:
+            await leases.release(runner_lease(settings.INSTANCE_ID), settings.INSTANCE_ID)
+        else:
+            worker_pool.stop_claiming()
+            await notify_queued(bot)
+            await worker_pool.stop(timeout=settings.SHUTDOWN_GRACE_SECONDS + 10)
+        if runner is not None:
+            await runner.cleanup()
+        scheduler.shutdown(wait=False)
+        await outbox.drain(timeout=5)
+        shutdown_executors()
+        await bot.session.close()
 
 
 if __name__ == "__main__":
@@ -1,7 +1,9 @@
 import os
 import logging
+import socket
+import uuid
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional
 
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
@@ -27,11 +29,15 @@ class Settings(BaseSettings):
     # Default model configurations
     PRIMARY_MODEL: str = "gpt-3.5-turbo"
     META_MODEL: str = "gpt-4-turbo" # Ensure this is a current, powerful GPT-4 Turbo model
+    # Ask the meta model for structured JSON (response_format=json_object); disable for models without JSON mode
+    META_JSON_MODE: bool = os.getenv("META_JSON_MODE", "true").lower() == "true"
     
     # Webhook settings (for production)
     WEBHOOK_HOST: Optional[str] = None
     WEBHOOK_PATH: str = "/webhook"
     WEBHOOK_URL: Optional[str] = None
+    # HMAC key for signed /reports/ links; derived from BOT_TOKEN when unset
+    REPORT_URL_SECRET: Optional[str] = None
     
     # Server settings
     PORT: int = 8080
@@ -45,12 +51,59 @@ class Settings(BaseSettings):
     BASE_DIR: Path = Path(__file__).parent.parent
     UPLOAD_DIR: Path = BASE_DIR / "uploads"
     REPORT_DIR: Path = BASE_DIR / "reports"
+    # Persistent bot state (cost ledger, report index, job queue) lives in one SQLite file
+    DATA_DIR: Path = BASE_DIR / "data"
+    STATE_DB_PATH: Path = DATA_DIR / "state.db"
+    # FSM state and leases: "sqlite" (state DB, shared by the bot processes of a host)
+    # or "memory" (single process, lost on restart)
+    STATE_BACKEND: str = os.getenv("STATE_BACKEND", "sqlite")
+    # Identifies this process as a lease owner; leases not renewed for the TTL expire.
+    # Unique per process start: in containers the pid (often 1) and the hostname repeat
+    # across restarts, and a restarted process must not inherit the leases of the dead one
+    INSTANCE_ID: str = os.getenv("INSTANCE_ID", f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}")
+    LEASE_TTL_SECONDS: int = int(os.getenv("LEASE_TTL_SECONDS", 30))
     MAX_FILE_SIZE: int = 2 * 1024 * 1024  # 2 MB
     
+    # wkhtmltopdf fallback renderer limits
+    WKHTMLTOPDF_TIMEOUT_SECONDS: int = int(os.getenv("WKHTMLTOPDF_TIMEOUT_SECONDS", 60))
+    WKHTMLTOPDF_CONCURRENCY: int = int(os.getenv("WKHTMLTOPDF_CONCURRENCY", 2))
+    
+    # CPU-bound work runs off the event loop (0 process workers = threads only)
+    CPU_THREAD_WORKERS: int = int(os.getenv("CPU_THREAD_WORKERS", 4))
+    CPU_PROCESS_WORKERS: int = int(os.getenv("CPU_PROCESS_WORKERS", 2))
+    # Analysis worker processes fed from the job queue; 0 runs the pipeline in the
+    # bot process itself. Each worker runs up to WORKER_CONCURRENCY jobs at once
+    WORKERS: int = int(os.getenv("WORKERS", 0))
+    WORKER_CONCURRENCY: int = int(os.getenv("WORKER_CONCURRENCY", 4))
+    WORKER_POLL_SECONDS: float = float(os.getenv("WORKER_POLL_SECONDS", 1))
+    # A queued upload whose worker died is retried until it was started this many times
+    QUEUE_MAX_ATTEMPTS: int = int(os.getenv("QUEUE_MAX_ATTEMPTS", 2))
+    # On SIGTERM running jobs get this long to finish before they are queued to resume
+    # after the restart; keep it below the platform's kill timeout (Render: 30s)
+    SHUTDOWN_GRACE_SECONDS: int = int(os.getenv("SHUTDOWN_GRACE_SECONDS", 20))
+    # Event-loop lag above this is logged and counted
+    LOOP_LAG_WARN_MS: int = int(os.getenv("LOOP_LAG_WARN_MS", 100))
+    # asyncio debug mode with slow-callback reports (adds overhead; for investigations)
+    ASYNCIO_DEBUG: bool = os.getenv("ASYNCIO_DEBUG", "false").lower() == "true"
+    # Enables GET /debug/loop?token=... on the webhook server when set
+    DEBUG_DUMP_TOKEN: Optional[str] = None
+    # Bearer token required by GET /metrics when set; open otherwise
+    METRICS_TOKEN: Optional[str] = None
+    # Enables POST /admin/reports/{job_id}/regenerate (bearer token) on the webhook server when set
+    ADMIN_TOKEN: Optional[str] = None
+    # Outgoing Telegram calls (messages per second): bot-wide, and per chat with short bursts
+    TELEGRAM_GLOBAL_RATE: float = float(os.getenv("TELEGRAM_GLOBAL_RATE", 30))
+    TELEGRAM_CHAT_RATE: float = float(os.getenv("TELEGRAM_CHAT_RATE", 1))
+    TELEGRAM_CHAT_BURST: int = int(os.getenv("TELEGRAM_CHAT_BURST", 3))
+    
     # Chunking settings
     MAX_MESSAGES_PER_CHUNK: int = 500
     MAX_TOKENS_PER_CHUNK: int = 2000
     
+    # Uploads are parsed from memory; set to also keep them in UPLOAD_DIR until the report
+    # is delivered, so a retry or a resume after a restart does not download them again
+    PERSIST_UPLOADS: bool = os.getenv("PERSIST_UPLOADS", "false").lower() == "true"
+
     # Retention periods (in hours)
     UPLOAD_RETENTION_HOURS: int = 1
     REPORT_RETENTION_HOURS: int = 72
@@ -58,6 +111,24 @@ class Settings(BaseSettings):
     # Logging and cost tracking
     ENABLE_COST_TRACKING: bool = True
     
+    # Pre-flight planner: the cheapest plan that keeps full coverage within both
+    # limits wins; candidates are every combination of the lists below
+    JOB_SLA_SECONDS: int = int(os.getenv("JOB_SLA_SECONDS", 300))
+    JOB_BUDGET_USD: float = float(os.getenv("JOB_BUDGET_USD", 0.50))
+    PLANNER_CHUNK_SIZES: List[int] = [15, 25, 40]
+    PLANNER_PRIMARY_MODELS: List[str] = []  # empty = PRIMARY_MODEL only
+    PLANNER_META_SAMPLE_SIZES: List[int] = [400, 250, 150]
+    # Throughput is learned from the cost ledger once a model/stage has this many timed calls
+    PLANNER_HISTORY_DAYS: int = int(os.getenv("PLANNER_HISTORY_DAYS", 14))
+    PLANNER_MIN_SAMPLES: int = int(os.getenv("PLANNER_MIN_SAMPLES", 5))
+    
+    # Hard time budget per job; stages degrade (aggregate-only chunks, smaller meta
+    # sample, HTML instead of PDF) rather than run past it
+    JOB_DEADLINE_SECONDS: int = int(os.getenv("JOB_DEADLINE_SECONDS", 600))
+    DEADLINE_META_MIN_SECONDS: int = int(os.getenv("DEADLINE_META_MIN_SECONDS", 60))
+    DEADLINE_META_SAMPLE_SIZE: int = int(os.getenv("DEADLINE_META_SAMPLE_SIZE", 150))
+    DEADLINE_PDF_RESERVE_SECONDS: int = int(os.getenv("DEADLINE_PDF_RESERVE_SECONDS", 30))
+    
     # Token and rate limit settings
     MAX_MESSAGES_FOR_META: int = int(os.getenv("MAX_MESSAGES_FOR_META", 400)) # Kept at 400
     
@@ -90,6 +161,13 @@ class Settings(BaseSettings):
     COST_PER_1K_TOKENS_GPT4_TURBO_INPUT: float = float(os.getenv("COST_PER_1K_TOKENS_GPT4_TURBO_INPUT", 0.01))
     COST_PER_1K_TOKENS_GPT4_TURBO_OUTPUT: float = float(os.getenv("COST_PER_1K_TOKENS_GPT4_TURBO_OUTPUT", 0.03))
 
+    # Per-model prices per 1K tokens, matched by longest model-name prefix, e.g.
+    # MODEL_PRICES_PER_1K='{"gpt-4o-mini": {"input": 0.00015, "output": 0.0006}}'.
+    # Models not listed fall back to the GPT-3.5 / GPT-4 Turbo values above.
+    MODEL_PRICES_PER_1K: Dict[str, Dict[str, float]] = {}
+    # Cached prompt tokens are billed at this fraction of the input price
+    CACHED_INPUT_PRICE_RATIO: float = float(os.getenv("CACHED_INPUT_PRICE_RATIO", 0.5))
+
     # Old combined cost variables for reference or if simpler model needed.
     # GPT35_COST_PER_TOKEN: float = float(os.getenv("GPT35_COST_PER_TOKEN", 0.0000015))
     # GPT4_TURBO_COST_PER_TOKEN: float = float(os.getenv("GPT4_TURBO_COST_PER_TOKEN", 0.00001))
@@ -105,6 +183,7 @@ settings = Settings()
 # Create directories if they don't exist
 os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
 os.makedirs(settings.REPORT_DIR, exist_ok=True)
+os.makedirs(settings.DATA_DIR, exist_ok=True)
 
 # Automatically construct webhook URL if host is provided but URL is not
 if settings.WEBHOOK_HOST and not settings.WEBHOOK_URL:
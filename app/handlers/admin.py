@@ -0,0 +1,45 @@
+import hmac
+import re
+
+from aiohttp import web
+
+from app.config import settings
+from app.services.regenerate import regenerate_report
+from app.services.render import report_url
+
+_JOB_ID = re.compile(r"^[\w-]+$")
+
+
+async def regenerate_endpoint(request: web.Request) -> web.Response:
+    """
+    POST /admin/reports/{job_id}/regenerate[?pdf=1]
+
+    Renders a delivered report again from its stored analysis, without calling
+    the model, and returns fresh links to it. Needs ADMIN_TOKEN as a bearer token.
+    """
+    supplied = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(supplied, f"Bearer {settings.ADMIN_TOKEN}"):
+        raise web.HTTPUnauthorized()
+    job_id = request.match_info["job_id"]
+    if not _JOB_ID.match(job_id):
+        raise web.HTTPNotFound()
+
+    try:
+        result = await regenerate_report(job_id, pdf=request.query.get("pdf") == "1")
+    except ValueError as e:
+        raise web.HTTPUnprocessableEntity(text=str(e))
+    if result is None:
+        raise web.HTTPNotFound(text="No stored analysis for this job")
+
+    return web.json_response({
+        "job_id": result.job_id,
+        "html_url": report_url(result.html_path),
+        "pdf_url": report_url(result.pdf_path or settings.REPORT_DIR / f"{job_id}.pdf"),
+        "seconds": round(result.seconds, 3),
+    })
+
+
+def setup_admin_routes(app: web.Application) -> None:
+    # Only exposed when a token is configured
+    if settings.ADMIN_TOKEN:
+        app.router.add_post("/admin/reports/{job_id}/regenerate", regenerate_endpoint)
@@ -0,0 +1,37 @@
+import hmac
+
+from aiohttp import web
+
+from app.config import settings
+from app.utils import metrics
+from app.utils.loop_monitor import loop_watchdog
+
+
+async def debug_dump(request: web.Request) -> web.Response:
+    """
+    GET /debug/loop?token=...
+
+    Rolling dump of event-loop health: lag and handler timing summaries, update
+    queue depth and the most recent stalls with the stack that was blocking.
+    """
+    token = request.query.get("token", "")
+    if not hmac.compare_digest(token, settings.DEBUG_DUMP_TOKEN or ""):
+        raise web.HTTPNotFound()
+
+    return web.json_response({
+        "event_loop": {
+            "lag": metrics.EVENT_LOOP_LAG_SECONDS.summary(),
+            "blocked_total": metrics.EVENT_LOOP_BLOCKED.value(),
+            "recent_stalls": loop_watchdog.recent(),
+        },
+        "handlers": metrics.HANDLER_SECONDS.summary(),
+        "cpu_tasks": metrics.CPU_TASK_SECONDS.summary(),
+        "updates_in_flight": metrics.UPDATES_IN_FLIGHT.value(),
+        "telegram_pending_updates": metrics.TELEGRAM_PENDING_UPDATES.value(),
+    })
+
+
+def setup_debug_routes(app: web.Application) -> None:
+    # Only exposed when a token is configured
+    if settings.DEBUG_DUMP_TOKEN:
+        app.router.add_get("/debug/loop", debug_dump)
@@ -0,0 +1,68 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.types import TelegramObject
+
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class UpdatesInFlightMiddleware(BaseMiddleware):
+    """Outer update middleware: tracks how many updates are being processed at once."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        metrics.UPDATES_IN_FLIGHT.inc()
+        try:
+            return await handler(event, data)
+        finally:
+            metrics.UPDATES_IN_FLIGHT.dec()
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Inner middleware: times each matched handler, labelled with its function name."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.monotonic()
+        try:
+            return await handler(event, data)
+        except Exception:
+            metrics.HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            metrics.HANDLER_SECONDS.observe(time.monotonic() - started, handler=name)
+
+
+def setup_instrumentation(dp: Dispatcher) -> None:
+    """Register the timing middlewares; inner ones on the dispatcher cover every included router."""
+    dp.update.outer_middleware(UpdatesInFlightMiddleware())
+    dp.message.middleware(HandlerTimingMiddleware())
+    dp.callback_query.middleware(HandlerTimingMiddleware())
+
+
+async def poll_pending_updates(bot: Bot, interval: float = 30) -> None:
+    """Record Telegram's webhook queue depth (updates not yet delivered to us)."""
+    while True:
+        try:
+            info = await bot.get_webhook_info()
+            metrics.TELEGRAM_PENDING_UPDATES.set(info.pending_update_count)
+            if info.last_error_message:
+                logger.debug(f"Webhook last error: {info.last_error_message}")
+        except Exception as e:
+            logger.warning(f"Could not fetch webhook info: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,42 @@
+import hmac
+import logging
+
+from aiohttp import web
+
+from app.config import settings
+from app.services import worker_metrics
+from app.utils.metrics import render_prometheus
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+async def metrics_endpoint(request: web.Request) -> web.Response:
+    """
+    GET /metrics
+
+    Prometheus scrape target. When METRICS_TOKEN is set the scraper has to send it
+    as a bearer token (Prometheus `authorization` / `bearer_token` config). With
+    WORKERS > 0 the analysis workers' metrics are included.
+    """
+    if settings.METRICS_TOKEN:
+        supplied = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(supplied, f"Bearer {settings.METRICS_TOKEN}"):
+            raise web.HTTPUnauthorized()
+
+    # Analysis workers keep their own registries; their published snapshots add in
+    snapshots = []
+    if settings.WORKERS:
+        try:
+            snapshots = await worker_metrics.collect(settings.INSTANCE_ID)
+        except Exception as e:
+            logger.warning(f"Could not read worker metrics: {e}")
+    response = web.Response(body=render_prometheus(snapshots).encode("utf-8"))
+    response.headers["Content-Type"] = CONTENT_TYPE
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+def setup_metrics_routes(app: web.Application) -> None:
+    app.router.add_get("/metrics", metrics_endpoint)
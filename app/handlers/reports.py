@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import re
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from aiohttp import web
+
+from app.config import settings
+from app.services.render import render_pdf_file
+from app.utils import metrics
+from app.utils.signing import verify_report_signature
+
+logger = logging.getLogger(__name__)
+
+# Only report documents are served; .meta files and raw model output stay private
+_REPORT_NAME = re.compile(r"^[\w-]+(?:\.pdf|_report\.html)$")
+
+# report id -> in-flight render, so concurrent requests share one WeasyPrint run
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+def _read_expiry(path: Path) -> Optional[float]:
+    """Expiration timestamp from the `.meta` file next to `path`, if any."""
+    try:
+        return float(Path(f"{path}.meta").read_text().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def _is_expired(path: Path) -> bool:
+    expiry = _read_expiry(path)
+    return expiry is not None and time.time() > expiry
+
+
+async def _render_once(report_id: str, html_path: Path, pdf_path: Path) -> None:
+    """Render the PDF for a report, joining an already running render if there is one."""
+    future = _inflight.get(report_id)
+    if future is None:
+        future = asyncio.ensure_future(_render_and_record(html_path, pdf_path))
+        _inflight[report_id] = future
+        future.add_done_callback(lambda _: _inflight.pop(report_id, None))
+    # Shield so a client disconnect doesn't cancel the render for everyone else
+    await asyncio.shield(future)
+
+
+async def _render_and_record(html_path: Path, pdf_path: Path) -> None:
+    logger.info(f"Rendering PDF on first request: {pdf_path.name}")
+    started = time.monotonic()
+    with metrics.PIPELINE_STAGE_SECONDS.time(stage="pdf_render"):
+        await render_pdf_file(html_path, pdf_path)
+
+    # The cached PDF expires together with the report it was rendered from
+    expiry = _read_expiry(html_path)
+    if expiry is None:
+        expiry = time.time() + settings.REPORT_RETENTION_HOURS * 3600
+    Path(f"{pdf_path}.meta").write_text(str(expiry))
+    logger.info(f"PDF {pdf_path.name} rendered in {time.monotonic() - started:.1f}s")
+
+
+def _file_response(path: Path) -> web.FileResponse:
+    # FileResponse handles ETag/Last-Modified validators, Range requests, sendfile
+    # and picks the precompressed .br/.gz sibling matching Accept-Encoding.
+    # A report can be regenerated under the same URL, so browsers revalidate every
+    # time; an unchanged report costs a 304 against the ETag.
+    return web.FileResponse(path, headers={"Cache-Control": "private, no-cache"})
+
+
+async def serve_report(request: web.Request) -> web.StreamResponse:
+    """
+    GET /reports/{name}?exp=...&sig=...
+
+    Links are HMAC-signed and expire with the report. PDFs are rendered lazily
+    from the stored `<id>_report.html` on first request and served from disk
+    afterwards. HTML reports are served as they are.
+    """
+    name = request.match_info["name"]
+    if not _REPORT_NAME.match(name):
+        raise web.HTTPNotFound()
+    if not verify_report_signature(name, request.query.get("exp"), request.query.get("sig")):
+        raise web.HTTPForbidden()
+
+    path = settings.REPORT_DIR / name
+    if name.endswith(".pdf"):
+        report_id = name[: -len(".pdf")]
+        html_path = settings.REPORT_DIR / f"{report_id}_report.html"
+        if path.exists():
+            metrics.CACHE_REQUESTS.inc(cache="report_pdf", result="hit")
+        else:
+            if not html_path.exists() or _is_expired(html_path):
+                raise web.HTTPNotFound()
+            metrics.CACHE_REQUESTS.inc(cache="report_pdf", result="miss")
+            try:
+                await _render_once(report_id, html_path, path)
+            except Exception as e:
+                logger.exception(f"On-demand PDF render failed for {report_id}: {e}")
+                # The HTML version is still a complete report
+                return _file_response(html_path)
+
+    if not path.exists() or _is_expired(path):
+        raise web.HTTPNotFound()
+    return _file_response(path)
+
+
+def setup_report_routes(app: web.Application) -> None:
+    app.router.add_get("/reports/{name}", serve_report, name="reports")
@@ -0,0 +1,279 @@
+import hashlib
+import json
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from app.utils import db
+from app.utils.executor import run_in_thread
+
+# Primary analysis results of a job, saved chunk by chunk as they arrive, so a
+# retry or a restart only sends the chunks that are missing and the meta stage
+# can run again from stored results. `analysis_jobs` keeps the upload message
+# (to re-run the job), the execution plan of its first run (so a re-run chunks
+# the chat the same way and the stored results still apply), once primary
+# analysis is done its totals and merged results (failed and aggregate-only
+# chunks included, which chunk_results leaves out so a re-run retries them),
+# and once the meta stage is done its raw output, from which the report can be
+# rendered again.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS analysis_jobs (
+    job_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    chunks INTEGER,
+    total_messages INTEGER,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chunk_results (
+    job_id TEXT NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    chunk_sha256 TEXT NOT NULL,
+    result TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (job_id, chunk_index)
+);
+"""
+
+
+@dataclass
+class AnalysisJob:
+    job_id: str
+    user_id: str
+    chat_id: int
+    message: str  # the upload's Telegram message as JSON
+    chunks: Optional[int]
+    total_messages: Optional[int]
+    created_at: float
+    updated_at: float
+    meta_content: Optional[str] = None
+    sample_note: Optional[str] = None
+    report_notes: Optional[str] = None  # JSON list
+    chunk_size: Optional[int] = None
+    primary_model: Optional[str] = None
+    meta_sample_size: Optional[int] = None
+    primary_results: Optional[str] = None  # JSON list
+
+
+@dataclass
+class StoredChunk:
+    chunk_sha256: str
+    result: List[Dict[str, Any]]
+    tokens: int
+
+
+@dataclass
+class PrimaryAnalysis:
+    """Everything the meta stage needs, without the upload."""
+
+    results: List[Dict[str, Any]]
+    total_messages: int
+    chunks: int
+
+
+@dataclass
+class StoredAnalysis:
+    """Everything a report is rendered from: primary results plus the meta model's output."""
+
+    primary: PrimaryAnalysis
+    meta_content: str
+    sample_note: Optional[str]
+    notes: List[str]
+
+
+def chunk_digest(chunk: List[Dict[str, Any]]) -> str:
+    """Hash of a chunk's text: a stored result is reused only for the very same chunk."""
+    return hashlib.sha256("\n\n".join(m["raw"] for m in chunk).encode("utf-8")).hexdigest()
+
+
+def _ensure_schema() -> None:
+    db.state_db.ensure_schema(_SCHEMA)
+    db.state_db.ensure_column("analysis_jobs", "meta_content", "TEXT")
+    db.state_db.ensure_column("analysis_jobs", "sample_note", "TEXT")
+    db.state_db.ensure_column("analysis_jobs", "report_notes", "TEXT")
+    db.state_db.ensure_column("analysis_jobs", "chunk_size", "INTEGER")
+    db.state_db.ensure_column("analysis_jobs", "primary_model", "TEXT")
+    db.state_db.ensure_column("analysis_jobs", "meta_sample_size", "INTEGER")
+    db.state_db.ensure_column("analysis_jobs", "primary_results", "TEXT")
+
+
+def _start_job(job_id: str, user_id: str, chat_id: int, message: str) -> None:
+    _ensure_schema()
+    now = time.time()
+    db.state_db.execute(
+        "INSERT INTO analysis_jobs (job_id, user_id, chat_id, message, created_at, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(job_id) DO UPDATE SET updated_at = excluded.updated_at",
+        (job_id, user_id, chat_id, message, now, now),
+    )
+
+
+def _save_chunk(job_id: str, index: int, digest: str, result: List[Dict[str, Any]], tokens: int) -> None:
+    _ensure_schema()
+    db.state_db.execute(
+        "INSERT OR REPLACE INTO chunk_results VALUES (?, ?, ?, ?, ?, ?)",
+        (job_id, index, digest, json.dumps(result, ensure_ascii=False), tokens, time.time()),
+    )
+
+
+def _load_chunks(job_id: str) -> Dict[int, StoredChunk]:
+    _ensure_schema()
+    rows = db.state_db.query(
+        "SELECT chunk_index, chunk_sha256, result, tokens FROM chunk_results WHERE job_id = ?", (job_id,)
+    )
+    return {
+        row["chunk_index"]: StoredChunk(row["chunk_sha256"], json.loads(row["result"]), row["tokens"])
+        for row in rows
+    }
+
+
+def _record_plan(job_id: str, chunk_size: int, primary_model: str, meta_sample_size: int) -> None:
+    _ensure_schema()
+    db.state_db.execute(
+        "UPDATE analysis_jobs SET chunk_size = ?, primary_model = ?, meta_sample_size = ?, updated_at = ? "
+        "WHERE job_id = ?",
+        (chunk_size, primary_model, meta_sample_size, time.time(), job_id),
+    )
+
+
+def _record_primary(
+    job_id: str, chunks: int, total_messages: int, results: Optional[List[Dict[str, Any]]]
+) -> None:
+    _ensure_schema()
+    db.state_db.execute(
+        "UPDATE analysis_jobs SET chunks = ?, total_messages = ?, primary_results = ?, updated_at = ? WHERE job_id = ?",
+        (
+            chunks,
+            total_messages,
+            json.dumps(results, ensure_ascii=False) if results is not None else None,
+            time.time(),
+            job_id,
+        ),
+    )
+    # Chunks of an earlier, differently chunked run of the job are not part of this one
+    db.state_db.execute("DELETE FROM chunk_results WHERE job_id = ? AND chunk_index >= ?", (job_id, chunks))
+
+
+def _record_meta(job_id: str, meta_content: str, sample_note: Optional[str], notes: List[str]) -> None:
+    _ensure_schema()
+    db.state_db.execute(
+        "UPDATE analysis_jobs SET meta_content = ?, sample_note = ?, report_notes = ?, updated_at = ? WHERE job_id = ?",
+        (meta_content, sample_note, json.dumps(notes, ensure_ascii=False), time.time(), job_id),
+    )
+
+
+def _rendered_jobs() -> List[str]:
+    _ensure_schema()
+    rows = db.state_db.query(
+        "SELECT job_id FROM analysis_jobs WHERE meta_content IS NOT NULL ORDER BY updated_at"
+    )
+    return [row["job_id"] for row in rows]
+
+
+def _get_job(job_id: str) -> Optional[AnalysisJob]:
+    _ensure_schema()
+    rows = db.state_db.query("SELECT * FROM analysis_jobs WHERE job_id = ?", (job_id,))
+    return AnalysisJob(**dict(rows[0])) if rows else None
+
+
+def _delete(job_id: str) -> None:
+    _ensure_schema()
+    with db.state_db.transaction() as conn:
+        conn.execute("DELETE FROM chunk_results WHERE job_id = ?", (job_id,))
+        conn.execute("DELETE FROM analysis_jobs WHERE job_id = ?", (job_id,))
+
+
+def _prune(before: float) -> int:
+    _ensure_schema()
+    with db.state_db.transaction() as conn:
+        conn.execute(
+            "DELETE FROM chunk_results WHERE job_id IN (SELECT job_id FROM analysis_jobs WHERE updated_at < ?)",
+            (before,),
+        )
+        return conn.execute("DELETE FROM analysis_jobs WHERE updated_at < ?", (before,)).rowcount
+
+
+async def start_job(job_id: str, user_id: str, chat_id: int, message: str) -> None:
+    """Record the job's upload message, so the job can be retried or resumed later."""
+    await db.state_db.run(_start_job, job_id, user_id, chat_id, message)
+
+
+async def save_chunk(job_id: str, index: int, digest: str, result: List[Dict[str, Any]], tokens: int) -> None:
+    await db.state_db.run(_save_chunk, job_id, index, digest, result, tokens)
+
+
+async def load_chunks(job_id: str) -> Dict[int, StoredChunk]:
+    """Chunk results saved by earlier runs of the job, by chunk index."""
+    return await db.state_db.run(_load_chunks, job_id)
+
+
+async def record_plan(job_id: str, chunk_size: int, primary_model: str, meta_sample_size: int) -> None:
+    """The plan the job was first run with; re-runs of the job keep it."""
+    await db.state_db.run(_record_plan, job_id, chunk_size, primary_model, meta_sample_size)
+
+
+async def record_primary(
+    job_id: str, chunks: int, total_messages: int, results: Optional[List[Dict[str, Any]]] = None
+) -> None:
+    """Primary analysis of the job went through every chunk; `results` is what the meta stage gets."""
+    await db.state_db.run(_record_primary, job_id, chunks, total_messages, results)
+
+
+async def record_meta(job_id: str, meta_content: str, sample_note: Optional[str], notes: List[str]) -> None:
+    """The meta stage's raw output and the notes shown in the report, for rendering it again."""
+    await db.state_db.run(_record_meta, job_id, meta_content, sample_note, notes)
+
+
+async def rendered_jobs() -> List[str]:
+    """Jobs with everything stored to render their report again, oldest first."""
+    return await db.state_db.run(_rendered_jobs)
+
+
+async def get_job(job_id: str) -> Optional[AnalysisJob]:
+    return await db.state_db.run(_get_job, job_id)
+
+
+async def load_primary(job_id: str) -> Optional[PrimaryAnalysis]:
+    """
+    The job's primary results as the meta stage got them. Without recorded
+    results (jobs recorded before they were stored), they are put together from
+    the chunk results, if every chunk of the job is stored.
+    """
+    job = await get_job(job_id)
+    if job is None or job.chunks is None:
+        return None
+    if job.primary_results is not None:
+        results = await run_in_thread(json.loads, job.primary_results)
+        return PrimaryAnalysis(results=results, total_messages=job.total_messages, chunks=job.chunks)
+    stored = await load_chunks(job_id)
+    if any(index not in stored for index in range(job.chunks)):
+        return None
+    results = [item for index in range(job.chunks) for item in stored[index].result]
+    return PrimaryAnalysis(results=results, total_messages=job.total_messages, chunks=job.chunks)
+
+
+async def load_analysis(job_id: str) -> Optional[StoredAnalysis]:
+    """Primary results and meta output of the job, if both are stored."""
+    job = await get_job(job_id)
+    if job is None or job.meta_content is None:
+        return None
+    primary = await load_primary(job_id)
+    if primary is None:
+        return None
+    return StoredAnalysis(
+        primary=primary,
+        meta_content=job.meta_content,
+        sample_note=job.sample_note,
+        notes=json.loads(job.report_notes or "[]"),
+    )
+
+
+async def delete(job_id: str) -> None:
+    await db.state_db.run(_delete, job_id)
+
+
+async def prune(older_than_hours: float) -> int:
+    """Drop checkpoints of jobs not touched for the given time; returns how many jobs went."""
+    return await db.state_db.run(_prune, time.time() - older_than_hours * 3600)
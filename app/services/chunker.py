@@ -2,7 +2,7 @@ import logging
 import re
 import os
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import IO, List, Dict, Any, Optional, Union
 from bs4 import BeautifulSoup
 import time  # added for timing logs
 
@@ -13,6 +13,27 @@ logger = logging.getLogger(__name__)
 # Adjust to a smaller chunk size to avoid rate limits
 MAX_MESSAGES_PER_CHUNK = 25  # Reduced from previous value
 
+# A chat export on disk, already in memory, or an open (binary or text) stream
+ChatSource = Union[str, Path, bytes, IO]
+
+
+def read_chat_text(source: ChatSource) -> str:
+    """
+    Return the text of a chat export, whatever form it arrives in.
+
+    Args:
+        source: File path, raw bytes, or a readable stream
+
+    Returns:
+        The decoded UTF-8 text
+    """
+    if isinstance(source, (str, Path)):
+        with open(source, "r", encoding="utf-8") as f:
+            return f.read()
+    data = source if isinstance(source, (bytes, bytearray)) else source.read()
+    return data.decode("utf-8") if isinstance(data, (bytes, bytearray)) else data
+
+
 def extract_message_parts(line: str) -> Dict[str, str]:
     """
     Extract author, timestamp, and content from a single line of chat.
@@ -62,20 +83,19 @@ def extract_message_parts(line: str) -> Dict[str, str]:
     # No pattern matched, return the original line as content
     return parts
 
-def extract_messages_from_html(file_path: Path) -> List[Dict[str, Any]]:
+def extract_messages_from_html(source: ChatSource) -> List[Dict[str, Any]]:
     """
     Extract messages from a WhatsApp HTML export.
     
     Args:
-        file_path: Path to the HTML chat file
+        source: Path, bytes or stream of the HTML chat file
         
     Returns:
         List of message dictionaries
     """
     try:
         messages = []
-        with open(file_path, "r", encoding="utf-8") as f:
-            html_content = f.read()
+        html_content = read_chat_text(source)
         
         soup = BeautifulSoup(html_content, 'html.parser')
         
@@ -183,22 +203,21 @@ def extract_messages_from_html(file_path: Path) -> List[Dict[str, Any]]:
         logger.error(f"Error extracting messages from HTML: {e}")
         raise
 
-def extract_messages_from_text(file_path: Path) -> List[Dict[str, Any]]:
+def extract_messages_from_text(source: ChatSource) -> List[Dict[str, Any]]:
     """
-    Extract messages from a plain text chat file.
+    Extract messages from a plain text chat file (path, bytes or stream).
     
     Added extra timing / diagnostic logging because this step was
     suspected to hang in production.  The new logs clearly mark the
     start, end and message count as well as elapsed seconds.
     """
 
-    logger.info(f"→ START extract_messages_from_text ({file_path})")
+    logger.info(f"→ START extract_messages_from_text ({source if isinstance(source, (str, Path)) else type(source).__name__})")
     _ts_start = time.time()
 
     try:
         # --- Fast line-by-line parsing first to avoid catastrophic regex backtracking ---
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
+        content = read_chat_text(source)
 
         messages: List[Dict[str, Any]] = []
 
@@ -272,25 +291,28 @@ def extract_messages_from_text(file_path: Path) -> List[Dict[str, Any]]:
         logger.exception("extract_messages_from_text FAILED")
         raise
 
-def extract_messages(file_path: Path) -> List[Dict[str, Any]]:
+def extract_messages(source: ChatSource, file_name: Optional[str] = None) -> List[Dict[str, Any]]:
     """
     Extract messages from a chat file (text or HTML).
     
     Args:
-        file_path: Path to the chat file
+        source: Path to the chat file, or its bytes / a stream
+        file_name: Name whose extension tells the format; defaults to the path
         
     Returns:
         List of message dictionaries
     """
     # Determine file type based on extension
-    file_extension = file_path.suffix.lower()
+    if file_name is None:
+        file_name = str(source) if isinstance(source, (str, Path)) else ""
+    file_extension = Path(file_name).suffix.lower()
     
     if file_extension == '.html' or file_extension == '.htm':
-        logger.info(f"Processing HTML file: {file_path}")
-        return extract_messages_from_html(file_path)
+        logger.info(f"Processing HTML file: {file_name}")
+        return extract_messages_from_html(source)
     else:
-        logger.info(f"Processing plain text file: {file_path}")
-        return extract_messages_from_text(file_path)
+        logger.info(f"Processing plain text file: {file_name or type(source).__name__}")
+        return extract_messages_from_text(source)
 
 def count_tokens(text: str) -> int:
     """
@@ -305,21 +327,39 @@ def count_tokens(text: str) -> int:
     # Roughly 1.3 tokens per word for English, might be different for other languages
     return int(len(text.split()) * 1.3)
 
-def split_chat(file_path: Path) -> List[List[Dict[str, Any]]]:
+def split_chat(source: ChatSource, file_name: Optional[str] = None) -> List[List[Dict[str, Any]]]:
     """
     Split a chat file into chunks.
     
     Args:
-        file_path: Path to the chat file
+        source: Path to the chat file, or its bytes / a stream
+        file_name: Name whose extension tells the format; defaults to the path
         
     Returns:
         List of chunks, where each chunk is a list of message dictionaries
     """
-    messages = extract_messages(file_path)
-    
+    return chunk_messages(extract_messages(source, file_name))
+
+
+def chunk_messages(
+    messages: List[Dict[str, Any]], max_messages: Optional[int] = None
+) -> List[List[Dict[str, Any]]]:
+    """
+    Group parsed messages into chunks that fit the primary analysis prompt.
+
+    Args:
+        messages: Message dictionaries from extract_messages
+        max_messages: Messages per chunk chosen by the planner; without it the
+            size falls back to the large-chat threshold below
+
+    Returns:
+        List of chunks, where each chunk is a list of message dictionaries
+    """
     # Check if we need to use a more aggressive chunking strategy
     # for very large chats (over 1000 messages)
-    if len(messages) > 1000:
+    if max_messages:
+        actual_chunk_size = max_messages
+    elif len(messages) > 1000:
         logger.warning(f"Very large chat detected ({len(messages)} messages). Using aggressive chunking.")
         # For large chats, use even smaller chunks
         actual_chunk_size = min(MAX_MESSAGES_PER_CHUNK, 15)
@@ -0,0 +1,201 @@
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.config import settings
+from app.utils import db, metrics
+
+logger = logging.getLogger(__name__)
+
+# One row per OpenAI call. Job and user come from the job context, so the LLM
+# helpers only need to say which stage they are.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_usage (
+    id INTEGER PRIMARY KEY,
+    at REAL NOT NULL,
+    job_id TEXT,
+    user_id TEXT,
+    stage TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    cached_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    cost_usd REAL NOT NULL,
+    seconds REAL
+);
+CREATE INDEX IF NOT EXISTS llm_usage_job ON llm_usage (job_id);
+CREATE INDEX IF NOT EXISTS llm_usage_user_at ON llm_usage (user_id, at);
+CREATE INDEX IF NOT EXISTS llm_usage_stage_at ON llm_usage (stage, at);
+"""
+
+
+def _ensure_schema() -> None:
+    db.state_db.ensure_schema(_SCHEMA)
+    # Ledgers created before call latency was recorded
+    db.state_db.ensure_column("llm_usage", "seconds", "REAL")
+
+_current_job: contextvars.ContextVar[Tuple[Optional[str], Optional[str]]] = contextvars.ContextVar(
+    "cost_ledger_job", default=(None, None)
+)
+
+
+@dataclass
+class UsageTotals:
+    calls: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+    cost_usd: float = 0.0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+def bind_job(job_id: str, user_id: str) -> None:
+    """
+    Attribute every call made from the current task, and tasks it starts, to this
+    job. Each Telegram update is handled in its own task, so nothing leaks between jobs.
+    """
+    _current_job.set((job_id, user_id))
+
+
+@contextmanager
+def job_context(job_id: str, user_id: str) -> Iterator[None]:
+    """Attribute every call made inside the block (and tasks it starts) to this job."""
+    token = _current_job.set((job_id, user_id))
+    try:
+        yield
+    finally:
+        _current_job.reset(token)
+
+
+def model_prices(model: str) -> Dict[str, float]:
+    """Input/output price per 1K tokens for `model`, by longest matching prefix."""
+    table = {
+        "gpt-3.5": {"input": settings.COST_PER_1K_TOKENS_GPT35_TURBO, "output": settings.COST_PER_1K_TOKENS_GPT35_TURBO},
+        "gpt-4": {"input": settings.COST_PER_1K_TOKENS_GPT4_TURBO_INPUT, "output": settings.COST_PER_1K_TOKENS_GPT4_TURBO_OUTPUT},
+        **settings.MODEL_PRICES_PER_1K,
+    }
+    matches = [prefix for prefix in table if model.startswith(prefix)]
+    if not matches:
+        logger.warning(f"No price configured for model {model}; recording zero cost")
+        return {"input": 0.0, "output": 0.0}
+    return table[max(matches, key=len)]
+
+
+def usage_cost(model: str, prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> float:
+    prices = model_prices(model)
+    cached_price = prices.get("cached_input", prices["input"] * settings.CACHED_INPUT_PRICE_RATIO)
+    return (
+        (prompt_tokens - cached_tokens) * prices["input"]
+        + cached_tokens * cached_price
+        + completion_tokens * prices["output"]
+    ) / 1000
+
+
+def _insert(row: Tuple[Any, ...]) -> None:
+    _ensure_schema()
+    db.state_db.execute(
+        "INSERT INTO llm_usage (at, job_id, user_id, stage, model, prompt_tokens, cached_tokens, completion_tokens, cost_usd, seconds) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        row,
+    )
+
+
+async def record_usage(usage: Any, model: str, stage: str, seconds: Optional[float] = None) -> int:
+    """
+    Store the `usage` block of one completion and return its total tokens.
+    Cached prompt tokens come from `prompt_tokens_details` when the API reports them;
+    `seconds` is the call's wall-clock time, which the planner learns throughput from.
+    """
+    if usage is None:
+        return 0
+    prompt_tokens = usage.prompt_tokens or 0
+    completion_tokens = usage.completion_tokens or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = (getattr(details, "cached_tokens", None) or 0) if details else 0
+    cost = usage_cost(model, prompt_tokens, cached_tokens, completion_tokens)
+
+    metrics.LLM_TOKENS.inc(prompt_tokens - cached_tokens, model=model, kind="prompt")
+    metrics.LLM_TOKENS.inc(cached_tokens, model=model, kind="cached")
+    metrics.LLM_TOKENS.inc(completion_tokens, model=model, kind="completion")
+
+    if settings.ENABLE_COST_TRACKING:
+        job_id, user_id = _current_job.get()
+        row = (time.time(), job_id, user_id, stage, model, prompt_tokens, cached_tokens, completion_tokens, cost, seconds)
+        try:
+            await db.state_db.run(_insert, row)
+        except Exception as e:
+            # Accounting must never fail the analysis itself
+            logger.error(f"Could not record LLM usage: {e}")
+    return prompt_tokens + completion_tokens
+
+
+def _totals(where: str, params: Tuple[Any, ...], group_by: Optional[str] = None) -> Any:
+    _ensure_schema()
+    select = (
+        "COUNT(*) AS calls, COALESCE(SUM(prompt_tokens), 0) AS prompt_tokens, "
+        "COALESCE(SUM(cached_tokens), 0) AS cached_tokens, "
+        "COALESCE(SUM(completion_tokens), 0) AS completion_tokens, COALESCE(SUM(cost_usd), 0) AS cost_usd"
+    )
+    if group_by is None:
+        row = db.state_db.query(f"SELECT {select} FROM llm_usage WHERE {where}", params)[0]
+        return UsageTotals(**dict(row))
+    rows = db.state_db.query(
+        f"SELECT {group_by} AS grp, {select} FROM llm_usage WHERE {where} GROUP BY {group_by} ORDER BY cost_usd DESC",
+        params,
+    )
+    return {row["grp"]: UsageTotals(**{k: row[k] for k in row.keys() if k != "grp"}) for row in rows}
+
+
+async def job_totals(job_id: str) -> UsageTotals:
+    return await db.state_db.run(_totals, "job_id = ?", (job_id,))
+
+
+async def job_stage_totals(job_id: str) -> Dict[str, UsageTotals]:
+    return await db.state_db.run(_totals, "job_id = ?", (job_id,), "stage")
+
+
+async def user_totals(user_id: str, since: float = 0) -> UsageTotals:
+    return await db.state_db.run(_totals, "user_id = ? AND at >= ?", (user_id, since))
+
+
+async def stage_totals(since: float = 0) -> Dict[str, UsageTotals]:
+    """Spend per stage across all jobs, e.g. to see what chunk sizes cost."""
+    return await db.state_db.run(_totals, "at >= ?", (since,), "stage")
+
+
+async def model_totals(since: float = 0) -> Dict[str, UsageTotals]:
+    return await db.state_db.run(_totals, "at >= ?", (since,), "model")
+
+
+def recent_jobs(limit: int = 50) -> List[Dict[str, Any]]:
+    """Per-job unit economics (tokens and cost per job), newest first."""
+    _ensure_schema()
+    rows = db.state_db.query(
+        "SELECT job_id, user_id, MIN(at) AS started, COUNT(*) AS calls, SUM(prompt_tokens) AS prompt_tokens, "
+        "SUM(completion_tokens) AS completion_tokens, SUM(cost_usd) AS cost_usd "
+        "FROM llm_usage WHERE job_id IS NOT NULL GROUP BY job_id ORDER BY started DESC LIMIT ?",
+        (limit,),
+    )
+    return [dict(row) for row in rows]
+
+
+def _throughput(model: str, stage: str, since: float) -> Optional[Dict[str, float]]:
+    _ensure_schema()
+    row = db.state_db.query(
+        "SELECT COUNT(*) AS calls, AVG(seconds) AS seconds, AVG(prompt_tokens) AS prompt_tokens, "
+        "AVG(completion_tokens) AS completion_tokens FROM llm_usage "
+        "WHERE stage = ? AND model LIKE ? AND at >= ? AND seconds IS NOT NULL",
+        (stage, f"{model}%", since),
+    )[0]
+    return dict(row) if row["calls"] else None
+
+
+async def throughput(model: str, stage: str, since: float = 0) -> Optional[Dict[str, float]]:
+    """Observed calls, mean seconds and mean prompt/completion tokens per call, if any."""
+    return await db.state_db.run(_throughput, model, stage, since)
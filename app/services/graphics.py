@@ -47,7 +47,7 @@ def generate_sentiment_timeline_svg(timeline: List[Dict[str, Any]], width: int =
             val = max(0, min(1, val))
             x = padding + idx * x_step
             y = padding + chart_h * (1 - val)
-            points.append(f"{x:.2f},{y:.2f}")
+            points.append(f"{x:.1f},{y:.1f}")
         polyline = f'<polyline fill="none" stroke="{palette[author]}" stroke-width="2" points="{" ".join(points)}" />'
         polylines.append(polyline)
 
@@ -99,14 +99,15 @@ def generate_radar_chart_svg(metrics_summary: Dict[str, Dict[str, float]], width
 
     # Axis lines & labels
     axes = []
+    axis_labels = []
     for i, metric in enumerate(metrics):
         angle = i * angle_step - math.pi / 2  # start at top
         x = cx + radius * math.cos(angle)
         y = cy + radius * math.sin(angle)
-        axes.append(f'<line x1="{cx}" y1="{cy}" x2="{x}" y2="{y}" stroke="#ccc" />')
+        axes.append(f'<line x1="{cx:g}" y1="{cy:g}" x2="{x:.1f}" y2="{y:.1f}" stroke="#ccc" />')
         lx = cx + (radius + 15) * math.cos(angle)
         ly = cy + (radius + 15) * math.sin(angle)
-        axes.append(f'<text x="{lx}" y="{ly}" font-size="12" font-family="Arial" text-anchor="middle">{metric}</text>')
+        axis_labels.append(f'<text x="{lx:.1f}" y="{ly:.1f}" font-size="12" font-family="Arial" text-anchor="middle">{metric}</text>')
 
     # Polygons for each author
     polys = []
@@ -119,13 +120,14 @@ def generate_radar_chart_svg(metrics_summary: Dict[str, Dict[str, float]], width
             angle = i * angle_step - math.pi / 2
             x = cx + r * math.cos(angle)
             y = cy + r * math.sin(angle)
-            points.append(f"{x:.2f},{y:.2f}")
+            points.append(f"{x:.1f},{y:.1f}")
         polys.append(f'<polygon points="{" ".join(points)}" fill="{palette[author]}33" stroke="{palette[author]}" stroke-width="1" />')
 
     svg = f"""
     <svg id="chart-2" width="{width}" height="{height}" viewBox="0 0 {width} {height}" xmlns="http://www.w3.org/2000/svg">
         <rect width="100%" height="100%" fill="#ffffff" />
         {"".join(axes)}
+        {"".join(axis_labels)}
         {"".join(polys)}
     </svg>
     """
@@ -147,8 +149,8 @@ def generate_bar_chart_svg(data: Dict[str, float], title: str, width: int = 600,
         h = (val / max_val) * (height - 60)
         y = height - 40 - h
         colour = COLOURS[i % len(COLOURS)]
-        bars.append(f'<rect x="{x}" y="{y}" width="{bar_w * 0.6}" height="{h}" fill="{colour}" />')
-        labels.append(f'<text x="{x + bar_w * 0.3}" y="{height - 20}" font-size="12" text-anchor="middle">{label}</text>')
+        bars.append(f'<rect x="{x:.1f}" y="{y:.1f}" width="{bar_w * 0.6:.1f}" height="{h:.1f}" fill="{colour}" />')
+        labels.append(f'<text x="{x + bar_w * 0.3:.1f}" y="{height - 20}" font-size="12" text-anchor="middle">{label}</text>')
 
     svg = f"""
     <svg id="{chart_id}" width="{width}" height="{height}" viewBox="0 0 {width} {height}" xmlns="http://www.w3.org/2000/svg">
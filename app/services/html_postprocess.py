@@ -0,0 +1,255 @@
+import logging
+import re
+from html import escape
+from html.parser import HTMLParser
+from typing import List, Optional, Tuple
+
+from app.services.insights import ReportInsights
+
+logger = logging.getLogger(__name__)
+
+_VIEWPORT_META = '<meta name="viewport" content="width=device-width, initial-scale=1.0">'
+_NO_CHART = "<p><i>(Визуализация для этого раздела не была сгенерирована.)</i></p>"
+
+# h2 headings whose first paragraph goes into the Telegram summary
+_INSIGHT_HEADINGS = [
+    ("overview", re.compile("Общий обзор", re.IGNORECASE)),
+    ("patterns", re.compile("Паттерны общения", re.IGNORECASE)),
+    ("emotions", re.compile("Анализ эмоций", re.IGNORECASE)),
+    ("recommendations", re.compile("Рекомендации", re.IGNORECASE)),
+]
+
+
+def _has_class(attrs, name: str) -> bool:
+    for key, value in attrs:
+        if key == "class" and value and name in value.split():
+            return True
+    return False
+
+
+class _ReportTransformer(HTMLParser):
+    """
+    Streams over the report once: re-serialises every token, applies the head/body
+    injections and chart placeholder replacement, and records the Telegram insight
+    fields along the way.
+    """
+
+    def __init__(self, head_html: str = "", body_html: str = "", charts: Optional[List[str]] = None):
+        super().__init__(convert_charrefs=True)
+        self.head_html = head_html
+        self.body_html = body_html
+        self.charts = list(charts or [])
+        self.insights = ReportInsights()
+
+        self.out: List[str] = []
+        self.started = False        # saw <!DOCTYPE> or <html>
+        self.head_done = False
+        self.body_done = False
+        self.in_head = False
+        self.has_viewport = False
+
+        self.placeholder_depth = 0  # >0 while skipping a chart placeholder <p>
+
+        # Insight extraction state
+        self.h2_text: Optional[List[str]] = None
+        self.section: Optional[str] = None
+        self.want_paragraph: Optional[str] = None
+        self.capture: Optional[List[str]] = None
+        self.capture_tag: Optional[str] = None
+        self.capture_depth = 0
+        self.capture_target: Optional[str] = None
+        self.in_quote_depth = 0
+        self.quote_text: Optional[str] = None
+        self.quote_author = ""
+
+    # -- helpers -------------------------------------------------------------
+    def _start_document(self):
+        if not self.started:
+            # Drop anything the model wrote before the document itself
+            self.out = []
+            self.started = True
+
+    def _begin_capture(self, tag: str, target: str):
+        self.capture = []
+        self.capture_tag = tag
+        self.capture_depth = 1
+        self.capture_target = target
+
+    def _finish_capture(self):
+        text = " ".join("".join(self.capture).split())
+        target = self.capture_target
+        self.capture = None
+        self.capture_target = None
+        if target in ("overview", "patterns", "emotions"):
+            setattr(self.insights, target, text)
+        elif target == "recommendation":
+            self.insights.recommendations.append(text)
+        elif target == "quote_text":
+            self.quote_text = text
+        elif target == "quote_author":
+            self.quote_author = text
+
+    # -- parser callbacks ----------------------------------------------------
+    def handle_decl(self, decl):
+        if decl.lower().startswith("doctype html"):
+            self._start_document()
+        self.out.append(f"<!{decl}>")
+
+    def handle_starttag(self, tag, attrs):
+        if self.placeholder_depth:
+            self.placeholder_depth += tag == "p"
+            return
+
+        if tag == "html":
+            if not self.started:
+                self._start_document()
+
+        if tag == "p" and _has_class(attrs, "chart-placeholder"):
+            self.placeholder_depth = 1
+            self.out.append(f"<div class='chart-container'>{self.charts.pop(0)}</div>" if self.charts else _NO_CHART)
+            return
+
+        if self.capture is not None:
+            self.capture_depth += tag == self.capture_tag
+
+        if tag == "meta" and dict(attrs).get("name") == "viewport":
+            self.has_viewport = True
+
+        self.out.append(self.get_starttag_text())
+
+        if tag == "head" and not self.head_done:
+            self.in_head = True
+            self.head_done = True
+            self.out.append(self.head_html)
+        elif tag == "body" and not self.body_done:
+            self.body_done = True
+            self.out.append(self.body_html)
+
+        # Insight extraction
+        if tag == "h2":
+            self.h2_text = []
+        elif self.capture is None:
+            if tag == "p" and self.in_quote_depth:
+                if self.quote_text is None:
+                    self._begin_capture("p", "quote_text")
+                elif _has_class(attrs, "quote-author"):
+                    self._begin_capture("p", "quote_author")
+            elif tag == "p" and self.want_paragraph:
+                self._begin_capture("p", self.want_paragraph)
+                self.want_paragraph = None
+            elif tag == "div" and self.section == "recommendations" and _has_class(attrs, "recommendation"):
+                self._begin_capture("div", "recommendation")
+        if tag == "div":
+            if self.in_quote_depth:
+                self.in_quote_depth += 1
+            elif _has_class(attrs, "quote"):
+                self.in_quote_depth = 1
+                self.quote_text = None
+                self.quote_author = ""
+
+    def handle_startendtag(self, tag, attrs):
+        if self.placeholder_depth:
+            return
+        if tag == "meta" and dict(attrs).get("name") == "viewport":
+            self.has_viewport = True
+        self.out.append(self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        if self.placeholder_depth:
+            if tag == "p":
+                self.placeholder_depth -= 1
+            return
+
+        if tag == "head" and self.in_head:
+            self.in_head = False
+            if not self.has_viewport:
+                self.out.append(_VIEWPORT_META)
+
+        self.out.append(f"</{tag}>")
+
+        if tag == "h2" and self.h2_text is not None:
+            heading = "".join(self.h2_text)
+            self.h2_text = None
+            self.section = None
+            self.want_paragraph = None
+            for name, pattern in _INSIGHT_HEADINGS:
+                if pattern.search(heading):
+                    self.section = name
+                    if name != "recommendations" and not getattr(self.insights, name):
+                        self.want_paragraph = name
+                    break
+
+        if self.capture is not None and tag == self.capture_tag:
+            self.capture_depth -= 1
+            if self.capture_depth == 0:
+                self._finish_capture()
+
+        if tag == "div" and self.in_quote_depth:
+            self.in_quote_depth -= 1
+            if self.in_quote_depth == 0 and self.quote_text:
+                self.insights.quotes.append((self.quote_text, self.quote_author))
+
+    def handle_data(self, data):
+        if self.placeholder_depth:
+            return
+        self.out.append(escape(data, quote=False) if not self._raw_text_context() else data)
+        if self.h2_text is not None:
+            self.h2_text.append(data)
+        if self.capture is not None:
+            self.capture.append(data)
+
+    def handle_comment(self, data):
+        if not self.placeholder_depth:
+            self.out.append(f"<!--{data}-->")
+
+    def handle_pi(self, data):
+        self.out.append(f"<?{data}>")
+
+    def _raw_text_context(self) -> bool:
+        # <style>/<script> contents are passed through verbatim by HTMLParser
+        return self.cdata_elem is not None
+
+
+def postprocess_report_html(
+    html_content: str,
+    head_html: str = "",
+    body_html: str = "",
+    charts: Optional[List[str]] = None,
+) -> Tuple[str, ReportInsights]:
+    """
+    Single parse/transform pass over model-written report HTML.
+
+    Inserts `head_html` after <head>, `body_html` after <body>, adds a viewport
+    meta tag if missing, replaces chart placeholders with `charts` in order, drops
+    any preamble before the document and extracts the Telegram insight fields.
+    The document is serialised once at the end.
+
+    Returns:
+        Tuple of (processed HTML, extracted insights)
+    """
+    parser = _ReportTransformer(head_html, body_html, charts)
+    parser.feed(html_content)
+    parser.close()
+
+    out = parser.out
+    if not parser.started:
+        logger.warning("Report HTML has no doctype/html tag. Wrapping it.")
+        out = [
+            "<!DOCTYPE html>\n<html><head><meta charset=\"UTF-8\">",
+            _VIEWPORT_META,
+            head_html,
+            "<title>Chat X-Ray: Психологический анализ отношений</title></head><body>",
+            body_html,
+            "<h1>Отчет (Возможно, неполный)</h1><div>",
+        ] + out + ["</div></body></html>"]
+    elif not parser.head_done:
+        out = [head_html] + out
+    if parser.started and not parser.body_done:
+        out = [body_html] + out
+
+    return "".join(out), parser.insights
+
+
+def extract_report_insights(html_content: str) -> ReportInsights:
+    """Extract the Telegram insight fields from a finished report in one pass."""
+    return postprocess_report_html(html_content)[1]
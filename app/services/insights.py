@@ -0,0 +1,82 @@
+from dataclasses import dataclass, field
+from html import escape
+from typing import Dict, List, Optional, Tuple
+
+from app.services.report_schema import MetaReportContent
+
+# Per-author averages from the aggregated metrics shown in the summary
+_SUMMARY_METRICS = [
+    ("toxicity", "токсичность"),
+    ("manipulation", "манипулятивность"),
+    ("empathy", "эмпатия"),
+]
+
+
+@dataclass
+class ReportInsights:
+    """Fields of the short Telegram summary sent before the full report."""
+
+    overview: str = ""
+    patterns: str = ""
+    emotions: str = ""
+    recommendations: List[str] = field(default_factory=list)
+    # (quote text, author)
+    quotes: List[Tuple[str, str]] = field(default_factory=list)
+    # author -> {metric: average 0..1}
+    metrics: Dict[str, Dict[str, float]] = field(default_factory=dict)
+
+    def is_empty(self) -> bool:
+        return not (self.overview or self.patterns or self.emotions or self.recommendations or self.quotes)
+
+
+def insights_from_content(
+    content: MetaReportContent,
+    metrics_summary: Optional[Dict[str, Dict[str, float]]] = None,
+) -> ReportInsights:
+    """Build the Telegram summary fields from the structured meta output, without touching HTML."""
+    return ReportInsights(
+        overview=content.overview[0] if content.overview else "",
+        patterns=content.communication_patterns[0] if content.communication_patterns else "",
+        emotions=content.emotional_analysis[0] if content.emotional_analysis else "",
+        recommendations=[rec.title or rec.text for rec in content.recommendations[:3]],
+        quotes=[(q.text, q.author) for q in content.key_quotes[:2]],
+        metrics=dict(metrics_summary or {}),
+    )
+
+
+def format_telegram_insights(insights: ReportInsights) -> str:
+    """Format extracted insights as a Telegram HTML message."""
+    text = "<b>🔍 Краткий анализ отношений:</b>\n\n"
+
+    if insights.is_empty():
+        return text + "Не удалось извлечь подробные выводы. Пожалуйста, обратитесь к полному отчету."
+
+    if insights.overview:
+        text += f"<b>Общий обзор:</b> {escape(insights.overview[:200])}...\n\n"
+    if insights.patterns:
+        text += f"<b>Паттерны общения:</b> {escape(insights.patterns[:200])}...\n\n"
+    if insights.emotions:
+        text += f"<b>Эмоциональный анализ:</b> {escape(insights.emotions[:200])}...\n\n"
+
+    metric_lines = []
+    for author, values in sorted(insights.metrics.items())[:5]:
+        shown = [f"{label} {values[key] * 100:.0f}%" for key, label in _SUMMARY_METRICS if key in values]
+        if shown:
+            metric_lines.append(f"• {escape(author)}: {', '.join(shown)}")
+    if metric_lines:
+        text += "<b>Ключевые показатели:</b>\n" + "\n".join(metric_lines) + "\n\n"
+
+    if insights.recommendations:
+        text += "<b>Ключевые рекомендации:</b>\n"
+        for i, rec in enumerate(insights.recommendations[:3], 1):
+            text += f"{i}. {escape(rec[:100])}...\n"
+
+    if insights.quotes:
+        text += "\n<b>Ключевые цитаты:</b>\n"
+        for quote, author in insights.quotes[:2]:
+            if author:
+                text += f"• <i>«{escape(quote)}»</i> — {escape(author)}\n"
+            else:
+                text += f"• <i>«{escape(quote)}»</i>\n"
+
+    return text
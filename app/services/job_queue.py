@@ -0,0 +1,150 @@
+import time
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Tuple
+
+from app.config import settings
+from app.utils import db
+
+# Uploads accepted by the webhook front end, waiting for (or held by) an
+# analysis worker process. `message` is the Telegram message as JSON, so the
+# worker can rebuild it and run the pipeline exactly as the front end would.
+# Jobs interrupted by a shutdown are queued again with their `job_id`.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS job_queue (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    job_id TEXT,
+    status TEXT NOT NULL,
+    owner TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    enqueued_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS job_queue_status ON job_queue (status, id);
+"""
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+INTERRUPTED = "interrupted"  # stopped by a shutdown and queued again
+
+
+def _ensure_schema() -> None:
+    db.state_db.ensure_schema(_SCHEMA)
+    db.state_db.ensure_column("job_queue", "job_id", "TEXT")
+
+
+@dataclass
+class QueuedJob:
+    id: int
+    user_id: str
+    chat_id: int
+    message: str
+    attempts: int
+    job_id: Optional[str] = None
+
+
+def _enqueue(message: str, user_id: str, chat_id: int, job_id: Optional[str]) -> Tuple[int, int]:
+    _ensure_schema()
+    with db.state_db.transaction() as conn:
+        queue_id = conn.execute(
+            "INSERT INTO job_queue (user_id, chat_id, message, job_id, status, enqueued_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (user_id, chat_id, message, job_id, QUEUED, time.time()),
+        ).lastrowid
+        ahead = conn.execute(
+            "SELECT COUNT(*) FROM job_queue WHERE status = ? OR (status = ? AND id < ?)",
+            (RUNNING, QUEUED, queue_id),
+        ).fetchone()[0]
+    return queue_id, ahead
+
+
+def _claim(owner: str) -> Optional[QueuedJob]:
+    _ensure_schema()
+    rows = db.state_db.query(
+        "UPDATE job_queue SET status = ?, owner = ?, attempts = attempts + 1, started_at = ? "
+        "WHERE id = (SELECT id FROM job_queue WHERE status = ? ORDER BY id LIMIT 1) "
+        "RETURNING id, user_id, chat_id, message, attempts, job_id",
+        (RUNNING, owner, time.time(), QUEUED),
+    )
+    return QueuedJob(**dict(rows[0])) if rows else None
+
+
+def _finish(queue_id: int, status: str) -> None:
+    _ensure_schema()
+    db.state_db.execute(
+        "UPDATE job_queue SET status = ?, finished_at = ? WHERE id = ?", (status, time.time(), queue_id)
+    )
+
+
+def _cancel_queued(user_id: str) -> int:
+    _ensure_schema()
+    return db.state_db.execute(
+        "UPDATE job_queue SET status = ?, finished_at = ? WHERE user_id = ? AND status = ?",
+        (CANCELLED, time.time(), user_id, QUEUED),
+    ).rowcount
+
+
+def _recover(live_owners: Tuple[str, ...]) -> int:
+    _ensure_schema()
+    placeholders = ",".join("?" * len(live_owners))
+    orphaned = f"status = ? AND owner NOT IN ({placeholders})" if live_owners else "status = ?"
+    with db.state_db.transaction() as conn:
+        conn.execute(
+            f"UPDATE job_queue SET status = ?, finished_at = ? WHERE {orphaned} AND attempts >= ?",
+            (FAILED, time.time(), RUNNING, *live_owners, settings.QUEUE_MAX_ATTEMPTS),
+        )
+        return conn.execute(
+            f"UPDATE job_queue SET status = ?, owner = NULL WHERE {orphaned}",
+            (QUEUED, RUNNING, *live_owners),
+        ).rowcount
+
+
+def _waiting() -> List[QueuedJob]:
+    _ensure_schema()
+    rows = db.state_db.query(
+        "SELECT id, user_id, chat_id, message, attempts, job_id FROM job_queue WHERE status = ? ORDER BY id",
+        (QUEUED,),
+    )
+    return [QueuedJob(**dict(row)) for row in rows]
+
+
+def _depth() -> int:
+    _ensure_schema()
+    return db.state_db.query("SELECT COUNT(*) AS n FROM job_queue WHERE status = ?", (QUEUED,))[0]["n"]
+
+
+async def enqueue(message: str, user_id: str, chat_id: int, job_id: Optional[str] = None) -> Tuple[int, int]:
+    """Queue an upload; returns its queue id and how many uploads (running or waiting) are ahead of it."""
+    return await db.state_db.run(_enqueue, message, user_id, chat_id, job_id)
+
+
+async def claim(owner: str) -> Optional[QueuedJob]:
+    """Take the oldest waiting upload for this worker, if any."""
+    return await db.state_db.run(_claim, owner)
+
+
+async def finish(queue_id: int, status: str = DONE) -> None:
+    await db.state_db.run(_finish, queue_id, status)
+
+
+async def cancel_queued(user_id: str) -> int:
+    """Drop the user's uploads that no worker has started yet."""
+    return await db.state_db.run(_cancel_queued, user_id)
+
+
+async def recover(live_owners: Iterable[str]) -> int:
+    """
+    Put uploads held by workers that are gone back in the queue (or mark them
+    failed after QUEUE_MAX_ATTEMPTS). Returns how many were requeued.
+    """
+    return await db.state_db.run(_recover, tuple(live_owners))
+
+
+async def waiting() -> List[QueuedJob]:
+    """Uploads no worker has started yet, oldest first."""
+    return await db.state_db.run(_waiting)
+
+
+async def depth() -> int:
+    return await db.state_db.run(_depth)
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set
+
+from app.config import settings
+from app.services.state_store import Lease, LeaseStore, leases
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Job:
+    """A running analysis: the tasks working on it, so it can be cancelled as a group."""
+
+    job_id: str
+    user_id: int
+    tasks: Set[asyncio.Task] = field(default_factory=set)
+    started: float = field(default_factory=time.monotonic)
+    # Tokens the plan expects the whole job to use, for "tokens saved" on cancel
+    estimated_tokens: int = 0
+    cancelled: bool = False
+    # Identities of the upload (file id, content hash) that identical uploads attach by
+    keys: Set[str] = field(default_factory=set)
+    # Leases this process holds for the job (the job itself, its upload keys)
+    leases: Set[str] = field(default_factory=set)
+    # The upload message, to queue the job again if shutdown interrupts it
+    message: Any = field(default=None, repr=False)
+    _outcome: Optional[asyncio.Future] = field(default=None, repr=False)
+
+    def outcome(self) -> asyncio.Future:
+        """Resolves with the finished report, or None if the job fails or is cancelled."""
+        if self._outcome is None:
+            self._outcome = asyncio.get_running_loop().create_future()
+        return self._outcome
+
+    def resolve(self, result: Any) -> None:
+        if self._outcome is None and result is None:
+            return  # nobody attached, nothing to tell
+        outcome = self.outcome()
+        if not outcome.done():
+            outcome.set_result(result)
+
+
+class JobRegistry:
+    """
+    In-process registry of running jobs, by job id, by user and by upload identity.
+
+    With a lease store, ownership is also recorded where other bot processes see
+    it: `job:<id>` (info: user id) and `upload:<key>` are held by the process
+    running the job and renewed by `renew_leases()`; another process asks for a
+    cancellation by taking `cancel:<id>`, which is cleared when the job finishes.
+    """
+
+    def __init__(self, lease_store: Optional[LeaseStore] = None, owner: str = ""):
+        self._jobs: Dict[str, Job] = {}
+        self._by_key: Dict[str, Job] = {}
+        self.lease_store = lease_store
+        self.owner = owner
+        self._releasing: Set[asyncio.Task] = set()
+
+    def register(self, job_id: str, user_id: int, task: Optional[asyncio.Task] = None) -> Job:
+        job = Job(job_id=job_id, user_id=user_id)
+        if task is not None:
+            job.tasks.add(task)
+        self._jobs[job_id] = job
+        return job
+
+    def attach(self, job_id: str, task: asyncio.Task) -> None:
+        """Add a task (e.g. background delivery) to a job's group."""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            job.tasks.add(task)
+            task.add_done_callback(job.tasks.discard)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def running(self) -> List[Job]:
+        return [job for job in self._jobs.values() if not job.cancelled]
+
+    def for_user(self, user_id: int) -> Optional[Job]:
+        """The user's most recently started job that is still running."""
+        running = [job for job in self._jobs.values() if job.user_id == user_id and not job.cancelled]
+        return max(running, key=lambda job: job.started) if running else None
+
+    def claim(self, job: Job, key: str) -> None:
+        """Make the job the one identical uploads with this key attach to."""
+        job.keys.add(key)
+        self._by_key.setdefault(key, job)
+
+    def find(self, key: str, exclude: Optional[Job] = None) -> Optional[Job]:
+        """A running job for the same upload, other than `exclude`."""
+        job = self._by_key.get(key)
+        if job is None or job is exclude or job.cancelled:
+            return None
+        return job
+
+    def finish(self, job_id: str, result: Any = None) -> None:
+        """Drop the job and hand its result (None on failure) to attached uploads."""
+        job = self._jobs.pop(job_id, None)
+        if job is None:
+            return
+        for key in job.keys:
+            if self._by_key.get(key) is job:
+                del self._by_key[key]
+        job.resolve(result)
+        if self.lease_store is not None:
+            task = asyncio.get_running_loop().create_task(self._release_leases(job))
+            self._releasing.add(task)
+            task.add_done_callback(self._releasing.discard)
+
+    # -- Ownership shared with other processes ---------------------------------
+
+    async def lease(self, job: Job) -> None:
+        """Record that this process runs the job."""
+        name = f"job:{job.job_id}"
+        if self.lease_store and await self.lease_store.acquire(
+            name, self.owner, settings.LEASE_TTL_SECONDS, info=str(job.user_id)
+        ):
+            job.leases.add(name)
+
+    async def claim_shared(self, job: Job, key: str) -> Optional[Lease]:
+        """
+        Take the upload key for this job across processes. Returns None if it is
+        ours, or the lease of the process already running the same upload.
+        """
+        if self.lease_store is None:
+            return None
+        name = f"upload:{key}"
+        if await self.lease_store.acquire(name, self.owner, settings.LEASE_TTL_SECONDS, info=job.job_id):
+            job.leases.add(name)
+            return None
+        return await self.lease_store.get(name)
+
+    async def wait_released(self, key: str, timeout: float, poll: float = 2.0) -> bool:
+        """Wait for another process to let go of an upload key (job done or process dead)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            lease = await self.lease_store.get(f"upload:{key}")
+            if lease is None or lease.owner == self.owner:
+                return True
+            await asyncio.sleep(poll)
+        return False
+
+    async def renew_leases(self) -> None:
+        """Keep this process's leases alive; run more often than LEASE_TTL_SECONDS."""
+        if self.lease_store is None:
+            return
+        for job in list(self._jobs.values()):
+            for name in list(job.leases):
+                if not await self.lease_store.renew(name, self.owner, settings.LEASE_TTL_SECONDS):
+                    logger.warning(f"Job {job.job_id}: lease {name} expired before renewal")
+                    job.leases.discard(name)
+
+    async def cancel_requests(self) -> List[Job]:
+        """Local jobs another process was asked to cancel."""
+        if self.lease_store is None:
+            return []
+        requested = {lease.name.split(":", 1)[1] for lease in await self.lease_store.list("cancel:")}
+        return [job for job_id, job in self._jobs.items() if job_id in requested and not job.cancelled]
+
+    async def request_cancel(self, user_id: int, job_id: Optional[str] = None) -> Optional[str]:
+        """
+        Ask the process running the user's job (the given one, or their latest)
+        to cancel it. Returns the job id, or None if no such job runs anywhere.
+        """
+        if self.lease_store is None:
+            return None
+        owned = [
+            lease for lease in await self.lease_store.list("job:")
+            if lease.info == str(user_id) and lease.owner != self.owner
+        ]
+        if job_id is not None:
+            owned = [lease for lease in owned if lease.name == f"job:{job_id}"]
+        if not owned:
+            return None
+        target = max(owned, key=lambda lease: lease.expires_at).name.split(":", 1)[1]
+        await self.lease_store.acquire(f"cancel:{target}", self.owner, settings.LEASE_TTL_SECONDS)
+        return target
+
+    async def _release_leases(self, job: Job) -> None:
+        for name in list(job.leases):
+            try:
+                await self.lease_store.release(name, self.owner)
+            except Exception as e:
+                logger.warning(f"Could not release lease {name}: {e}")
+        job.leases.clear()
+        # A cancellation asked for this run must not stop a retry or resume of the job id
+        try:
+            await self.lease_store.clear(f"cancel:{job.job_id}")
+        except Exception as e:
+            logger.warning(f"Could not clear cancellation of job {job.job_id}: {e}")
+
+    async def cancel(self, job: Job, timeout: float = 10) -> bool:
+        """
+        Cancel every task of the job and wait for them to unwind. Awaited OpenAI
+        requests are aborted by the cancellation (httpx closes the connection).
+        Returns False if the job was already cancelled.
+        """
+        if job.cancelled:
+            return False
+        job.cancelled = True
+        current = asyncio.current_task()
+        tasks = [task for task in job.tasks if task is not current and not task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            if pending:
+                logger.warning(f"Job {job.job_id}: {len(pending)} tasks still unwinding after cancel")
+        self.finish(job.job_id)
+        return True
+
+
+jobs = JobRegistry(leases, settings.INSTANCE_ID)
@@ -2,12 +2,28 @@ import json
 import logging
 import time
 import asyncio
-from typing import List, Dict, Any, Tuple
+from collections import defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Dict, Any, Tuple, Optional, Callable, Awaitable
 
 import openai
 from openai import AsyncOpenAI
 
 from app.config import settings
+from app.utils import metrics
+from app.services.cost_ledger import record_usage
+from app.utils.deadline import Deadline
+from app.utils.executor import run_in_thread
+from app.services.report_schema import (
+    SECTION_TITLES,
+    MetaReportContent,
+    SectionStreamTracker,
+    parse_report_content,
+)
+from app.services.insights import ReportInsights, insights_from_content
+from app.services.report_template import REPORT_CSS, render_report
+from app.services.html_postprocess import postprocess_report_html
 from app.services.graphics import (
     generate_sentiment_timeline_svg,
     generate_radar_chart_svg,
@@ -36,7 +52,7 @@ META_PROMPT = """
 - психологические_потребности
 - ключевые_цитаты (key_quotes)
 
-На основе этих данных создайте ПОДРОБНЫЙ и ГЛУБОКИЙ психологический отчет в формате HTML ПОЛНОСТЬЮ НА РУССКОМ ЯЗЫКЕ. Отчет должен быть исключительно детальным, с большим количеством цитат и проницательным анализом. Он будет состоять из следующих разделов:
+На основе этих данных создайте ПОДРОБНЫЙ и ГЛУБОКИЙ психологический отчет ПОЛНОСТЬЮ НА РУССКОМ ЯЗЫКЕ. Отчет должен быть исключительно детальным, с большим количеством цитат и проницательным анализом. Верните только СОДЕРЖАНИЕ разделов в виде JSON — оформление, HTML, стили и графики добавляются программно. Отчет будет состоять из следующих разделов:
 
 1. **Общий обзор** (минимум 600 слов):
    - Подробная оценка динамики отношений с обширными примерами
@@ -68,7 +84,6 @@ META_PROMPT = """
    - Распределение цитат должно быть равномерным между всеми участниками беседы
    - ВАЖНО: Если в данных есть поле с дополнительными цитатами (передаются в `quotes_prompt`), ОБЯЗАТЕЛЬНО включите их в этот раздел
    - Для каждой цитаты указывайте автора, эмоцию и стиль коммуникации
-   - Оформляйте цитаты в отдельных блоках с классом "quote" для лучшей визуализации
 
 6. **Психологические инсайты** (минимум 600 слов):
    - Глубокий анализ на основе Трансакционного анализа с подробным разбором эго-состояний и их взаимодействия
@@ -83,7 +98,7 @@ META_PROMPT = """
    - Специфические рекомендации для каждого участника отдельно
 
 8. **Количественный анализ и Визуализация Данных**:
-   - В этом разделе предоставьте текстовый анализ и ключевые выводы для следующих типов визуализаций. Графики будут созданы программно и вставлены в HTML на место соответствующих заполнителей (`<p class="chart-placeholder">...</p>`). Используйте данные из `AGG_METRICS` и `results_json` для вашего анализа.
+   - В этом разделе предоставьте текстовый анализ и ключевые выводы для следующих типов визуализаций. Графики будут созданы программно и вставлены рядом с вашим текстом. Используйте данные из `AGG_METRICS` и `results_json` для вашего анализа.
    - **8.1. Анализ временной шкалы настроений**: Опишите эмоциональные колебания каждого участника с течением времени, ссылаясь на данные, которые будут визуализированы.
    - **8.2. Анализ коммуникационных метрик (Лепестковая диаграмма)**: Для каждого участника проанализируйте ключевые коммуникационные метрики (токсичность, манипулятивность, позитивность, ассертивность, эмпатия, эмоциональная регуляция), которые будут отображены на лепестковой диаграмме.
    - **8.3. Анализ распределения коммуникационных паттернов (Гистограммы)**: Опишите распределение стилей коммуникации для каждого участника.
@@ -98,22 +113,28 @@ META_PROMPT = """
    - Привяжите анализ к КОНКРЕТНЫМ цитатам (укажите номера/текст цитат из раздела 5)
    - Опишите сильные стороны, уязвимости и ключевые триггеры
 
-## РЕКОМЕНДАЦИИ ПО СТИЛЮ HTML:
-1. Используйте профессиональный, чистый дизайн с успокаивающей цветовой схемой.
-2. Используйте адекватные размеры шрифта, отступы и поля для удобочитаемости.
-3. HTML должен быть полностью автономным со встроенным CSS (без внешних зависимостей JavaScript, если это не для графиков).
-4. Сделайте отчет похожим на профессиональный психологический анализ высшего уровня.
-5. Включите заголовок с названием "Chat X-Ray: Подробный психологический анализ отношений" и текущей датой.
-6. Для раздела "Ключевые цитаты" используйте следующий HTML шаблон для каждой цитаты:
-   \`\`\`html
-   <div class="quote">
-     <p>"Текст цитаты здесь"</p>
-     <p class="quote-author">Автор цитаты</p>
-     <p class="quote-emotion">Эмоция: [эмоция] | Стиль общения: [стиль]</p>
-     <p>Психологический анализ: [ваш анализ цитаты]</p>
-   </div>
-   \`\`\`
-   Местозаполнители для графиков будут иметь вид `<p class="chart-placeholder">Здесь будет график...</p>`. Ваша задача - предоставить текстовый контент ВОКРУГ этих местозаполнителей.
+## ФОРМАТ ОТВЕТА (JSON):
+Верните ОДИН JSON-объект строго со следующими ключами в указанном порядке. Абзацы — это массивы строк, без HTML-разметки и без Markdown.
+{
+  "overview": ["абзац", ...],
+  "communication_patterns": ["абзац", ...],
+  "emotional_analysis": ["абзац", ...],
+  "toxic_interactions": ["абзац", ...],
+  "key_quotes": [{"text": "точная цитата", "author": "автор", "emotion": "эмоция", "style": "стиль общения", "analysis": "психологический анализ"}, ...],
+  "psychological_insights": ["абзац", ...],
+  "recommendations": [{"title": "краткое название", "text": "подробное объяснение", "participant": "для кого (или пустая строка)"}, ...],
+  "quantitative_analysis": {
+    "sentiment_timeline": ["абзац", ...],
+    "communication_metrics": ["абзац", ...],
+    "communication_patterns": ["абзац", ...],
+    "emotional_dynamics": ["абзац", ...],
+    "gottman_horsemen": ["абзац", ...],
+    "transactional_flows": ["абзац", ...],
+    "psychological_needs": ["абзац", ...]
+  },
+  "participant_portraits": [{"participant": "имя", "paragraphs": ["абзац", ...]}, ...]
+}
+Подразделы `quantitative_analysis` соответствуют пунктам 8.1–8.7.
 
 ## КЛЮЧЕВЫЕ ТРЕБОВАНИЯ:
 1. ОБЯЗАТЕЛЬНО ПИШИТЕ ВЕСЬ ТЕКСТ ОТЧЕТА НА РУССКОМ ЯЗЫКЕ БЕЗ ИСКЛЮЧЕНИЙ.
@@ -123,16 +144,121 @@ META_PROMPT = """
 5. Сделайте отчёт МАКСИМАЛЬНО ГЛУБОКИМ и ПРОНИЦАТЕЛЬНЫМ.
 6. ОБЯЗАТЕЛЬНО включите ВСЕ цитаты, которые были предоставлены в дополнительных данных (`quotes_prompt`), даже если они отсутствуют в основной выборке `results_json`.
 7. СТРОГО ЗАПРЕЩЕНО придумывать или искажать цитаты — используйте ТОЛЬКО фактические цитаты.
-8. Убедитесь, что итоговый HTML легко конвертируется в PDF без потери форматирования.
-9. Включите отдельный под-раздел для КАЖДОГО участника с подробным психологическим портретом.
+8. Включите отдельный элемент `participant_portraits` для КАЖДОГО участника с подробным психологическим портретом.
 
-Ваш вывод должен быть ТОЛЬКО допустимым HTML (со встроенным CSS), который можно напрямую преобразовать в PDF. Начните с `<!DOCTYPE html>`.
+Ваш вывод должен быть ТОЛЬКО допустимым JSON-объектом описанной структуры, без пояснений до или после него.
 """
 
 
-async def generate_meta_report(results: List[Dict[str, Any]], total_messages:int, max_retries: int = 3) -> Tuple[str, int]:
+@dataclass
+class MetaReport:
+    """Result of the meta stage: the rendered report plus the data it was built from."""
+
+    html: str
+    tokens: int
+    insights: ReportInsights
+    content: Optional[MetaReportContent] = None
+    # What the report was rendered from besides the primary results, so it can be
+    # rendered again without the model (see build_meta_report)
+    raw_content: str = ""
+    sample_note: Optional[str] = None
+    notes: List[str] = field(default_factory=list)
+    # Set when the meta stage failed; `html` is then an error page, not a report
+    error: Optional[str] = None
+
+
+def _error_report(error_message: str, details: str = "") -> MetaReport:
+    return MetaReport(
+        html=_generate_error_html(error_message, details), tokens=0, insights=ReportInsights(),
+        error=details or error_message,
+    )
+
+
+def compute_metrics_summary(results: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """Average of each numeric metric per author over the primary results."""
+    per_author = defaultdict(lambda: defaultdict(list))
+    for m in results:
+        author = m.get("author", "Unknown")
+        for field_name in ["sentiment_score", "toxicity", "manipulation", "empathy", "assertiveness", "emotion_intensity"]:
+            val = m.get(field_name)
+            if isinstance(val, (int, float)): per_author[author][field_name].append(val)
+        horsemen = m.get("gottman_horsemen", {})
+        for hk, hv in (horsemen or {}).items():
+            if isinstance(hv, (int, float)): per_author[author][f"horsemen_{hk}"].append(hv)
+    return {author: {k: (sum(v)/len(v) if v else 0) for k, v in values.items()} for author, values in per_author.items()}
+
+
+def build_meta_report(
+    raw_content: str,
+    metrics_summary: Dict[str, Dict[str, float]],
+    total_messages: int,
+    sample_note: Optional[str] = None,
+    notes: Optional[List[str]] = None,
+    tokens: int = 0,
+) -> Optional[MetaReport]:
+    """
+    Render the report from the meta model's raw output: charts, HTML and Telegram
+    insights. Makes no API calls, so a stored output can be rendered again after
+    the template, CSS or charts change. None if the output can't be parsed.
+    """
+    notes = list(notes or [])
+    charts = _build_charts(metrics_summary)
+    content = parse_report_content(raw_content)
+    if content is not None:
+        html_content = render_report(content, charts, total_messages, sample_note, notes)
+        insights = insights_from_content(content, metrics_summary)
+    elif raw_content.lstrip().startswith("<"):
+        logger.warning("Meta model returned HTML instead of JSON; falling back to legacy post-processing")
+        html_content, insights = _postprocess_html(raw_content, charts, total_messages, sample_note)
+        insights.metrics = dict(metrics_summary)
+    else:
+        return None
+    return MetaReport(
+        html=html_content, tokens=tokens, insights=insights, content=content,
+        raw_content=raw_content, sample_note=sample_note, notes=notes,
+    )
+
+
+async def render_stored_meta_report(
+    results: List[Dict[str, Any]],
+    total_messages: int,
+    raw_content: str,
+    sample_note: Optional[str] = None,
+    notes: Optional[List[str]] = None,
+) -> Optional[MetaReport]:
+    """build_meta_report for a stored meta output, off the event loop. No API calls."""
+    metrics_summary = await run_in_thread(compute_metrics_summary, results)
+    return await run_in_thread(build_meta_report, raw_content, metrics_summary, total_messages, sample_note, notes)
+
+
+async def generate_meta_report(
+    results: List[Dict[str, Any]],
+    total_messages: int,
+    max_retries: int = 3,
+    stream_path: Optional[Path] = None,
+    progress_callback: Optional[Callable[[int, int, str], Awaitable[None]]] = None,
+    sample_size: Optional[int] = None,
+    deadline: Optional[Deadline] = None,
+) -> MetaReport:
     """
-    Generate a meta report from the analysis results using a single call to settings.META_MODEL.
+    Generate a meta report from the analysis results using a single streamed call to settings.META_MODEL.
+
+    Args:
+        results: Primary analysis results
+        total_messages: Number of messages in the original chat
+        max_retries: Maximum number of retries on API errors
+        stream_path: Optional file the raw completion is written to as it streams in
+        progress_callback: Optional callback(sections_done, total_sections, current_title)
+            invoked when the model starts writing and whenever a new section starts
+        sample_size: Cap on analysed segments sent to the model, as chosen by the
+            planner (defaults to settings.MAX_MESSAGES_FOR_META)
+        deadline: Job deadline. The stream is cut at the deadline (but gets at least
+            DEADLINE_META_MIN_SECONDS), keeping complete sections; no retries are
+            started after it; its degradation notes are shown in the report
+
+    Returns:
+        MetaReport with the final HTML, tokens used and the Telegram insights,
+        which are built from the structured content rather than the HTML
     """
     def estimate_tokens(data_str: str) -> int:
         return int(len(data_str) * 0.25) # Rough estimate
@@ -179,21 +305,7 @@ async def generate_meta_report(results: List[Dict[str, Any]], total_messages:int
     all_key_quotes = extract_key_quotes(results)
     logger.info(f"Extracted {len(all_key_quotes)} key quotes for preservation.")
 
-    from collections import defaultdict
-    def compute_metrics_summary(msgs):
-        per_author = defaultdict(lambda: defaultdict(list))
-        for m in msgs:
-            author = m.get("author", "Unknown")
-            for field in ["sentiment_score", "toxicity", "manipulation", "empathy", "assertiveness", "emotion_intensity"]:
-                val = m.get(field)
-                if isinstance(val, (int, float)): per_author[author][field].append(val)
-            horsemen = m.get("gottman_horsemen", {})
-            for hk, hv in (horsemen or {}).items():
-                if isinstance(hv, (int, float)): per_author[author][f"horsemen_{hk}"].append(hv)
-        summary = {author: {k: (sum(v)/len(v) if v else 0) for k,v in metrics.items()} for author,metrics in per_author.items()}
-        return summary
-
-    metrics_summary = compute_metrics_summary(results)
+    metrics_summary = await run_in_thread(compute_metrics_summary, results)
     
     def compute_timeline(msgs, bins: int = 24):
         if not msgs: return []
@@ -237,34 +349,38 @@ async def generate_meta_report(results: List[Dict[str, Any]], total_messages:int
             cleaned.append(m_copy)
         return cleaned
 
-    results_to_process_clean = strip_bulky_fields(results)
-    temp_results_json = json.dumps(results_to_process_clean, indent=None, ensure_ascii=False)
-    estimated_tokens_for_results = estimate_tokens(temp_results_json)
+    def prepare_sample():
+        results_to_process_clean = strip_bulky_fields(results)
 
-    # Iteratively shrink results_to_process_clean until its JSON representation is under budget
-    # MAX_MESSAGES_FOR_META from config (400) is an initial cap before this token-based sampling.
-    # This loop further refines based on token budget.
-    current_max_messages = settings.MAX_MESSAGES_FOR_META 
-    results_to_process_sampled = get_balanced_sample(results_to_process_clean, current_max_messages)
+        # Iteratively shrink results_to_process_clean until its JSON representation is under budget
+        # MAX_MESSAGES_FOR_META from config (400) is an initial cap before this token-based sampling.
+        # This loop further refines based on token budget.
+        current_max_messages = sample_size or settings.MAX_MESSAGES_FOR_META
+        results_to_process_sampled = get_balanced_sample(results_to_process_clean, current_max_messages)
     
-    # Minimal sample size if aggressive reduction is needed
-    minimal_sample_size_fallback = 200 # User previously set this, let's use it as lower bound for adaptive.
+        # Minimal sample size if aggressive reduction is needed
+        minimal_sample_size_fallback = min(200, current_max_messages) # User previously set this, let's use it as lower bound for adaptive.
 
-    # Adaptive reduction based on token budget
-    while estimate_tokens(json.dumps(results_to_process_sampled, indent=None, ensure_ascii=False)) > target_token_budget_for_results and \
-          len(results_to_process_sampled) > minimal_sample_size_fallback:
-        current_max_messages = max(minimal_sample_size_fallback, int(len(results_to_process_sampled) * 0.85))
-        results_to_process_sampled = get_balanced_sample(results_to_process_clean, current_max_messages) # Sample from the original cleaned full results
-        logger.info(f"Adaptive reduction: {len(results_to_process_sampled)} msgs, aiming for <{target_token_budget_for_results} tokens for results_json")
+        # Adaptive reduction based on token budget
+        while estimate_tokens(json.dumps(results_to_process_sampled, indent=None, ensure_ascii=False)) > target_token_budget_for_results and \
+              len(results_to_process_sampled) > minimal_sample_size_fallback:
+            current_max_messages = max(minimal_sample_size_fallback, int(len(results_to_process_sampled) * 0.85))
+            results_to_process_sampled = get_balanced_sample(results_to_process_clean, current_max_messages) # Sample from the original cleaned full results
+            logger.info(f"Adaptive reduction: {len(results_to_process_sampled)} msgs, aiming for <{target_token_budget_for_results} tokens for results_json")
 
-    final_results_json_for_llm = json.dumps(results_to_process_sampled, indent=None, ensure_ascii=False)
-    logger.info(f"Final sample size for meta report: {len(results_to_process_sampled)} messages. Estimated tokens for results_json: {estimate_tokens(final_results_json_for_llm)}")
+        final_results_json_for_llm = json.dumps(results_to_process_sampled, indent=None, ensure_ascii=False)
+        logger.info(f"Final sample size for meta report: {len(results_to_process_sampled)} messages. Estimated tokens for results_json: {estimate_tokens(final_results_json_for_llm)}")
+        return results_to_process_clean, results_to_process_sampled, final_results_json_for_llm
+
+    # Repeated json.dumps over the whole result set is CPU-heavy; keep it off the event loop
+    results_to_process_clean, results_to_process_sampled, final_results_json_for_llm = await run_in_thread(prepare_sample)
 
     retry_count = 0
     backoff_time = settings.RETRY_DELAY_SECONDS
     
     tokens_used_meta = 0
-    html_content = ""
+    raw_content = ""
+    stream_interrupted = False
 
     while retry_count <= max_retries:
         try:
@@ -287,33 +403,53 @@ async def generate_meta_report(results: List[Dict[str, Any]], total_messages:int
 
             logger.info(f"Attempting to generate meta report with {settings.META_MODEL}. Input estimate (results_json part): {estimate_tokens(final_results_json_for_llm)} tokens.")
             
-            response = await client.chat.completions.create(
-                model=settings.META_MODEL,
-                messages=[
-                    {"role": "system", "content": META_PROMPT},
-                    {"role": "user", "content": user_content},
-                ],
-                temperature=0.7,
-                max_tokens=4096, # Standard max output, adjust if a different output length is consistently needed
-                n=1
-            )
-            html_content = response.choices[0].message.content
-            
-            if response.usage:
-                tokens_used_meta = response.usage.total_tokens
-                # If we need to separate input/output tokens for cost:
-                # tokens_input_meta = response.usage.prompt_tokens
-                # tokens_output_meta = response.usage.completion_tokens
-            else:
-                tokens_used_meta = 0 # Fallback
+            request_kwargs = {}
+            if settings.META_JSON_MODE:
+                request_kwargs["response_format"] = {"type": "json_object"}
+
+            messages = [
+                {"role": "system", "content": META_PROMPT},
+                {"role": "user", "content": user_content},
+            ]
+            parts: List[str] = []
+            tracker = SectionStreamTracker()
+            stream_timeout = None
+            if deadline:
+                stream_timeout = max(deadline.remaining(), settings.DEADLINE_META_MIN_SECONDS)
+            try:
+                tokens_used_meta = await asyncio.wait_for(
+                    _stream_meta_completion(messages, request_kwargs, parts, tracker, stream_path, progress_callback),
+                    timeout=stream_timeout,
+                )
+            except Exception as stream_error:
+                # Keep what was already streamed if at least one section is complete,
+                # instead of paying for the whole completion again.
+                if tracker.completed == 0:
+                    raise
+                logger.warning(
+                    f"Meta report stream interrupted after {tracker.completed} complete sections: {stream_error}. "
+                    "Keeping partial output."
+                )
+                stream_interrupted = True
+                if isinstance(stream_error, asyncio.TimeoutError) and deadline is not None:
+                    deadline.degrade(
+                        "meta_sections",
+                        "Из-за ограничения времени отчёт содержит только разделы, сформированные до истечения срока.",
+                    )
+            raw_content = "".join(parts)
 
             logger.info(f"Meta report generated. Tokens used: {tokens_used_meta}")
             break # Success
 
         except openai.RateLimitError as e:
             retry_count += 1
+            metrics.LLM_RATE_LIMITED.inc(stage="meta")
             logger.warning(f"Rate limit exceeded for meta report (attempt {retry_count}/{max_retries}): {e}")
+            if deadline and deadline.remaining() < backoff_time:
+                logger.error("No time left before the job deadline to retry the meta report.")
+                return _error_report(str(e), "Rate limit error; job deadline reached.")
             if retry_count <= max_retries:
+                metrics.LLM_RETRIES.inc(stage="meta")
                 logger.info(f"Retrying meta report in {backoff_time} seconds...")
                 await asyncio.sleep(backoff_time) # Use asyncio.sleep
                 backoff_time *= 2
@@ -323,8 +459,7 @@ async def generate_meta_report(results: List[Dict[str, Any]], total_messages:int
                     logger.info(f"Final meta attempt with further reduced sample: {len(results_to_process_sampled)} messages.")
             else:
                 logger.error("Max retries reached for meta report generation due to rate limits.")
-                html_content = _generate_error_html(str(e), "Rate limit error after multiple retries.")
-                return html_content, 0
+                return _error_report(str(e), "Rate limit error after multiple retries.")
         
         except openai.OpenAIError as e: # Catch other OpenAI errors
             logger.error(f"OpenAI API error during meta report generation: {e}")
@@ -335,150 +470,171 @@ async def generate_meta_report(results: List[Dict[str, Any]], total_messages:int
                 # For now, the loop for adaptive reduction should handle this if it's systematically too large.
                 # If it happens *after* sampling, it means the prompt + sampled data is still too big.
                 # Fallback to error HTML for now if this specific error is not resolved by retries or sampling.
-                html_content = _generate_error_html(str(e), "Context length exceeded.")
-                return html_content, 0 # Bail out on context length errors not caught by sampling
+                return _error_report(str(e), "Context length exceeded.") # Bail out on context length errors not caught by sampling
 
             # Generic retry for other API errors
             retry_count += 1
+            if deadline and deadline.remaining() < backoff_time:
+                logger.error("No time left before the job deadline to retry the meta report.")
+                return _error_report(str(e), "API error; job deadline reached.")
             if retry_count <= max_retries:
+                metrics.LLM_RETRIES.inc(stage="meta")
                 logger.info(f"Retrying meta report due to API error in {backoff_time} seconds...")
                 await asyncio.sleep(backoff_time)
                 backoff_time *= 2
             else:
                 logger.error("Max retries reached for meta report generation due to API errors.")
-                html_content = _generate_error_html(str(e), "API error after multiple retries.")
-                return html_content, 0
+                return _error_report(str(e), "API error after multiple retries.")
         except Exception as e: # Catch any other unexpected error
             logger.exception(f"Unexpected error during meta report generation: {e}")
-            html_content = _generate_error_html(str(e), "An unexpected error occurred.")
-            return html_content, 0
-
-
-    # Post-processing HTML
-    if html_content:
-        # --- Inject additional CSS for better readability ---
-        def _inject_css(html_str: str) -> str:
-            import re
-            style_block = """
-            <style>
-                body { font-size: 16px; line-height: 1.7; } /* Adjusted for typical screen reading */
-                h1 { font-size: 28px; margin-bottom: 25px; }
-                h2 { font-size: 22px; margin-top: 35px; margin-bottom: 15px; }
-                h3 { font-size: 18px; margin-top: 25px; margin-bottom: 10px; }
-                svg text { font-family: Arial, sans-serif; font-size: 12px; } /* Smaller SVG text */
-                .quote { border-left: 4px solid #3498db; padding: 10px 15px; margin: 20px 0; background-color: #f8f9fa; }
-                .quote p { margin: 5px 0; }
-                .quote-author { font-weight: bold; color: #555; }
-                .quote-emotion { color: #777; font-size: 0.9em; }
-                .chart-container { background-color: #f5f5f5; padding: 15px; border-radius: 5px; margin: 25px 0; overflow-x: auto; } /* Added container for charts */
-            </style>
-            """
-            head_match = re.search(r"<head[^>]*>", html_str, re.IGNORECASE)
-            if head_match:
-                insert_pos = head_match.end()
-                return html_str[:insert_pos] + style_block + html_str[insert_pos:]
-            return style_block + html_str # Fallback if no head tag
-
-        html_content = _inject_css(html_content)
-
-        import html as _html_module
-        html_content = _html_module.unescape(html_content)
-
-        import re
-        leading_html_match = re.search(r'(<!DOCTYPE html[\s\S]*|<html[\s\S]*)', html_content, re.IGNORECASE)
-        if leading_html_match:
-            html_content = leading_html_match.group(1).lstrip()
-        
-        _html_start = html_content.lstrip()[:40].lower()
-        if not (_html_start.startswith("<!doctype html") or _html_start.startswith("<html")):
-            logger.warning("Meta report output doesn't seem to start with valid HTML doctype/tag. Wrapping it.")
-            # This basic wrapper might be too simple if the LLM produced partial HTML or just text.
-            # The prompt strongly guides for full HTML.
-            html_content = f"""<!DOCTYPE html>
-                            <html><head><meta charset="UTF-8">
-                            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                            <title>Chat X-Ray: Психологический анализ отношений</title></head><body>
-                            <h1>Отчет (Возможно, неполный)</h1><div>{html_content}</div></body></html>"""
-
-        if "<meta name=\"viewport\"" not in html_content:
-            html_content = html_content.replace("<head>", "<head>\n<meta name=\"viewport\" content=\"width=device-width, initial-scale=1.0\">", 1)
-            
-        # Add sampling disclaimer if applicable
-        # results_to_process_sampled is the actual data sent to LLM. 'results' is the full primary analysis.
-        if len(results_to_process_sampled) < len(results_to_process_clean): # Compare sampled vs full cleaned list
-            import re
-            body_pattern = r'<body[^>]*>'
-            disclaimer_text = f"""
-            <div style="background-color: #fff3cd; color: #856404; padding: 15px; margin-bottom: 20px; border-radius: 5px; border: 1px solid #ffeeba;">
-                <strong>Примечание о выборке:</strong> Этот анализ основан на автоматически отобранной выборке из {len(results_to_process_sampled)} проанализированных сегментов сообщений 
-                (из общего числа {len(results_to_process_clean)} доступных сегментов после первичной обработки {len(results)} исходных сообщений).
-                Выборка стремится охватить начало, середину и конец чата для сбалансированного анализа в рамках установленного бюджета.
-            </div>
-            """
-            if re.search(body_pattern, html_content):
-                html_content = re.sub(body_pattern, lambda m: m.group(0) + disclaimer_text, html_content, count=1)
-            else:
-                html_content = disclaimer_text + html_content
+            return _error_report(str(e), "An unexpected error occurred.")
 
-        msg_banner = (
-            f"""
-            <div style=\"background-color:#e8f4fd; color: #1e4271; padding:12px; margin-bottom:20px; border-left:4px solid #3498db;\">
-                Отчёт подготовлен после анализа <b>{total_messages}</b> сообщений из вашего чата.
-            </div>
-            """
-        )
-        body_tag_re = re.compile(r"<body[^>]*>", re.IGNORECASE)
-        html_content, subs = body_tag_re.subn(lambda m: m.group(0)+msg_banner, html_content, count=1)
-        if subs == 0: html_content = msg_banner + html_content
-        
-        # ---- Programmatically generate SVG charts ----
-        try:
-            svgs_to_inject: List[str] = []
-            # Ensure metrics_summary and svg_timeline_data are available and correct for these functions
-            
-            # 1. Sentiment timeline (svg_timeline_data needs to be correctly computed for this)
-            # The compute_timeline was simplified; let's assume graphics.py can handle raw segments or needs specific format.
-            # For now, let's rely on data within metrics_summary for other charts if timeline is too complex to quickly re-integrate.
-            # svgs_to_inject.append(generate_sentiment_timeline_svg(svg_timeline_data)) # This needs correctly formatted svg_timeline_data
 
-            # 2. Radar chart of core metrics per author
-            if metrics_summary: svgs_to_inject.append(generate_radar_chart_svg(metrics_summary))
+    # Sampling disclaimer if the LLM only saw part of the primary results
+    sample_note = None
+    if len(results_to_process_sampled) < len(results_to_process_clean): # Compare sampled vs full cleaned list
+        sample_note = (
+            f"Этот анализ основан на автоматически отобранной выборке из {len(results_to_process_sampled)} проанализированных сегментов сообщений "
+            f"(из общего числа {len(results_to_process_clean)} доступных сегментов после первичной обработки {len(results)} исходных сообщений). "
+            "Выборка стремится охватить начало, середину и конец чата для сбалансированного анализа в рамках установленного бюджета."
+        )
 
-            # 3. Bar chart of overall toxicity per author
-            toxicity_totals = {a: round(m.get("toxicity",0),3) for a,m in metrics_summary.items() if m}
-            if toxicity_totals: svgs_to_inject.append(generate_bar_chart_svg(toxicity_totals, "Средний уровень токсичности по авторам", chart_id="chart-toxicity"))
+    notes = []
+    if stream_interrupted and not (deadline and deadline.degraded("meta_sections")):
+        notes.append("Генерация отчёта была прервана; ниже приведены полностью сформированные разделы.")
+    if deadline:
+        notes.extend(deadline.notes())
+
+    # Chart generation, JSON parsing and HTML rendering run off the event loop
+    report = await run_in_thread(
+        build_meta_report, raw_content, metrics_summary, total_messages, sample_note, notes, tokens_used_meta
+    )
+    if report is None:
+        logger.error(f"Meta report output could not be parsed: {raw_content[:200]!r}")
+        report = _error_report("invalid_meta_output", "Модель вернула отчёт в неожиданном формате.")
+        report.tokens = tokens_used_meta
+    return report
+
+
+async def _stream_meta_completion(
+    messages: List[Dict[str, str]],
+    request_kwargs: Dict[str, Any],
+    parts: List[str],
+    tracker: SectionStreamTracker,
+    stream_path: Optional[Path] = None,
+    progress_callback: Optional[Callable[[int, int, str], Awaitable[None]]] = None,
+) -> int:
+    """
+    Stream the meta completion into `parts` (and `stream_path`, if given), reporting
+    section progress as it happens. Returns total tokens from the usage chunk.
+    Partial content stays in `parts` if the stream raises.
+    """
+    titles = dict(SECTION_TITLES)
+    total_sections = len(SECTION_TITLES)
+    tokens_used = 0
+
+    async def _report(title: str):
+        if progress_callback:
+            try:
+                await progress_callback(tracker.completed, total_sections, title)
+            except Exception as cb_err:
+                logger.warning(f"Meta progress callback error: {cb_err}")
+
+    started = time.monotonic()
+    stream = await client.chat.completions.create(
+        model=settings.META_MODEL,
+        messages=messages,
+        temperature=0.7,
+        max_tokens=4096, # Standard max output, adjust if a different output length is consistently needed
+        n=1,
+        stream=True,
+        stream_options={"include_usage": True},
+        **request_kwargs,
+    )
+
+    out = open(stream_path, "w", encoding="utf-8") if stream_path else None
+    try:
+        async for chunk in stream:
+            if chunk.usage:
+                tokens_used = await record_usage(
+                    chunk.usage, chunk.model or settings.META_MODEL, stage="meta", seconds=time.monotonic() - started
+                )
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+
+            if not parts:
+                logger.info("Meta report stream started")
+                await _report("")
+            parts.append(delta)
+            if out:
+                out.write(delta)
+                out.flush()
+
+            for key in tracker.feed(delta):
+                logger.info(f"Meta report section started: {key}")
+                await _report(titles.get(key, key))
+    finally:
+        if out:
+            out.close()
+
+    return tokens_used
+
+
+def _build_charts(metrics_summary: Dict[str, Dict[str, float]]) -> Dict[str, List[str]]:
+    """Programmatically generate SVG charts, keyed by quantitative sub-section."""
+    charts: Dict[str, List[str]] = defaultdict(list)
+    try:
+        # Radar chart of core metrics per author
+        if metrics_summary:
+            charts["communication_metrics"].append(generate_radar_chart_svg(metrics_summary))
+
+        bar_charts = [
+            ("toxicity", "Средний уровень токсичности по авторам", "chart-toxicity"),
+            ("manipulation", "Уровень манипулятивности по авторам", "chart-manipulation"),
+            ("assertiveness", "Уровень ассертивности по авторам", "chart-assertiveness"),
+            ("empathy", "Уровень эмпатии по авторам", "chart-empathy"),
+        ]
+        for field, title, chart_id in bar_charts:
+            totals = {a: round(m.get(field, 0), 3) for a, m in metrics_summary.items() if m}
+            if totals:
+                charts["communication_metrics"].append(generate_bar_chart_svg(totals, title, chart_id=chart_id))
+
+        horsemen_overall = defaultdict(float)
+        for author_metrics in metrics_summary.values():
+            for key, value in author_metrics.items():
+                if key.startswith("horsemen_"):
+                    horsemen_overall[key.replace("horsemen_","").capitalize()] += value
+        if horsemen_overall:
+            avg_horsemen = {k: round(v / len(metrics_summary) if metrics_summary else 0, 3) for k,v in horsemen_overall.items()}
+            charts["gottman_horsemen"].append(generate_bar_chart_svg(avg_horsemen, "Среднее проявление \"Всадников Апокалипсиса\"", chart_id="chart-horsemen"))
+    except Exception as gerr:
+        logger.warning(f"Programmatic SVG generation failed: {gerr}", exc_info=True)
+    return dict(charts)
+
+
+def _postprocess_html(html_content: str, charts: Dict[str, List[str]], total_messages: int, sample_note: str = None) -> Tuple[str, ReportInsights]:
+    """
+    Legacy path for models that ignore the JSON instructions and write HTML themselves.
+    Injects the shared CSS, banners and charts into the model-written document and
+    extracts the Telegram insights in a single parse/serialise pass.
+    """
+    import html as _html_module
 
-            manip_totals = {a: round(m.get("manipulation",0),3) for a,m in metrics_summary.items() if m}
-            if manip_totals: svgs_to_inject.append(generate_bar_chart_svg(manip_totals, "Уровень манипулятивности по авторам", chart_id="chart-manipulation"))
-            
-            assert_totals = {a: round(m.get("assertiveness",0),3) for a,m in metrics_summary.items() if m}
-            if assert_totals: svgs_to_inject.append(generate_bar_chart_svg(assert_totals, "Уровень ассертивности по авторам", chart_id="chart-assertiveness"))
-
-            empathy_totals = {a: round(m.get("empathy",0),3) for a,m in metrics_summary.items() if m}
-            if empathy_totals: svgs_to_inject.append(generate_bar_chart_svg(empathy_totals, "Уровень эмпатии по авторам", chart_id="chart-empathy"))
-
-            horsemen_overall = defaultdict(float)
-            for author_metrics in metrics_summary.values():
-                for key, value in author_metrics.items():
-                    if key.startswith("horsemen_"):
-                        horsemen_overall[key.replace("horsemen_","").capitalize()] += value
-            if horsemen_overall:
-                avg_horsemen = {k: round(v / len(metrics_summary) if metrics_summary else 0, 3) for k,v in horsemen_overall.items()}
-                svgs_to_inject.append(generate_bar_chart_svg(avg_horsemen, "Среднее проявление \"Всадников Апокалипсиса\"", chart_id="chart-horsemen"))
-
-            chart_container_template = "<div class='chart-container'>{}</div>"
-            for svg_code in svgs_to_inject:
-                styled_svg = chart_container_template.format(svg_code)
-                # Replace placeholders sequentially. Ensure META_PROMPT asks for these placeholders.
-                html_content = re.sub(r'<p class="chart-placeholder">[\s\S]*?</p>', styled_svg, html_content, count=1)
-            
-            # Remove any remaining placeholders if not enough SVGs were generated
-            html_content = re.sub(r'<p class="chart-placeholder">[\s\S]*?</p>', '<p><i>(Визуализация для этого раздела не была сгенерирована.)</i></p>', html_content)
+    banners = ""
+    if sample_note:
+        banners += f'<div class="sample-note"><strong>Примечание о выборке:</strong> {_html_module.escape(sample_note)}</div>'
+    banners += f'<div class="messages-banner">Отчёт подготовлен после анализа <b>{total_messages}</b> сообщений из вашего чата.</div>'
 
-        except Exception as gerr:
-            logger.warning(f"Programmatic SVG injection failed: {gerr}", exc_info=True)
+    return postprocess_report_html(
+        html_content,
+        head_html=f"<style>{REPORT_CSS}</style>",
+        body_html=banners,
+        charts=[svg for key_charts in charts.values() for svg in key_charts],
+    )
 
-    return html_content, tokens_used_meta
 
 def _generate_error_html(error_message: str, details: str = "") -> str:
     # Sanitize error_message for HTML display
@@ -10,10 +10,12 @@ import openai
 from openai import AsyncOpenAI
 
 from app.config import settings
+from app.services import checkpoints
+from app.utils import metrics
+from app.utils.deadline import Deadline
 
-# Import local Llama wrapper if enabled
-if settings.USE_LOCAL_LLM:
-    from app.services.local_llm import analyse_chunk_with_llama
+# Chunk analysis goes through the OpenAI wrapper in local_llm regardless of USE_LOCAL_LLM
+from app.services.local_llm import analyse_chunk
 
 logger = logging.getLogger(__name__)
 
@@ -76,13 +78,16 @@ PRIMARY_PROMPT = """
 Выведите результат в формате JSON. Обязательно анализируйте количественные параметры максимально точно, так как они будут использованы для создания графиков и визуализаций.
 """
 
-async def process_chunk(chunk: List[Dict[str, Any]], max_retries: int = 3) -> Tuple[List[Dict[str, Any]], int]:
+async def process_chunk(
+    chunk: List[Dict[str, Any]], max_retries: int = 3, model: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], int]:
     """
     Process a single chunk of messages using local Llama for analysis.
     
     Args:
         chunk: List of message dictionaries
         max_retries: Maximum number of retries on rate limit errors
+        model: Primary model to use (defaults to settings.PRIMARY_MODEL)
         
     Returns:
         Tuple containing the list of processed message dictionaries with analysis and the number of tokens used
@@ -91,19 +96,19 @@ async def process_chunk(chunk: List[Dict[str, Any]], max_retries: int = 3) -> Tu
     try:
         chunk_text = "\n\n".join(m["raw"] for m in chunk)
         logger.info(f"Processing chunk with local Llama model: {settings.OLLAMA_MODEL}")
-        llama_result = await analyse_chunk_with_llama(chunk_text)
+        llama_result, tokens_used = await analyse_chunk(chunk_text, model=model or settings.PRIMARY_MODEL)
         
         if "error" in llama_result:
             logger.error(f"Local Llama analysis failed: {llama_result['error']}")
             if "details" in llama_result:
                 logger.error(f"Error details: {llama_result['details']}")
-            return [{"error": llama_result["error"], "raw_input": msg["raw"]} for msg in chunk], 0
+            return [{"error": llama_result["error"], "raw_input": msg["raw"]} for msg in chunk], tokens_used
             
         # Normalize to list-of-dicts shape expected downstream
         if isinstance(llama_result, list):
-            return llama_result, 0
+            return llama_result, tokens_used
         else:
-            return [llama_result], 0
+            return [llama_result], tokens_used
                 
     except Exception as le:
         logger.error(f"Local Llama analysis failed with exception: {le}")
@@ -113,6 +118,10 @@ async def process_chunk(chunk: List[Dict[str, Any]], max_retries: int = 3) -> Tu
 async def process_chunks(
     chunks: List[List[Dict[str, Any]]],
     progress_callback: Optional[Callable[[int, int], Awaitable[None]]] = None,
+    model: Optional[str] = None,
+    deadline: Optional[Deadline] = None,
+    reserve_seconds: float = 0,
+    job_id: Optional[str] = None,
 ) -> Tuple[List[Dict[str, Any]], int]:
     """
     Process all chunks of messages in parallel and combine the results.
@@ -120,6 +129,14 @@ async def process_chunks(
     Args:
         chunks: List of chunks, where each chunk is a list of message dictionaries
         progress_callback: Optional callback function to report progress
+        model: Primary model chosen by the planner (defaults to settings.PRIMARY_MODEL)
+        deadline: Job deadline. Once less than `reserve_seconds` (the time later
+            stages need) is left, no new chunks are sent and running calls are
+            abandoned; those chunks get aggregate-only results instead
+        reserve_seconds: Time to keep for the stages after primary analysis
+        job_id: Checkpoint chunk results under this job: each successful chunk is
+            saved as it completes, and chunks an earlier run of the job already
+            analysed are taken from the checkpoint instead of the model
         
     Returns:
         Tuple containing the list of all processed message dictionaries with analysis and the total number of tokens used
@@ -130,18 +147,46 @@ async def process_chunks(
     # Use a semaphore to limit concurrent API calls
     semaphore = asyncio.Semaphore(concurrency_limit)
     
+    aggregate_only = 0
+    stored = await checkpoints.load_chunks(job_id) if job_id else {}
+
+    async def report_progress(i):
+        if progress_callback:
+            try:
+                await progress_callback(i + 1, len(chunks))
+            except Exception as cb_err:
+                logger.warning(f"Progress callback error: {cb_err}")
+
     async def process_with_semaphore(i, chunk):
         """Process a chunk with semaphore to limit concurrency"""
+        nonlocal aggregate_only
+        digest = checkpoints.chunk_digest(chunk) if job_id else None
+        saved = stored.get(i)
+        if saved is not None and saved.chunk_sha256 == digest:
+            metrics.CHUNKS_FROM_CHECKPOINT.inc()
+            await report_progress(i)
+            return saved.result, 0
         async with semaphore:
-            logger.info(f"Processing chunk {i+1}/{len(chunks)}")
-            result, tokens_used = await process_chunk(chunk)
-            # Report progress if callback provided
-            if progress_callback:
-                try:
-                    await progress_callback(i + 1, len(chunks))
-                except Exception as cb_err:
-                    logger.warning(f"Progress callback error: {cb_err}")
-            return result, tokens_used
+            budget = deadline.remaining() - reserve_seconds if deadline else None
+            try:
+                if budget is not None and budget <= 0:
+                    raise asyncio.TimeoutError
+                logger.info(f"Processing chunk {i+1}/{len(chunks)}")
+                with metrics.PIPELINE_STAGE_SECONDS.time(stage="primary_chunk"):
+                    result, tokens_used = await asyncio.wait_for(process_chunk(chunk, model=model), timeout=budget)
+            except asyncio.TimeoutError:
+                logger.warning(f"Chunk {i+1} left to aggregate-only coverage at the deadline")
+                aggregate_only += 1
+                await report_progress(i)
+                return [_aggregate_only_result(chunk)], 0
+            await report_progress(i)
+        # Failed chunks are not saved, so the next run of the job sends them again
+        if job_id and not any("error" in item for item in result):
+            try:
+                await checkpoints.save_chunk(job_id, i, digest, result, tokens_used)
+            except Exception as e:
+                logger.warning(f"Could not checkpoint chunk {i+1}: {e}")
+        return result, tokens_used
     
     # Create tasks for all chunks
     tasks = [process_with_semaphore(i, chunk) for i, chunk in enumerate(chunks)]
@@ -162,9 +207,31 @@ async def process_chunks(
             chunk_result, tokens_used = res
             results.extend(chunk_result)
             total_tokens += tokens_used
+
+    if aggregate_only:
+        deadline.degrade(
+            "primary",
+            f"Из-за ограничения времени {aggregate_only} из {len(chunks)} фрагментов чата не прошли "
+            "подробный анализ; для них учтены только объём переписки и участники.",
+        )
     
     return results, total_tokens
 
+
+def _aggregate_only_result(chunk: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Stand-in for a chunk the deadline left unanalysed: counts only, no model metrics."""
+    authors: Dict[str, int] = {}
+    for msg in chunk:
+        author = msg.get("author") or "Unknown"
+        authors[author] = authors.get(author, 0) + 1
+    return {
+        "author": max(authors, key=authors.get) if authors else "Unknown",
+        "timestamp": chunk[0].get("timestamp", "") if chunk else "",
+        "coverage": "aggregate_only",
+        "message_count": len(chunk),
+        "messages_per_author": authors,
+    }
+
 def extract_messages_from_text(file_path: Path) -> List[Dict[str, Any]]:
     logger.info(f"→ START extract_messages_from_text ({file_path})")
     start_ts = time.time()
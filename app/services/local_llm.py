@@ -2,11 +2,14 @@ import json
 import httpx
 import logging
 import asyncio
-from typing import Dict, Any, Optional, List
+import time
+from typing import Dict, Any, Optional, List, Tuple
 import openai
 from openai import AsyncOpenAI
 
 from app.config import settings
+from app.utils import metrics
+from app.services.cost_ledger import record_usage
 
 logger = logging.getLogger(__name__)
 
@@ -18,32 +21,45 @@ SYSTEM_PROMPT = (
     "Числовые поля – float от 0 до 1 (или -1…1 где уместно). key_quotes – массив до 3 строк."
 )
 
+# Chunk text beyond this many characters is cut off before it reaches the model
+MAX_CHUNK_CHARS = 4096
+
 async def analyse_chunk_with_llama(text: str, timeout: int = 60) -> Dict[str, Any]:
     """
     Process text chunks using OpenAI GPT-3.5-turbo model.
     This function no longer uses Ollama/Llama2 but uses OpenAI API directly.
     """
+    result, _ = await analyse_chunk(text, timeout)
+    return result
+
+
+async def analyse_chunk(text: str, timeout: int = 60, model: str = "gpt-3.5-turbo") -> Tuple[Dict[str, Any], int]:
+    """Same as analyse_chunk_with_llama, also returning the tokens the call used."""
     # Initialize OpenAI client
     client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
     
     try:
-        logger.info(f"Processing chunk with GPT-3.5-turbo, text length: {len(text[:100])}...")
+        logger.info(f"Processing chunk with {model}, text length: {len(text[:100])}...")
         
+        started = time.monotonic()
         response = await client.chat.completions.create(
-            model="gpt-3.5-turbo",
+            model=model,
             messages=[
                 {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": text[:4096]}
+                {"role": "user", "content": text[:MAX_CHUNK_CHARS]}
             ],
             temperature=0.3,
         )
+        tokens_used = await record_usage(
+            response.usage, response.model or model, stage="primary", seconds=time.monotonic() - started
+        )
         
         raw_resp = response.choices[0].message.content
         
         try:
             result = json.loads(raw_resp)
             logger.info("Successfully parsed JSON response from OpenAI")
-            return result
+            return result, tokens_used
         except json.JSONDecodeError:
             # Fallback: try to extract first JSON object
             import re
@@ -52,16 +68,18 @@ async def analyse_chunk_with_llama(text: str, timeout: int = 60) -> Dict[str, An
                 try:
                     result = json.loads(m.group(0))
                     logger.info("Successfully extracted and parsed JSON from OpenAI response")
-                    return result
+                    return result, tokens_used
                 except Exception as e:
                     logger.error(f"Failed to parse extracted JSON from OpenAI: {e}")
             
             logger.error("Failed to parse JSON response")
-            return {"error": "json_parse_error", "raw_response": raw_resp[:200]}
+            return {"error": "json_parse_error", "raw_response": raw_resp[:200]}, tokens_used
             
     except Exception as e:
         logger.error(f"OpenAI API error: {e}")
-        return {"error": "openai_api_error", "details": str(e)}
+        if isinstance(e, openai.RateLimitError):
+            metrics.LLM_RATE_LIMITED.inc(stage="primary")
+        return {"error": "openai_api_error", "details": str(e)}, 0
 
 # Keep LocalLLM class for compatibility with existing code
 class LocalLLM:
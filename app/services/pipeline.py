@@ -0,0 +1,773 @@
+import asyncio
+import io
+import logging
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import sentry_sdk
+from aiogram.enums import ParseMode
+from aiogram.types import FSInputFile, InlineKeyboardButton, InlineKeyboardMarkup, Message
+
+from app.config import settings
+from app.services import checkpoints, job_queue, report_index
+from app.services.insights import format_telegram_insights
+from app.services.jobs import Job, jobs
+from app.services.state_store import leases
+from app.utils import cleanup, metrics
+from app.utils.deadline import Deadline
+from app.utils.executor import run_in_process, run_in_thread
+from app.utils.messaging import safe_delete_message, safe_edit_message, safe_send_message
+from app.utils.telegram_outbox import Priority, outbox
+
+logger = logging.getLogger(__name__)
+
+# Background tasks (e.g. PDF delivery) are kept referenced until they finish
+_background_tasks: set = set()
+# Set once shutdown starts: new uploads are turned away, running jobs may finish
+_draining = False
+
+
+def spawn_background(coro) -> asyncio.Task:
+    """Run a coroutine in the background without letting the task be garbage-collected."""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+def _cancel_markup(job_id: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[[InlineKeyboardButton(text="✖️ Отменить анализ", callback_data=f"cancel:{job_id}")]]
+    )
+
+
+def _retry_markup(job: Optional[Job]) -> Optional[InlineKeyboardMarkup]:
+    if job is None:
+        return None
+    return InlineKeyboardMarkup(
+        inline_keyboard=[[InlineKeyboardButton(text="🔁 Повторить анализ", callback_data=f"retry:{job.job_id}")]]
+    )
+
+
+async def cancel_job(job: Job) -> str:
+    """Cancel a running job, delete its files and report what the cancellation saved."""
+    from app.services import cost_ledger
+    from app.utils.logging_utils import log_cancellation
+
+    if not await jobs.cancel(job):
+        return "Анализ уже отменяется."
+    removed = await run_in_thread(cleanup.remove_job_files, job.job_id)
+    await checkpoints.delete(job.job_id)
+    spent = await cost_ledger.job_totals(job.job_id)
+    tokens_saved = max(0, job.estimated_tokens - spent.total_tokens)
+    metrics.JOBS_CANCELLED.inc()
+    metrics.CANCELLED_TOKENS_SAVED.inc(tokens_saved)
+    await log_cancellation(str(job.user_id), job.job_id, spent.total_tokens, tokens_saved, spent.cost_usd)
+    logger.info(f"Job {job.job_id} cancelled: {removed} files removed, ~{tokens_saved} tokens saved")
+    return "🛑 Анализ отменён. Загруженный файл и промежуточные результаты удалены."
+
+
+def runner_lease(owner: str) -> str:
+    """Lease of a process running queued uploads; job_queue.recover leaves alone what live ones hold."""
+    return f"worker:{owner}"
+
+
+async def lease_heartbeat(webhook_mode: bool = False, runner: bool = False):
+    """
+    Renew this process's leases and act on cancellations requested by other
+    processes. `runner`: this process runs queued uploads itself (no workers).
+    """
+    while True:
+        await asyncio.sleep(settings.LEASE_TTL_SECONDS / 3)
+        try:
+            await jobs.renew_leases()
+            if webhook_mode:
+                await leases.acquire("webhook", settings.INSTANCE_ID, settings.LEASE_TTL_SECONDS)
+            if runner:
+                await leases.acquire(runner_lease(settings.INSTANCE_ID), settings.INSTANCE_ID, settings.LEASE_TTL_SECONDS)
+            for job in await jobs.cancel_requests():
+                logger.info(f"Job {job.job_id}: cancellation requested by another process")
+                await cancel_job(job)
+        except Exception as e:
+            logger.warning(f"Lease heartbeat failed: {e}")
+
+
+async def _send_existing_report(message: Message, entry: report_index.ReportEntry, note: str):
+    """Answer an upload with a report that was already produced for the same chat."""
+    from app.services.render import report_url as build_report_url
+
+    text = f"{entry.insights}\n\n♻️ <i>{note}</i>"
+    if settings.WEBHOOK_HOST:
+        download_markup = InlineKeyboardMarkup(
+            inline_keyboard=[[InlineKeyboardButton(
+                text="📊 Скачать полный отчет",
+                url=build_report_url(entry.pdf_path, expires=entry.expires_at),
+            )]]
+        )
+        await safe_send_message(
+            message, text, Priority.FINAL, parse_mode=ParseMode.HTML, reply_markup=download_markup
+        )
+        return
+    summary_message = await safe_send_message(message, text, Priority.FINAL, parse_mode=ParseMode.HTML)
+    document_path = entry.pdf_path if entry.pdf_path.exists() else entry.html_path
+    await outbox.call(
+        lambda: message.answer_document(
+            FSInputFile(document_path),
+            caption="Ваш полный отчет Chat X-Ray. Этот файл будет доступен в течение 72 часов.",
+            reply_to_message_id=summary_message.message_id if summary_message else None,
+        ),
+        message.chat.id,
+        Priority.FINAL,
+    )
+
+
+async def _serve_duplicate(message: Message, job: Job, key: str, lookup) -> bool:
+    """
+    Answer the upload from an identical job instead of running the pipeline:
+    attach to one that is still running, or reuse a finished report that is
+    still retained (`lookup` queries the report index). Otherwise the key is
+    claimed for this job and False is returned.
+    """
+    running = jobs.find(key, exclude=job)
+    if running is None:
+        # Claimed before any await, so a concurrent duplicate attaches to this job
+        jobs.claim(job, key)
+        holder = await jobs.claim_shared(job, key)
+        if holder is not None:
+            # Another bot process runs the same upload; its report lands in the shared index
+            logger.info(f"Job {job.job_id}: identical upload running in {holder.owner}, waiting for it")
+            await safe_send_message(
+                message, "⏳ Этот файл уже анализируется — пришлю отчёт, как только он будет готов."
+            )
+            await jobs.wait_released(key, timeout=settings.JOB_DEADLINE_SECONDS)
+            await jobs.claim_shared(job, key)
+        entry = await lookup()
+        note = "Этот чат уже анализировался недавно — отправляю готовый отчёт."
+    else:
+        logger.info(f"Job {job.job_id}: attaching to identical running job {running.job_id}")
+        await safe_send_message(
+            message, "⏳ Этот файл уже анализируется — пришлю отчёт, как только он будет готов."
+        )
+        entry = await asyncio.shield(running.outcome())
+        note = "Отчёт по этому файлу был подготовлен по вашему предыдущему запросу."
+        if entry is None:
+            # The other run failed or was cancelled; this upload runs the pipeline itself
+            jobs.claim(job, key)
+    if entry is None:
+        return False
+    logger.info(f"Job {job.job_id}: answered with the existing report of job {entry.job_id}")
+    metrics.CACHE_REQUESTS.inc(cache="report", result="hit")
+    await _send_existing_report(message, entry, note)
+    return True
+
+
+async def reject_invalid_document(message: Message) -> bool:
+    """Tell the user why the upload cannot be analysed; False if it is fine."""
+    # Check if document exists
+    if not message.document:
+        logger.warning(f"[TIMEOUT-FIX] Document not found in message from user {message.from_user.id}")
+        await safe_send_message(message, "⚠️ Документ не найден. Пожалуйста, отправьте текстовый файл или HTML-экспорт чата.")
+        return True
+    
+    # Log document details
+    logger.info(f"[TIMEOUT-FIX] Document details: name={message.document.file_name}, size={message.document.file_size}, mime={message.document.mime_type}")
+    
+    # Check MIME type or fallback to file extension for Telegram exports, which often lack correct MIME
+    valid_mime_types = ["text/plain", "text/html", "application/octet-stream"]
+    valid_extensions = [".txt", ".html", ".htm"]
+
+    file_extension = Path(message.document.file_name or "").suffix.lower()
+
+    if (message.document.mime_type not in valid_mime_types) and (file_extension not in valid_extensions):
+        logger.warning(
+            f"[TIMEOUT-FIX] Invalid file type: mime={message.document.mime_type}, ext={file_extension} from user {message.from_user.id}"
+        )
+        await safe_send_message(
+            message,
+            "⚠️ Неверный формат файла. Пожалуйста, отправьте текстовый файл (.txt) или HTML-экспорт чата (.html)."
+        )
+        return True
+    
+    # Check file size
+    if message.document.file_size > settings.MAX_FILE_SIZE:
+        logger.warning(f"[TIMEOUT-FIX] File too large: {message.document.file_size} bytes from user {message.from_user.id}")
+        await safe_send_message(
+            message,
+            f"⚠️ Файл слишком большой. Максимальный размер {settings.MAX_FILE_SIZE // (1024 * 1024)} МБ."
+        )
+        return True
+    return False
+
+
+async def analyse_document(message: Message, job_id: Optional[str] = None) -> Optional[Job]:
+    """
+    Run the analysis pipeline for an uploaded chat export and deliver the report.
+    `job_id` runs an interrupted or failed job again under its id; chunks it
+    already analysed come from its checkpoint. Returns the job (None if the
+    upload was rejected); its report may still be in delivery.
+    """
+    logger.info(f"[TIMEOUT-FIX] Document handler started for user {message.from_user.id}: {getattr(message.document, 'file_name', 'Unknown')}")
+    job_started = time.monotonic()
+    
+    if await reject_invalid_document(message):
+        return
+    
+    # All checks passed, let's download and process the file
+    logger.info(f"[TIMEOUT-FIX] File validation passed, proceeding to download and process file from user {message.from_user.id}")
+    
+    # The job stays in flight until the background delivery finishes, if it gets that far
+    metrics.JOBS_IN_FLIGHT.inc()
+    delivery_spawned = False
+    stage = "download"
+    job = None
+    try:
+        # Send acknowledgment message - THIS USED TO FAIL WITH TIMEOUT ERROR
+        logger.info("[TIMEOUT-FIX] About to send acknowledgment message using safe_send_message")
+        ack_message = await safe_send_message(
+            message,
+            "🔄 Продолжаю анализ вашего файла..." if job_id else "✅ Ваш файл получен. Начинаю анализ...",
+        )
+        logger.info("[TIMEOUT-FIX] Acknowledgment message sent successfully")
+        
+        # Process the file by importing here to avoid circular imports
+        from app.services.chunker import extract_messages
+        from app.services.planner import format_eta, plan_job
+        from app.services.llm_primary import process_chunks
+        from app.services.llm_meta import generate_meta_report, render_stored_meta_report
+        from app.services.render import render_to_pdf, report_url as build_report_url
+        from app.services import cost_ledger
+        from app.utils.logging_utils import log_cost, log_timing
+        from app.utils.report_files import write_report_html
+        from app.services.report_optimizer import optimize_report_html
+        import uuid
+        
+        # Generate unique IDs for the files
+        file_id = job_id or str(uuid.uuid4())
+        logger.info(f"Generated file ID: {file_id}")
+        cost_ledger.bind_job(file_id, str(message.from_user.id))
+        # /cancel and the cancel button cancel this task (and the delivery task later on)
+        job = jobs.register(file_id, message.from_user.id, asyncio.current_task())
+        job.message = message
+        await checkpoints.start_job(
+            file_id, str(message.from_user.id), message.chat.id, message.model_dump_json(exclude_none=True)
+        )
+        await jobs.lease(job)
+        cancel_markup = _cancel_markup(file_id)
+
+        # The same Telegram file sent again: reuse its report or its running job
+        file_unique_id = message.document.file_unique_id
+        if await _serve_duplicate(
+            message, job, f"file:{file_unique_id}", lambda: report_index.find_by_file(file_unique_id)
+        ):
+            return job
+        
+        # Set the appropriate file extension based on mime type
+        file_extension = ".html" if message.document.mime_type == "text/html" else ".txt"
+        upload_file_path = settings.UPLOAD_DIR / f"{file_id}{file_extension}"
+        report_file_path = settings.REPORT_DIR / f"{file_id}.pdf"
+        html_file_path = settings.REPORT_DIR / f"{file_id}_report.html"
+        
+        logger.info(f"File paths: upload={upload_file_path}, report={report_file_path}, html={html_file_path}")
+        
+        # Download the file into memory; the parser reads it from there. A re-run of
+        # the job reads the upload its earlier run persisted, if it is still there
+        persisted = bool(job_id and settings.PERSIST_UPLOADS and upload_file_path.exists())
+        logger.info("Reading persisted upload" if persisted else "Starting file download")
+        try:
+            if persisted:
+                upload_data = await run_in_thread(upload_file_path.read_bytes)
+            else:
+                upload_buffer = io.BytesIO()
+                with metrics.PIPELINE_STAGE_SECONDS.time(stage="download"):
+                    await message.bot.download(message.document, destination=upload_buffer)
+                upload_data = upload_buffer.getvalue()
+            logger.info(f"Upload size: {len(upload_data)} bytes")
+            if not upload_data:
+                logger.error("Downloaded file is empty")
+                metrics.JOB_FAILURES.inc(stage="download")
+                await safe_send_message(message, "❌ Ошибка: загруженный файл пуст. Пожалуйста, проверьте файл и попробуйте снова.")
+                return job
+        except Exception as download_error:
+            logger.exception(f"Error downloading file: {download_error}")
+            metrics.JOB_FAILURES.inc(stage="download")
+            await safe_send_message(message, "❌ Ошибка при загрузке файла. Пожалуйста, попробуйте снова.")
+            return job
+
+        # The same chat re-exported or forwarded arrives under a new file id
+        content_sha256 = report_index.content_sha256(upload_data)
+        if await _serve_duplicate(
+            message, job, f"sha256:{content_sha256}", lambda: report_index.find_by_content(content_sha256)
+        ):
+            return job
+        metrics.CACHE_REQUESTS.inc(cache="report", result="miss")
+        # Starts only now: waiting for an identical job that then failed must not
+        # leave this upload an expired budget and a degraded report
+        deadline = Deadline(settings.JOB_DEADLINE_SECONDS)
+
+        # Kept for the retry button and resume after a restart until the job is delivered;
+        # clean_old_uploads removes what is left after UPLOAD_RETENTION_HOURS
+        if settings.PERSIST_UPLOADS and not persisted:
+            await run_in_thread(upload_file_path.write_bytes, upload_data)
+        
+        # Let the user know we're processing and all data is anonymized
+        logger.info("Sending status message")
+        status_message = await safe_send_message(
+            message,
+            "🔍 <b>Анализирую чат...</b>\n\n"
+            "⚠️ <b>Важно:</b> Все личные данные в чате анонимизируются при обработке. "
+            "Имена заменяются общими идентификаторами, а чувствительная информация не сохраняется. "
+            "Ваша конфиденциальность важна для нас.\n\n"
+            "Это может занять минуту или две.",
+            reply_markup=cancel_markup,
+        )
+        
+        # Parse and split the chat into chunks
+        logger.info(f"Splitting chat from upload {file_id}")
+        stage = "parse"
+        with metrics.PIPELINE_STAGE_SECONDS.time(stage="parse"):
+            chat_messages = await run_in_process(extract_messages, upload_data, upload_file_path.name)
+        # The planner chunks the chat for each candidate plan and keeps the chosen one
+        stage = "chunk"
+        # A re-run keeps the plan of the first run: another chunking or model would
+        # miss every checkpointed chunk, or mix results of two models in one report
+        first_run = await checkpoints.get_job(file_id) if job_id else None
+        with metrics.PIPELINE_STAGE_SECONDS.time(stage="chunk"):
+            if first_run is not None and first_run.chunk_size:
+                plan, chunks = await plan_job(
+                    chat_messages, first_run.chunk_size, first_run.primary_model, first_run.meta_sample_size
+                )
+            else:
+                plan, chunks = await plan_job(chat_messages)
+                await checkpoints.record_plan(file_id, plan.chunk_size, plan.primary_model, plan.meta_sample_size)
+        num_chunks = len(chunks)
+        job.estimated_tokens = plan.estimated_tokens
+        logger.info(f"Split chat into {num_chunks} chunks")
+        
+        if num_chunks == 0:
+            logger.warning(f"No chunks extracted from file {upload_file_path}")
+            metrics.JOB_FAILURES.inc(stage="parse")
+            await safe_send_message(message, "⚠️ Не удалось обработать файл. Возможно, он пуст или имеет неправильный формат?")
+            if upload_file_path.exists():
+                os.unlink(upload_file_path)
+            return job
+        
+        # Progress bar helper
+        def _build_progress_bar(done: int, total: int, bar_len: int = 20) -> str:
+            """Return a unicode progress bar string."""
+            filled = int(bar_len * done / total) if total else 0
+            bar = "█" * filled + "░" * (bar_len - filled)
+            return f"[{bar}] {done}/{total}"
+
+        eta_line = f"\n\n⏱ Ориентировочное время анализа: {format_eta(plan.estimated_seconds)}"
+
+        # Initial progress message
+        await safe_edit_message(
+            status_message,
+            f"🔄 <b>Обрабатываю фрагменты данных чата</b> 0/{num_chunks}\n{_build_progress_bar(0, num_chunks)}{eta_line}",
+            parse_mode=ParseMode.HTML,
+            reply_markup=cancel_markup,
+        )
+
+        # Progress edits are queued in the outbox, where a newer one replaces one not
+        # yet sent, so they go out as fast as Telegram's limits allow
+        async def _progress_callback(done: int, total: int):
+            await safe_edit_message(
+                status_message,
+                f"🔄 <b>Обрабатываю фрагменты данных чата</b> {done}/{total}\n{_build_progress_bar(done, total)}{eta_line}",
+                Priority.PROGRESS,
+                parse_mode=ParseMode.HTML,
+                reply_markup=cancel_markup,
+            )
+
+        stage = "primary"
+        with metrics.PIPELINE_STAGE_SECONDS.time(stage="primary_job"):
+            analysis_results, primary_tokens = await process_chunks(
+                chunks,
+                progress_callback=_progress_callback,
+                model=plan.primary_model,
+                deadline=deadline,
+                reserve_seconds=plan.meta_seconds,
+                job_id=file_id,
+            )
+        logger.info(f"Successfully processed {len(analysis_results)} chunk results")
+        total_messages = sum(len(chunk) for chunk in chunks)
+        await checkpoints.record_primary(file_id, num_chunks, total_messages, analysis_results)
+        
+        # Generate meta report with GPT-4
+        logger.info(f"Starting meta report generation with {settings.META_MODEL}")
+        await safe_edit_message(
+            status_message, "✨ Создаю психологические выводы и генерирую отчет...", reply_markup=cancel_markup
+        )
+        
+        meta_stream_path = settings.REPORT_DIR / f"{file_id}_meta.json"
+        # An earlier run that got past the meta stage (e.g. stopped during delivery by a
+        # shutdown) left its meta output: render that rather than pay for the call again
+        stored_analysis = await checkpoints.load_analysis(file_id) if job_id else None
+        meta_seconds = 0 if stored_analysis else plan.meta_seconds
+
+        # Degrade what is left of the job if the meta report would run into the deadline
+        meta_sample_size = plan.meta_sample_size
+        if deadline.remaining() < meta_seconds * 1.5 and meta_sample_size > settings.DEADLINE_META_SAMPLE_SIZE:
+            meta_sample_size = settings.DEADLINE_META_SAMPLE_SIZE
+            deadline.degrade(
+                "meta_sample",
+                f"Из-за ограничения времени итоговые выводы построены по сокращённой выборке "
+                f"(до {meta_sample_size} фрагментов).",
+            )
+        if not settings.WEBHOOK_HOST and deadline.remaining() - meta_seconds < settings.DEADLINE_PDF_RESERVE_SECONDS:
+            # The webhook server renders PDFs on download, so only the local mode has a render to skip
+            deadline.degrade("pdf", "Из-за ограничения времени отчёт отправлен в формате HTML, без PDF-версии.")
+
+        async def _meta_progress_callback(done: int, total: int, title: str):
+            text = "✨ Создаю психологические выводы и генерирую отчет...\n\n"
+            if title:
+                text += f"✍️ Пишу раздел «{title}»\n{_build_progress_bar(done, total)}"
+            else:
+                text += "✍️ Модель начала писать отчет..."
+            await safe_edit_message(status_message, text, Priority.PROGRESS, reply_markup=cancel_markup)
+
+        try:
+            stage = "meta"
+            with metrics.PIPELINE_STAGE_SECONDS.time(stage="meta"):
+                meta_report = None
+                if stored_analysis is not None:
+                    logger.info(f"Job {file_id}: rendering the meta output of an earlier run")
+                    meta_report = await render_stored_meta_report(
+                        analysis_results,
+                        total_messages,
+                        stored_analysis.meta_content,
+                        stored_analysis.sample_note,
+                        stored_analysis.notes,
+                    )
+                if meta_report is None:
+                    meta_report = await generate_meta_report(
+                        analysis_results,
+                        total_messages,
+                        stream_path=meta_stream_path,
+                        progress_callback=_meta_progress_callback,
+                        sample_size=meta_sample_size,
+                        deadline=deadline,
+                    )
+            if meta_report.error is not None:
+                # Rate limits, API errors and unparseable output: nothing to deliver or index
+                logger.error(f"Job {file_id}: meta report failed: {meta_report.error}")
+                metrics.JOB_FAILURES.inc(stage="meta")
+                await safe_edit_message(
+                    status_message,
+                    "⚠️ Не удалось создать итоговый отчет.\n\n"
+                    "Это обычно происходит при обработке очень больших чатов или в периоды пиковой нагрузки.\n\n"
+                    "Нажмите «Повторить анализ» через несколько минут — уже проанализированные фрагменты не придётся обрабатывать заново.",
+                    Priority.FINAL,
+                    reply_markup=_retry_markup(job),
+                )
+                return job
+            html_content, meta_tokens = meta_report.html, meta_report.tokens
+            logger.info("Successfully generated meta report HTML content")
+
+            # The Telegram summary comes from the structured meta output, so it is
+            # ready before the PDF render starts
+            telegram_insights = format_telegram_insights(meta_report.insights)
+            
+            # Save HTML content to file
+            logger.info(f"Saving HTML content to {html_file_path}")
+            optimized_html = await run_in_thread(optimize_report_html, html_content)
+            await run_in_thread(write_report_html, html_file_path, optimized_html)
+
+            # Stored next to the primary results, so the report can be rendered again without the model
+            if meta_report.raw_content:
+                try:
+                    await checkpoints.record_meta(
+                        file_id, meta_report.raw_content, meta_report.sample_note, meta_report.notes
+                    )
+                except Exception as checkpoint_error:
+                    logger.warning(f"Could not store meta output of {file_id}: {checkpoint_error}")
+
+            # Cost comes from the usage the API reported for every call of this job
+            logger.info(f"Tokens used: primary={primary_tokens}, meta={meta_tokens}")
+            job_usage = await cost_ledger.job_totals(file_id)
+            await log_cost(str(message.from_user.id), num_chunks, job_usage.cost_usd, job_id=file_id, usage=job_usage)
+            
+            # Phase 1: deliver the summary as soon as the meta report exists
+            logger.info("Sending insights message")
+            await safe_delete_message(status_message)
+            summary_message = await safe_send_message(
+                message,
+                telegram_insights + "\n\n⏳ <i>Готовлю полный PDF-отчет...</i>",
+                Priority.FINAL,
+                parse_mode=ParseMode.HTML
+            )
+            time_to_summary = time.monotonic() - job_started
+            logger.info(f"Summary delivered {time_to_summary:.1f}s after upload")
+
+            # Phase 2: render the PDF in the background and attach it to the summary when ready
+            async def _deliver_report():
+                delivery_started = time.monotonic()
+                delivered = None
+                try:
+                    # Add metadata to track file expiration
+                    logger.info("Adding file expiration metadata")
+                    expiration_time = datetime.now().timestamp() + (settings.REPORT_RETENTION_HOURS * 3600)
+                    with open(f"{html_file_path}.meta", "w") as f:
+                        f.write(str(expiration_time))
+
+                    if settings.WEBHOOK_HOST and not settings.WORKERS:
+                        # The /reports/ handler renders the PDF on first download
+                        report_url = build_report_url(report_file_path, expires=expiration_time)
+                    elif settings.WEBHOOK_HOST:
+                        # Worker process: render now, so the web front end only serves the file
+                        # (it still renders on download if this fails)
+                        with metrics.PIPELINE_STAGE_SECONDS.time(stage="pdf_render"):
+                            await render_to_pdf(html_file_path, report_file_path)
+                        if report_file_path.exists():
+                            with open(f"{report_file_path}.meta", "w") as f:
+                                f.write(str(expiration_time))
+                        report_url = build_report_url(report_file_path, expires=expiration_time)
+                    elif deadline.degraded("pdf"):
+                        logger.info("Skipping PDF render to meet the job deadline; sending HTML")
+                        report_url = build_report_url(html_file_path)
+                    else:
+                        logger.info(f"Rendering HTML to PDF at {report_file_path}")
+                        with metrics.PIPELINE_STAGE_SECONDS.time(stage="pdf_render"):
+                            report_url = await render_to_pdf(html_file_path, report_file_path)
+                        if report_file_path.exists():
+                            with open(f"{report_file_path}.meta", "w") as f:
+                                f.write(str(expiration_time))
+                    logger.info(f"Report URL: {report_url}")
+
+                    # If we're in local mode without a webhook, just send the file directly
+                    if not settings.WEBHOOK_HOST:
+                        logger.info("Running in local mode, sending file directly")
+                        if summary_message:
+                            await safe_edit_message(
+                                summary_message, telegram_insights, Priority.FINAL, parse_mode=ParseMode.HTML
+                            )
+                        document_path = report_file_path if report_file_path.exists() else html_file_path
+                        sent_document = await outbox.call(
+                            lambda: message.answer_document(
+                                FSInputFile(document_path),
+                                caption="Ваш полный отчет Chat X-Ray готов. Этот файл будет доступен в течение 72 часов.",
+                                reply_to_message_id=summary_message.message_id if summary_message else None,
+                            ),
+                            message.chat.id,
+                            Priority.FINAL,
+                        )
+                        if sent_document:
+                            logger.info("Document sent successfully")
+                    else:
+                        # In production with webhook, attach the download button to the summary
+                        logger.info("Running in webhook mode, adding download button to the summary")
+                        download_markup = InlineKeyboardMarkup(
+                            inline_keyboard=[
+                                [InlineKeyboardButton(
+                                    text="📊 Скачать полный отчет",
+                                    url=report_url
+                                )]
+                            ]
+                        )
+                        edited = None
+                        if summary_message:
+                            edited = await safe_edit_message(
+                                summary_message, telegram_insights, Priority.FINAL,
+                                parse_mode=ParseMode.HTML, reply_markup=download_markup
+                            )
+                        if not edited:
+                            await safe_send_message(
+                                message,
+                                "📋 Для получения полного отчета нажмите на кнопку ниже:",
+                                Priority.FINAL,
+                                reply_markup=download_markup
+                            )
+
+                    # Delivered: nothing will run the job again
+                    if upload_file_path.exists():
+                        os.unlink(upload_file_path)
+
+                    metrics.PIPELINE_STAGE_SECONDS.observe(time.monotonic() - delivery_started, stage="delivery")
+                    await log_timing(str(message.from_user.id), file_id, time_to_summary, time.monotonic() - job_started)
+                    logger.info(f"Successfully completed processing file for user {message.from_user.id}")
+
+                    delivered = report_index.ReportEntry(
+                        job_id=file_id,
+                        user_id=str(message.from_user.id),
+                        file_unique_id=file_unique_id,
+                        content_sha256=content_sha256,
+                        insights=telegram_insights,
+                        html_path=html_file_path,
+                        pdf_path=report_file_path,
+                        created_at=time.time(),
+                        expires_at=expiration_time,
+                    )
+                    # Later identical uploads get this report until it expires; a report cut
+                    # short by the deadline is not reused, those get a full run instead
+                    if meta_report.raw_content and not deadline.notes():
+                        try:
+                            await report_index.record_report(delivered)
+                        except Exception as index_error:
+                            logger.warning(f"Could not index report {file_id}: {index_error}")
+                except Exception as deliver_error:
+                    logger.exception(f"Error delivering full report: {deliver_error}")
+                    metrics.JOB_FAILURES.inc(stage="delivery")
+                    await safe_send_message(
+                        message,
+                        "❌ Не удалось подготовить полный отчет. Краткие выводы выше остаются актуальными.",
+                        Priority.FINAL,
+                    )
+                finally:
+                    metrics.JOBS_IN_FLIGHT.dec()
+                    jobs.finish(file_id, delivered)
+
+            jobs.attach(file_id, spawn_background(_deliver_report()))
+            delivery_spawned = True
+
+        except Exception as e:
+            logger.exception(f"Error in meta analysis: {e}")
+            metrics.JOB_FAILURES.inc(stage=stage)
+            await safe_edit_message(
+                status_message,
+                "❌ Произошла ошибка при создании отчета.\n\n"
+                f"Детали ошибки: {str(e)}\n\n"
+                "Пожалуйста, попробуйте еще раз или обратитесь в поддержку, если проблема не исчезнет.",
+                Priority.FINAL,
+                reply_markup=_retry_markup(job),
+            )
+            
+    except asyncio.CancelledError:
+        if not (job and job.cancelled):
+            raise
+        # Cancelled from /cancel or the button; _cancel_job cleans up and tells the user
+        logger.info(f"Job {job.job_id} stopped during {stage}")
+        asyncio.current_task().uncancel()
+    except Exception as e:
+        logger.exception(f"Error processing file: {e}")
+        metrics.JOB_FAILURES.inc(stage=stage)
+        if settings.SENTRY_DSN:
+            sentry_sdk.capture_exception(e)
+
+        # A persisted upload stays in place for the retry button (see PERSIST_UPLOADS)
+        await safe_send_message(
+            message,
+            "❌ Извините, произошла ошибка при обработке вашего файла. Пожалуйста, попробуйте позже.",
+            Priority.FINAL,
+            reply_markup=_retry_markup(job),
+        )
+    finally:
+        if not delivery_spawned:
+            metrics.JOBS_IN_FLIGHT.dec()
+            if job:
+                jobs.finish(job.job_id)
+    return job
+
+
+def draining() -> bool:
+    return _draining
+
+
+async def drain(grace: float) -> int:
+    """
+    Shutdown: stop taking uploads and give running jobs `grace` seconds to
+    finish. Jobs still running then are cancelled - keeping their files and
+    partial results - and queued to resume after the restart. A resumed job
+    takes stored chunk results and, if it got that far, its stored meta output
+    instead of calling the model again. Returns how many were queued.
+    """
+    global _draining
+    _draining = True
+    deadline = time.monotonic() + grace
+    if jobs.running():
+        logger.info(f"Shutdown: waiting up to {grace:.0f}s for {len(jobs.running())} running jobs")
+    while jobs.running() and time.monotonic() < deadline:
+        await asyncio.sleep(0.5)
+
+    interrupted = 0
+    for job in jobs.running():
+        message = job.message
+        await jobs.cancel(job)
+        if message is None:
+            continue
+        try:
+            await job_queue.enqueue(
+                message.model_dump_json(exclude_none=True), str(job.user_id), message.chat.id, job_id=job.job_id
+            )
+        except Exception as e:
+            logger.error(f"Job {job.job_id}: could not queue it for resume: {e}")
+            continue
+        interrupted += 1
+        metrics.JOBS_INTERRUPTED.inc()
+        logger.info(f"Job {job.job_id} interrupted by shutdown, queued for resume")
+        await safe_send_message(
+            message,
+            "🔄 Бот перезапускается. Анализ вашего файла продолжится автоматически сразу после перезапуска.",
+            Priority.FINAL,
+        )
+    return interrupted
+
+
+async def notify_queued(bot) -> None:
+    """Shutdown with workers: tell users whose uploads are still queued that they keep their place."""
+    notified = set()
+    for queued in await job_queue.waiting():
+        if queued.job_id or queued.chat_id in notified:
+            continue  # interrupted jobs: the worker told the user already
+        notified.add(queued.chat_id)
+        message = Message.model_validate_json(queued.message).as_(bot)
+        await safe_send_message(
+            message, "🔄 Бот перезапускается. Ваш файл остаётся в очереди и будет обработан сразу после перезапуска."
+        )
+
+
+async def run_queued(bot, queued: job_queue.QueuedJob) -> None:
+    """Run an upload taken from the job queue and record how it ended."""
+    message = Message.model_validate_json(queued.message).as_(bot)
+    status = job_queue.FAILED
+    job = None
+    try:
+        job = await analyse_document(message, job_id=queued.job_id)
+        if job is not None and jobs.get(job.job_id) is job:
+            # The summary is out; wait for the report delivery before taking the slot back
+            await job.outcome()
+        status = job_queue.DONE
+    except asyncio.CancelledError:
+        if not (job and job.cancelled):
+            raise
+        asyncio.current_task().uncancel()
+    except Exception as e:
+        logger.exception(f"Queued upload {queued.id} failed: {e}")
+    finally:
+        if job is not None and job.cancelled:
+            # Shutdown queued the job again under a new queue entry
+            status = job_queue.INTERRUPTED if _draining else job_queue.CANCELLED
+        await job_queue.finish(queued.id, status)
+
+
+async def retry_job(bot, job_id: str, user_id: int) -> bool:
+    """
+    Run a failed job again under its id, from the upload message it recorded;
+    chunks it already analysed come from its checkpoint. False if the job is
+    unknown, not the user's or still running.
+    """
+    record = await checkpoints.get_job(job_id)
+    if record is None or record.user_id != str(user_id):
+        return False
+    if jobs.get(job_id) is not None or await leases.get(f"job:{job_id}") is not None:
+        return False
+    if settings.WORKERS:
+        await job_queue.enqueue(record.message, record.user_id, record.chat_id, job_id=job_id)
+    else:
+        spawn_background(analyse_document(Message.model_validate_json(record.message).as_(bot), job_id=job_id))
+    return True
+
+
+async def resume_interrupted(bot) -> None:
+    """Single-process mode: run the jobs the previous run queued for resume on shutdown."""
+    try:
+        # Held like a worker's lease, so replicas sharing the state DB don't take back what this one runs
+        await leases.acquire(runner_lease(settings.INSTANCE_ID), settings.INSTANCE_ID, settings.LEASE_TTL_SECONDS)
+        await job_queue.recover([lease.owner for lease in await leases.list(runner_lease(""))])
+        while not _draining and (queued := await job_queue.claim(settings.INSTANCE_ID)) is not None:
+            logger.info(f"Resuming queued upload {queued.id} (job {queued.job_id})")
+            spawn_background(run_queued(bot, queued))
+    except Exception as e:
+        logger.error(f"Could not resume interrupted jobs: {e}")
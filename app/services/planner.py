@@ -0,0 +1,196 @@
+import itertools
+import logging
+import math
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.services import cost_ledger
+from app.services.chunker import chunk_messages, count_tokens
+from app.services.llm_meta import META_PROMPT
+from app.services.local_llm import MAX_CHUNK_CHARS, SYSTEM_PROMPT
+from app.utils.executor import run_in_thread
+
+logger = logging.getLogger(__name__)
+
+Chunks = List[List[Dict[str, Any]]]
+
+# Prompt shape of the meta call: each primary result is one compact JSON object,
+# and up to 200 key quotes ride along
+META_TOKENS_PER_RESULT = 120
+META_TOKENS_PER_QUOTE = 30
+META_MAX_QUOTES = 200
+
+
+@dataclass
+class Throughput:
+    seconds_per_call: float
+    completion_tokens_per_call: float
+
+
+# Used until the cost ledger has enough timed calls for a model/stage
+DEFAULT_THROUGHPUT = {
+    "primary": Throughput(seconds_per_call=4.0, completion_tokens_per_call=250),
+    "meta": Throughput(seconds_per_call=90.0, completion_tokens_per_call=3000),
+}
+
+
+@dataclass
+class ExecutionPlan:
+    chunk_size: int
+    primary_model: str
+    meta_sample_size: int
+    chunks: int
+    coverage: float  # share of the chat text the primary model gets to see
+    primary_prompt_tokens: int
+    meta_prompt_tokens: int
+    estimated_cost_usd: float
+    estimated_seconds: float
+    meta_seconds: float
+    estimated_tokens: int
+    within_limits: bool
+
+    @property
+    def meta_coverage(self) -> float:
+        """Share of the primary results (one per chunk) the meta sample keeps."""
+        return round(min(1.0, self.meta_sample_size / self.chunks), 2) if self.chunks else 1.0
+
+    def describe(self) -> str:
+        return (
+            f"chunk_size={self.chunk_size} model={self.primary_model} meta_sample={self.meta_sample_size} "
+            f"chunks={self.chunks} coverage={self.coverage:.0%} cost=${self.estimated_cost_usd:.4f} "
+            f"eta={self.estimated_seconds:.0f}s within_limits={self.within_limits}"
+        )
+
+
+def format_eta(seconds: float) -> str:
+    """User-facing ETA for the status message."""
+    if seconds < 60:
+        return "меньше минуты"
+    return f"~{math.ceil(seconds / 60)} мин"
+
+
+def _chunking_profile(chunks: Chunks) -> Tuple[int, float]:
+    """Prompt tokens the primary calls will send and the share of text that survives truncation."""
+    system_tokens = count_tokens(SYSTEM_PROMPT)
+    prompt_tokens = 0
+    total_chars = kept_chars = 0
+    for chunk in chunks:
+        text = "\n\n".join(m["raw"] for m in chunk)
+        kept = min(len(text), MAX_CHUNK_CHARS)
+        total_chars += len(text)
+        kept_chars += kept
+        prompt_tokens += system_tokens + int(count_tokens(text) * kept / len(text) if text else 0)
+    return prompt_tokens, (kept_chars / total_chars if total_chars else 1.0)
+
+
+def choose_plan(
+    messages: List[Dict[str, Any]],
+    primary_throughput: Dict[str, Throughput],
+    meta_throughput: Throughput,
+    chunk_sizes: Optional[List[int]] = None,
+    meta_sample_sizes: Optional[List[int]] = None,
+) -> Tuple[ExecutionPlan, Chunks]:
+    """
+    Estimate every candidate plan and pick one.
+
+    Among plans within JOB_SLA_SECONDS and JOB_BUDGET_USD, the one with the best
+    coverage (no truncated chunks, then the largest meta sample) wins, and the
+    cheapest of those. If nothing fits, the plan that overshoots the limits least
+    is used. Returns the plan and the chunks it was estimated on. Candidates are
+    PLANNER_CHUNK_SIZES x models x PLANNER_META_SAMPLE_SIZES unless lists are given.
+    """
+    chunk_sizes = chunk_sizes or settings.PLANNER_CHUNK_SIZES
+    meta_sample_sizes = meta_sample_sizes or settings.PLANNER_META_SAMPLE_SIZES
+    chunkings = {size: chunk_messages(messages, max_messages=size) for size in chunk_sizes}
+    profiles = {size: _chunking_profile(chunks) for size, chunks in chunkings.items()}
+    meta_base_tokens = count_tokens(META_PROMPT)
+    waves_per_chunk = 1 / max(1, settings.OPENAI_CONCURRENCY_LIMIT)
+
+    plans: List[ExecutionPlan] = []
+    for size, model, sample in itertools.product(chunk_sizes, primary_throughput, meta_sample_sizes):
+        chunks = chunkings[size]
+        primary_prompt, coverage = profiles[size]
+        primary = primary_throughput[model]
+        primary_completion = int(len(chunks) * primary.completion_tokens_per_call)
+        # Primary analysis yields one result per chunk, which is what the meta sample draws from
+        sampled = min(len(chunks), sample)
+        meta_prompt = (
+            meta_base_tokens
+            + sampled * META_TOKENS_PER_RESULT
+            + min(META_MAX_QUOTES, 2 * len(chunks)) * META_TOKENS_PER_QUOTE
+        )
+        cost = (
+            cost_ledger.usage_cost(model, primary_prompt, 0, primary_completion)
+            + cost_ledger.usage_cost(settings.META_MODEL, meta_prompt, 0, int(meta_throughput.completion_tokens_per_call))
+        )
+        seconds = math.ceil(len(chunks) * waves_per_chunk) * primary.seconds_per_call + meta_throughput.seconds_per_call
+        plans.append(ExecutionPlan(
+            chunk_size=size,
+            primary_model=model,
+            meta_sample_size=sample,
+            chunks=len(chunks),
+            coverage=coverage,
+            primary_prompt_tokens=primary_prompt,
+            meta_prompt_tokens=meta_prompt,
+            estimated_cost_usd=cost,
+            estimated_seconds=seconds,
+            meta_seconds=meta_throughput.seconds_per_call,
+            estimated_tokens=(
+                primary_prompt + primary_completion + meta_prompt + int(meta_throughput.completion_tokens_per_call)
+            ),
+            within_limits=seconds <= settings.JOB_SLA_SECONDS and cost <= settings.JOB_BUDGET_USD,
+        ))
+
+    feasible = [p for p in plans if p.within_limits]
+    if feasible:
+        plan = min(feasible, key=lambda p: (
+            -round(p.coverage, 2), -p.meta_coverage, p.estimated_cost_usd, p.estimated_seconds
+        ))
+    else:
+        plan = min(plans, key=lambda p: max(
+            p.estimated_seconds / settings.JOB_SLA_SECONDS, p.estimated_cost_usd / settings.JOB_BUDGET_USD
+        ))
+    return plan, chunkings[plan.chunk_size]
+
+
+async def _throughput(model: str, stage: str) -> Throughput:
+    since = time.time() - settings.PLANNER_HISTORY_DAYS * 86400
+    try:
+        history = await cost_ledger.throughput(model, stage, since)
+    except Exception as e:
+        logger.warning(f"Could not read throughput history for {model}/{stage}: {e}")
+        history = None
+    if not history or history["calls"] < settings.PLANNER_MIN_SAMPLES:
+        return DEFAULT_THROUGHPUT[stage]
+    return Throughput(
+        seconds_per_call=history["seconds"],
+        completion_tokens_per_call=history["completion_tokens"],
+    )
+
+
+async def plan_job(
+    messages: List[Dict[str, Any]],
+    chunk_size: Optional[int] = None,
+    primary_model: Optional[str] = None,
+    meta_sample_size: Optional[int] = None,
+) -> Tuple[ExecutionPlan, Chunks]:
+    """
+    Pick an execution plan for a parsed upload, using throughput observed in the cost ledger.
+    Values given pin that part of the plan: a resumed job keeps the chunking and model
+    of its first run, so its checkpointed chunk results still apply.
+    """
+    models = [primary_model] if primary_model else settings.PLANNER_PRIMARY_MODELS or [settings.PRIMARY_MODEL]
+    primary = {model: await _throughput(model, "primary") for model in models}
+    meta = await _throughput(settings.META_MODEL, "meta")
+    plan, chunks = await run_in_thread(
+        choose_plan,
+        messages,
+        primary,
+        meta,
+        [chunk_size] if chunk_size else None,
+        [meta_sample_size] if meta_sample_size else None,
+    )
+    logger.info(f"Execution plan for {len(messages)} messages: {plan.describe()}")
+    return plan, chunks
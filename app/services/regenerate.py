@@ -0,0 +1,139 @@
+import argparse
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+from app.config import settings
+from app.services import checkpoints, report_index
+from app.services.insights import format_telegram_insights
+from app.services.llm_meta import render_stored_meta_report
+from app.services.render import render_pdf_file
+from app.services.report_optimizer import optimize_report_html
+from app.utils import metrics
+from app.utils.executor import run_in_thread
+from app.utils.report_files import remove_compressed_variants, write_report_html
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RegeneratedReport:
+    job_id: str
+    html_path: Path
+    pdf_path: Optional[Path]  # None unless rendered right away
+    insights: str  # Telegram summary, HTML-formatted
+    seconds: float
+
+
+def _report_expiry(html_path: Path) -> float:
+    """Expiration of the report being replaced; a report already cleaned up gets a fresh retention period."""
+    try:
+        return float(Path(f"{html_path}.meta").read_text().strip())
+    except (OSError, ValueError):
+        return time.time() + settings.REPORT_RETENTION_HOURS * 3600
+
+
+def _write_report(html_path: Path, pdf_path: Path, html_content: str, expires: float) -> None:
+    # A variant not smaller than the new HTML is not rewritten, so old ones must go first
+    remove_compressed_variants(str(html_path))
+    write_report_html(html_path, html_content)
+    Path(f"{html_path}.meta").write_text(str(expires))
+    # A PDF rendered from the old HTML would keep being served; the next download renders it again
+    for stale in (pdf_path, Path(f"{pdf_path}.meta")):
+        if stale.exists():
+            os.unlink(stale)
+
+
+async def regenerate_report(job_id: str, pdf: bool = False) -> Optional[RegeneratedReport]:
+    """
+    Render a job's report again from its stored analysis (primary results plus the
+    meta model's output) with the current template, CSS and charts. No model is
+    called. The HTML replaces the old one under the same name, so existing links
+    serve the new version; the old PDF is dropped, or rendered again now if `pdf`.
+    Returns None if the job's analysis is not stored (unfinished or pruned).
+    """
+    started = time.monotonic()
+    analysis = await checkpoints.load_analysis(job_id)
+    if analysis is None:
+        return None
+
+    report = await render_stored_meta_report(
+        analysis.primary.results,
+        analysis.primary.total_messages,
+        analysis.meta_content,
+        analysis.sample_note,
+        analysis.notes,
+    )
+    if report is None:
+        raise ValueError(f"Stored meta output of job {job_id} could not be parsed")
+
+    html_path = settings.REPORT_DIR / f"{job_id}_report.html"
+    pdf_path = settings.REPORT_DIR / f"{job_id}.pdf"
+    expires = _report_expiry(html_path)
+    optimized_html = await run_in_thread(optimize_report_html, report.html)
+    await run_in_thread(_write_report, html_path, pdf_path, optimized_html, expires)
+
+    if pdf:
+        with metrics.PIPELINE_STAGE_SECONDS.time(stage="pdf_render"):
+            await render_pdf_file(html_path, pdf_path)
+        Path(f"{pdf_path}.meta").write_text(str(expires))
+
+    # Identical uploads are answered with the index's summary; keep it in line with the report
+    insights = format_telegram_insights(report.insights)
+    await report_index.update_insights(job_id, insights)
+
+    metrics.REPORTS_REGENERATED.inc()
+    seconds = time.monotonic() - started
+    logger.info(f"Regenerated report {job_id} in {seconds:.2f}s")
+    return RegeneratedReport(
+        job_id=job_id,
+        html_path=html_path,
+        pdf_path=pdf_path if pdf else None,
+        insights=insights,
+        seconds=seconds,
+    )
+
+
+async def regenerate_reports(job_ids: List[str], pdf: bool = False) -> int:
+    """Regenerate several reports one after another; returns how many were rendered."""
+    done = 0
+    for job_id in job_ids:
+        try:
+            result = await regenerate_report(job_id, pdf=pdf)
+        except Exception as e:
+            logger.exception(f"Could not regenerate report {job_id}: {e}")
+            continue
+        if result is None:
+            logger.warning(f"No stored analysis for job {job_id}")
+            continue
+        done += 1
+    return done
+
+
+if __name__ == "__main__":
+    # Re-render reports after a template, CSS or chart change, e.g.
+    #   python -m app.services.regenerate --all
+    #   python -m app.services.regenerate <job_id> --pdf
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+
+    parser = argparse.ArgumentParser(description="Render stored reports again without calling the model")
+    parser.add_argument("job_ids", nargs="*", help="jobs to regenerate")
+    parser.add_argument("--all", action="store_true", help="every job whose analysis is still stored")
+    parser.add_argument("--pdf", action="store_true", help="render PDFs now instead of on first download")
+    args = parser.parse_args()
+    if not args.job_ids and not args.all:
+        parser.error("give job ids or --all")
+
+    async def _main() -> int:
+        job_ids = args.job_ids or await checkpoints.rendered_jobs()
+        return await regenerate_reports(job_ids, pdf=args.pdf)
+
+    regenerated = asyncio.run(_main())
+    logger.info(f"Regenerated {regenerated} reports")
@@ -1,12 +1,243 @@
+import asyncio
+import inspect
+import io
 import logging
 import os
-import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Optional
 
 from app.config import settings
+from app.services.report_template import REPORT_CSS
+from app.utils import metrics
+from app.utils.signing import signed_query
 
 logger = logging.getLogger(__name__)
 
+def report_url(path: Path, expires: Optional[float] = None) -> str:
+    """
+    Public URL of a file in REPORT_DIR (webhook mode) or a local file:// URL.
+
+    Public URLs are HMAC-signed and stop working at `expires`, which defaults
+    to the expiration stored in the file's `.meta`.
+    """
+    if not settings.WEBHOOK_HOST:
+        return f"file://{path}"
+
+    if expires is None:
+        try:
+            with open(f"{path}.meta", "r") as f:
+                expires = float(f.read().strip())
+        except (OSError, ValueError):
+            expires = time.time() + settings.REPORT_RETENTION_HOURS * 3600
+    file_name = os.path.basename(path)
+    return f"{settings.WEBHOOK_HOST}/reports/{file_name}?{signed_query(file_name, expires)}"
+
+
+# Minimal document used to load fonts and the stylesheet before the first real report
+_WARMUP_HTML = (
+    '<!DOCTYPE html><html><head><meta charset="UTF-8"><style>' + REPORT_CSS + "</style></head>"
+    "<body><h1>Chat X-Ray</h1><h2>Прогрев</h2><p>Warm-up</p><div class=\"quote\"><p>«…»</p></div>"
+    '<svg width="10" height="10"><text x="0" y="10">0</text></svg></body></html>'
+)
+
+
+class PdfRenderer:
+    """
+    Long-lived WeasyPrint renderer.
+
+    WeasyPrint is imported and its API detected once, a single FontConfiguration is
+    shared by all renders, and the report stylesheet is parsed once: when a document
+    embeds the standard REPORT_CSS block it is swapped for the pre-parsed CSS object.
+    Fonts are subset to the glyphs used, whichever WeasyPrint version is installed.
+    Renders run one at a time on a dedicated thread, off the event loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._load_error: Optional[Exception] = None
+        self._weasyprint = None
+        self._font_config = None
+        self._stylesheet = None
+        self._supports_font_config = False
+        self._pdf_options: dict = {}
+        self._inline_style = f"<style>{REPORT_CSS}</style>"
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf-render")
+
+    def _load(self) -> None:
+        with self._lock:
+            if self._loaded:
+                if self._load_error:
+                    raise self._load_error
+                return
+            self._loaded = True
+            try:
+                import weasyprint
+                try:
+                    # WeasyPrint 53+
+                    from weasyprint.text.fonts import FontConfiguration
+                except ImportError:
+                    from weasyprint.fonts import FontConfiguration
+
+                self._weasyprint = weasyprint
+                params = inspect.signature(weasyprint.HTML.write_pdf).parameters
+                self._supports_font_config = "font_config" in params
+                # Embed only the glyphs used and recompress images
+                if "optimize_size" in params:
+                    # WeasyPrint 53-59
+                    self._pdf_options = {"optimize_size": ("fonts", "images")}
+                elif "full_fonts" in getattr(weasyprint, "DEFAULT_OPTIONS", {}):
+                    # WeasyPrint 60+
+                    self._pdf_options = {"full_fonts": False, "hinting": False, "optimize_images": True}
+                self._font_config = FontConfiguration()
+                self._stylesheet = weasyprint.CSS(string=REPORT_CSS, font_config=self._font_config)
+                logger.info(f"WeasyPrint {weasyprint.__version__} loaded (shared font config: {self._supports_font_config})")
+            except Exception as e:
+                self._load_error = e
+                raise
+
+    def render(self, html_content: str, target) -> None:
+        """Render an HTML string to `target` (path or binary file object). Blocking."""
+        self._load()
+        options = dict(self._pdf_options)
+        if self._inline_style in html_content:
+            html_content = html_content.replace(self._inline_style, "", 1)
+            options["stylesheets"] = [self._stylesheet]
+        if self._supports_font_config:
+            options["font_config"] = self._font_config
+        self._weasyprint.HTML(string=html_content).write_pdf(target, **options)
+
+    def warm_up(self) -> None:
+        """Load WeasyPrint, fonts and the stylesheet by rendering a tiny document. Blocking."""
+        started = time.monotonic()
+        self.render(_WARMUP_HTML, io.BytesIO())
+        logger.info(f"PDF renderer warmed up in {time.monotonic() - started:.2f}s")
+
+    async def run(self, func, *args):
+        """Run a blocking render function on the renderer thread."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def prewarm(self) -> None:
+        try:
+            await self.run(self.warm_up)
+        except Exception as e:
+            logger.warning(f"PDF renderer warm-up failed, will use the fallback renderer: {e}")
+
+
+pdf_renderer = PdfRenderer()
+
+
+# Bounds concurrent wkhtmltopdf processes; each one is a full browser engine
+_wkhtmltopdf_slots = asyncio.Semaphore(settings.WKHTMLTOPDF_CONCURRENCY)
+
+
+def _record_wkhtmltopdf_stderr(stderr: bytes) -> None:
+    text = stderr.decode("utf-8", errors="replace").strip()
+    if not text:
+        return
+    for line in text.splitlines():
+        level = "error" if "error" in line.lower() else "warning"
+        metrics.WKHTMLTOPDF_STDERR_LINES.inc(level=level)
+    logger.warning(f"wkhtmltopdf stderr: {text[:2000]}")
+
+
+async def _render_wkhtmltopdf(html_content: str, pdf_path: Path) -> None:
+    """
+    Render with wkhtmltopdf as an asyncio subprocess, feeding the HTML via stdin.
+
+    At most WKHTMLTOPDF_CONCURRENCY processes run at once; a render that exceeds
+    WKHTMLTOPDF_TIMEOUT_SECONDS or whose caller is cancelled is killed.
+    """
+    async with _wkhtmltopdf_slots:
+        started = time.monotonic()
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                "wkhtmltopdf", "--quiet", "--encoding", "utf-8", "-", str(pdf_path),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        except FileNotFoundError:
+            metrics.WKHTMLTOPDF_RENDERS.inc(outcome="unavailable")
+            raise Exception("wkhtmltopdf failed: executable not found")
+
+        try:
+            _, stderr = await asyncio.wait_for(
+                proc.communicate(html_content.encode("utf-8")),
+                timeout=settings.WKHTMLTOPDF_TIMEOUT_SECONDS,
+            )
+        except asyncio.TimeoutError:
+            await _kill(proc)
+            metrics.WKHTMLTOPDF_RENDERS.inc(outcome="timeout")
+            raise Exception(f"wkhtmltopdf failed: timed out after {settings.WKHTMLTOPDF_TIMEOUT_SECONDS}s")
+        except asyncio.CancelledError:
+            await _kill(proc)
+            metrics.WKHTMLTOPDF_RENDERS.inc(outcome="cancelled")
+            raise
+        finally:
+            metrics.WKHTMLTOPDF_SECONDS.observe(time.monotonic() - started)
+
+        _record_wkhtmltopdf_stderr(stderr)
+        if proc.returncode != 0:
+            metrics.WKHTMLTOPDF_RENDERS.inc(outcome="error")
+            raise Exception(f"wkhtmltopdf failed with exit code {proc.returncode}")
+
+        metrics.WKHTMLTOPDF_RENDERS.inc(outcome="ok")
+        logger.info(f"PDF generated successfully with wkhtmltopdf: {pdf_path}")
+
+
+async def _kill(proc: asyncio.subprocess.Process) -> None:
+    if proc.returncode is None:
+        proc.kill()
+        await proc.wait()
+
+
+def _file_version(path: Path) -> tuple:
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+async def render_pdf_file(html_path: Path, pdf_path: Path, attempts: int = 3) -> None:
+    """
+    Render HTML file to PDF with WeasyPrint on the renderer thread, falling back
+    to wkhtmltopdf.
+
+    The PDF is written to a temporary sibling and moved into place, so a reader
+    never sees a half-written file. If the HTML is replaced while the render runs
+    (the report was regenerated, possibly by another process), that PDF is dropped
+    and the new HTML rendered. Raises if rendering fails.
+    """
+    for _ in range(attempts):
+        source = _file_version(html_path)
+        with open(html_path, "r", encoding="utf-8") as f:
+            html_content = f.read()
+
+        tmp_path = pdf_path.with_name(f".{pdf_path.stem}.partial.pdf")
+        try:
+            try:
+                await pdf_renderer.run(pdf_renderer.render, html_content, tmp_path)
+                logger.info(f"PDF generated successfully with WeasyPrint: {pdf_path}")
+            except Exception as e:
+                logger.warning(f"WeasyPrint failed: {e}. Falling back to wkhtmltopdf...")
+                await _render_wkhtmltopdf(html_content, tmp_path)
+            os.replace(tmp_path, pdf_path)
+        finally:
+            if tmp_path.exists():
+                os.unlink(tmp_path)
+
+        # Checked after the move: a regeneration that wrote its HTML later also
+        # deletes the PDF afterwards, so no stale PDF survives either way
+        if _file_version(html_path) == source:
+            return
+        logger.info(f"{html_path.name} changed during the PDF render, rendering again")
+        if pdf_path.exists():
+            os.unlink(pdf_path)
+    raise RuntimeError(f"{html_path.name} kept changing during the PDF render")
+
+
 async def render_to_pdf(html_path: Path, pdf_path: Path) -> str:
     """
     Render HTML file to PDF using WeasyPrint or wkhtmltopdf as fallback.
@@ -16,101 +247,19 @@ async def render_to_pdf(html_path: Path, pdf_path: Path) -> str:
         pdf_path: Path to save the PDF file
         
     Returns:
-        URL of the generated PDF file
+        URL of the generated PDF file, or of the HTML file if rendering failed
     """
     try:
-        # Try using WeasyPrint first
-        try:
-            import weasyprint
-            logger.info(f"Rendering PDF with WeasyPrint: {pdf_path}")
-            logger.info(f"WeasyPrint version: {weasyprint.__version__}")
-            
-            # Read HTML content
-            with open(html_path, "r", encoding="utf-8") as f:
-                html_content = f.read()
-            
-            # Render to PDF - handle multiple WeasyPrint API versions
-            try:
-                # First attempt - older API (WeasyPrint < 52.0)
-                weasyprint.HTML(string=html_content).write_pdf(pdf_path)
-                logger.info("Used WeasyPrint older API successfully")
-            except TypeError as e:
-                if "takes 1 positional argument but" in str(e):
-                    # Second attempt - middle API (WeasyPrint 52.x - 59.x)
-                    html = weasyprint.HTML(string=html_content)
-                    pdf = html.render()
-                    pdf.write_pdf(target=pdf_path)
-                    logger.info("Used WeasyPrint middle API successfully")
-                else:
-                    # Third attempt - newest API (WeasyPrint 60+)
-                    html = weasyprint.HTML(string=html_content)
-                    pdf = html.render()
-                    with open(pdf_path, 'wb') as f:
-                        pdf.write_pdf(f)
-                    logger.info("Used WeasyPrint newest API successfully")
-            except Exception as e:
-                logger.error(f"All WeasyPrint API attempts failed: {e}")
-                raise
-                
-            logger.info(f"PDF generated successfully with WeasyPrint: {pdf_path}")
-            
-        except (ImportError, Exception) as e:
-            logger.warning(f"WeasyPrint failed: {e}. Falling back to wkhtmltopdf...")
-            
-            # Fall back to wkhtmltopdf
-            result = subprocess.run(
-                ["wkhtmltopdf", str(html_path), str(pdf_path)],
-                capture_output=True,
-                text=True
-            )
-            
-            if result.returncode != 0:
-                logger.error(f"wkhtmltopdf error: {result.stderr}")
-                raise Exception(f"wkhtmltopdf failed: {result.stderr}")
-            
-            logger.info(f"PDF generated successfully with wkhtmltopdf: {pdf_path}")
-        
-        # Generate a URL for the PDF
-        file_name = os.path.basename(pdf_path)
-        
-        if settings.WEBHOOK_HOST:
-            # In production with a webhook, return a public URL
-            pdf_url = f"{settings.WEBHOOK_HOST}/reports/{file_name}"
-        else:
-            # In local mode, return a file path
-            pdf_url = f"file://{pdf_path}"
-        
-        return pdf_url
-        
+        await render_pdf_file(Path(html_path), Path(pdf_path))
+        return report_url(pdf_path)
     except Exception as e:
         logger.exception(f"Failed to render PDF: {e}")
-        
         # If PDF rendering fails, return the HTML path as fallback
-        file_name = os.path.basename(html_path)
-        
-        if settings.WEBHOOK_HOST:
-            return f"{settings.WEBHOOK_HOST}/reports/{file_name}"
-        else:
-            return f"file://{html_path}"
+        return report_url(html_path)
 
 # Helper function used by tests
 def render_pdf(html_content: str, pdf_path: str) -> None:
     """
     Render HTML content to PDF using WeasyPrint (for testing)
     """
-    import weasyprint
-    try:
-        # First attempt - older API (WeasyPrint < 52.0)
-        weasyprint.HTML(string=html_content).write_pdf(pdf_path)
-    except TypeError as e:
-        if "takes 1 positional argument but" in str(e):
-            # Second attempt - middle API (WeasyPrint 52.x - 59.x)
-            html = weasyprint.HTML(string=html_content)
-            pdf = html.render()
-            pdf.write_pdf(target=pdf_path)
-        else:
-            # Third attempt - newest API (WeasyPrint 60+)
-            html = weasyprint.HTML(string=html_content)
-            pdf = html.render()
-            with open(pdf_path, 'wb') as f:
-                pdf.write_pdf(f) 
\ No newline at end of file
+    pdf_renderer.render(html_content, pdf_path)
@@ -0,0 +1,100 @@
+import hashlib
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from app.utils import db
+
+# Finished reports by upload identity, so an identical upload can be answered
+# from the existing report while it is retained
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    job_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    file_unique_id TEXT,
+    content_sha256 TEXT,
+    insights TEXT NOT NULL,
+    html_path TEXT NOT NULL,
+    pdf_path TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reports_file ON reports (file_unique_id, expires_at);
+CREATE INDEX IF NOT EXISTS reports_sha ON reports (content_sha256, expires_at);
+"""
+
+
+@dataclass
+class ReportEntry:
+    job_id: str
+    user_id: str
+    file_unique_id: Optional[str]
+    content_sha256: Optional[str]
+    insights: str  # Telegram summary, HTML-formatted
+    html_path: Path
+    pdf_path: Path
+    created_at: float
+    expires_at: float
+
+
+def content_sha256(data: bytes) -> str:
+    """Hash of the uploaded file, so the same chat matches under any file id."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _record(entry: ReportEntry) -> None:
+    db.state_db.ensure_schema(_SCHEMA)
+    db.state_db.execute(
+        "INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            entry.job_id, entry.user_id, entry.file_unique_id, entry.content_sha256, entry.insights,
+            str(entry.html_path), str(entry.pdf_path), entry.created_at, entry.expires_at,
+        ),
+    )
+
+
+def _find(column: str, value: str) -> Optional[ReportEntry]:
+    db.state_db.ensure_schema(_SCHEMA)
+    rows = db.state_db.query(
+        f"SELECT * FROM reports WHERE {column} = ? AND expires_at > ? ORDER BY created_at DESC",
+        (value, time.time()),
+    )
+    for row in rows:
+        entry = ReportEntry(**{**dict(row), "html_path": Path(row["html_path"]), "pdf_path": Path(row["pdf_path"])})
+        # The files may have been removed early (cancellation, manual cleanup)
+        if entry.html_path.exists():
+            return entry
+    return None
+
+
+def _update_insights(job_id: str, insights: str) -> None:
+    db.state_db.ensure_schema(_SCHEMA)
+    db.state_db.execute("UPDATE reports SET insights = ? WHERE job_id = ?", (insights, job_id))
+
+
+def _prune(now: float) -> int:
+    db.state_db.ensure_schema(_SCHEMA)
+    return db.state_db.execute("DELETE FROM reports WHERE expires_at <= ?", (now,)).rowcount
+
+
+async def record_report(entry: ReportEntry) -> None:
+    await db.state_db.run(_record, entry)
+
+
+async def find_by_file(file_unique_id: str) -> Optional[ReportEntry]:
+    return await db.state_db.run(_find, "file_unique_id", file_unique_id)
+
+
+async def find_by_content(content_sha256: str) -> Optional[ReportEntry]:
+    return await db.state_db.run(_find, "content_sha256", content_sha256)
+
+
+async def update_insights(job_id: str, insights: str) -> None:
+    """Replace the summary sent for a report, e.g. after it was rendered again."""
+    await db.state_db.run(_update_insights, job_id, insights)
+
+
+async def prune_expired() -> int:
+    """Forget reports past their retention; the files go with clean_old_reports."""
+    return await db.state_db.run(_prune, time.time())
@@ -0,0 +1,156 @@
+import re
+from collections import Counter
+from typing import Dict, List
+
+# Size optimisation applied to the final report HTML before it is stored and
+# rendered. Every step keeps the rendered result the same; it only removes
+# bytes WeasyPrint would otherwise have to parse, lay out and embed.
+
+# Contents of these elements are left byte-for-byte untouched
+_RAW_BLOCK = re.compile(r"(<(pre|textarea|script|style)\b[^>]*>.*?</\2\s*>)", re.S | re.I)
+_COMMENT = re.compile(r"<!--(?!\[if).*?-->", re.S)
+_WHITESPACE = re.compile(r"\s+")
+# Whitespace next to block-level tags is never significant
+_BLOCK_TAG_SPACE = re.compile(
+    r"\s*(</?(?:html|head|body|meta|title|link|div|section|p|h[1-6]|ul|ol|li|table|thead|tbody|tr|td|th|br|hr"
+    r"|svg|g|defs|rect|line|polyline|polygon|path|circle|ellipse|text)\b[^>]*>)\s*",
+    re.I,
+)
+
+_SVG = re.compile(r"<svg\b.*?</svg\s*>", re.S | re.I)
+_GEOMETRY_ATTR = re.compile(r'(\s(?:x|y|x1|y1|x2|y2|cx|cy|r|rx|ry|width|height|points|d|viewBox)=")([^"]*)(")')
+_DECIMAL = re.compile(r"-?\d+\.\d+")
+# The report stylesheet already sets `svg text { font-family: Arial }`
+_REDUNDANT_SVG_ATTR = re.compile(r'\sfont-family="Arial"')
+_SHAPE = re.compile(r"<(line|path)\b([^>]*?)\s*/>(?:</\1>)?", re.I)
+_ATTR = re.compile(r'([\w:-]+)="([^"]*)"')
+
+_START_TAG = re.compile(r"<([a-zA-Z][\w-]*)(\s[^<>]*?)?(\s*/?)>")
+_STYLE_ATTR = re.compile(r'\sstyle="([^"]*)"')
+_CLASS_ATTR = re.compile(r'\sclass="([^"]*)"')
+
+
+def _round_number(match: re.Match, precision: int) -> str:
+    value = round(float(match.group(0)), precision)
+    text = f"{value:.{precision}f}".rstrip("0").rstrip(".")
+    return "0" if text in ("-0", "") else text
+
+
+def _shape_path(name: str, attrs: Dict[str, str]) -> str:
+    if name == "line":
+        return f"M{attrs.get('x1', '0')} {attrs.get('y1', '0')}L{attrs.get('x2', '0')} {attrs.get('y2', '0')}"
+    return attrs.get("d", "")
+
+
+def _merge_shapes(svg: str) -> str:
+    """
+    Merge runs of adjacent <line>s and unfilled <path>s that share all
+    presentation attributes into a single <path>, dropping exact duplicates.
+    """
+    out: List[str] = []
+    pos = 0
+    run_key = None
+    run_paths: List[str] = []
+    run_attrs = ""
+    run_count = 0
+    run_source = ""
+
+    def flush():
+        if run_count > 1:
+            out.append(f'<path d="{"".join(dict.fromkeys(run_paths))}"{run_attrs}/>')
+        elif run_count == 1:
+            out.append(run_source)
+
+    for match in _SHAPE.finditer(svg):
+        between = svg[pos:match.start()]
+        name = match.group(1).lower()
+        attrs = dict(_ATTR.findall(match.group(2)))
+        geometry = ("x1", "y1", "x2", "y2") if name == "line" else ("d",)
+        style = {k: v for k, v in attrs.items() if k not in geometry}
+        # id'd elements may be referenced elsewhere, and merging filled paths would
+        # change how overlaps are painted; keep those as they are
+        mergeable = "id" not in style and (name == "line" or style.get("fill") == "none")
+        key = tuple(sorted(style.items())) if mergeable else None
+
+        if key is None or key != run_key or between.strip():
+            flush()
+            out.append(between)
+            run_key, run_paths, run_count = key, [], 0
+            run_attrs = "".join(f' {k}="{v}"' for k, v in style.items())
+        if key is None:
+            out.append(match.group(0))
+        else:
+            run_paths.append(_shape_path(name, attrs))
+            run_count += 1
+            run_source = match.group(0)
+        pos = match.end()
+
+    flush()
+    out.append(svg[pos:])
+    return "".join(out)
+
+
+def _optimize_svg(match: re.Match) -> str:
+    svg = match.group(0)
+    svg = _GEOMETRY_ATTR.sub(
+        lambda m: m.group(1) + _DECIMAL.sub(lambda n: _round_number(n, 1), m.group(2)) + m.group(3), svg
+    )
+    svg = _REDUNDANT_SVG_ATTR.sub("", svg)
+    return _merge_shapes(svg)
+
+
+def _hoist_inline_styles(html: str) -> str:
+    """Move inline style="" values used more than once into generated classes."""
+    counts = Counter(m.group(1).strip() for m in _STYLE_ATTR.finditer(html))
+    repeated = [style for style, count in counts.items() if count > 1 and style]
+    if not repeated or "</head>" not in html:
+        return html
+    classes = {style: f"xs{i}" for i, style in enumerate(repeated, 1)}
+
+    def rewrite(tag: re.Match) -> str:
+        attrs = tag.group(2) or ""
+        style = _STYLE_ATTR.search(attrs)
+        if not style or style.group(1).strip() not in classes:
+            return tag.group(0)
+        name = classes[style.group(1).strip()]
+        attrs = _STYLE_ATTR.sub("", attrs, count=1)
+        if _CLASS_ATTR.search(attrs):
+            attrs = _CLASS_ATTR.sub(lambda c: f' class="{c.group(1)} {name}"', attrs, count=1)
+        else:
+            attrs += f' class="{name}"'
+        return f"<{tag.group(1)}{attrs}{tag.group(3)}>"
+
+    html = _START_TAG.sub(rewrite, html)
+
+    # !important keeps inline-style precedence over the report stylesheet
+    rules = []
+    for style, name in classes.items():
+        declarations = [d.strip() for d in style.split(";") if d.strip()]
+        body = ";".join(d if d.endswith("!important") else f"{d} !important" for d in declarations)
+        rules.append(f".{name}{{{body}}}")
+    return html.replace("</head>", f"<style>{''.join(rules)}</style></head>", 1)
+
+
+def _minify(html: str) -> str:
+    parts = _RAW_BLOCK.split(html)
+    out = []
+    # re.split with two groups yields: text, raw block, tag name, text, ...
+    for i in range(0, len(parts), 3):
+        text = _COMMENT.sub("", parts[i])
+        text = _WHITESPACE.sub(" ", text)
+        out.append(_BLOCK_TAG_SPACE.sub(r"\1", text))
+        if i + 1 < len(parts):
+            out.append(parts[i + 1])
+    return "".join(out).strip()
+
+
+def optimize_report_html(html: str) -> str:
+    """
+    Shrink a report before it is stored and rendered: reduce SVG coordinate
+    precision, drop attributes the stylesheet already sets, merge identical
+    adjacent SVG lines/paths, hoist repeated inline styles into classes and
+    minify the markup outside <pre>/<style>/<script>/<textarea>.
+    """
+    html = _SVG.sub(_optimize_svg, html)
+    html = _hoist_inline_styles(html)
+    return _minify(html)
@@ -0,0 +1,247 @@
+import json
+import logging
+import re
+from typing import List, Dict, Any, Optional, Tuple
+
+from pydantic import BaseModel, Field, ValidationError, field_validator
+
+logger = logging.getLogger(__name__)
+
+# Order in which the model is asked to emit the sections. The template renders them
+# in the same order and the titles double as the headings of the final report.
+SECTION_TITLES: List[Tuple[str, str]] = [
+    ("overview", "Общий обзор"),
+    ("communication_patterns", "Паттерны общения"),
+    ("emotional_analysis", "Анализ эмоций"),
+    ("toxic_interactions", "Токсичные взаимодействия"),
+    ("key_quotes", "Ключевые цитаты"),
+    ("psychological_insights", "Психологические инсайты"),
+    ("recommendations", "Рекомендации"),
+    ("quantitative_analysis", "Количественный анализ и визуализация данных"),
+    ("participant_portraits", "Индивидуальный психологический портрет участников"),
+]
+
+# Sub-sections of the quantitative analysis. Charts generated in graphics.py are
+# attached to these keys, so the LLM only writes the commentary around them.
+QUANTITATIVE_TITLES: List[Tuple[str, str]] = [
+    ("sentiment_timeline", "Временная шкала настроений"),
+    ("communication_metrics", "Коммуникационные метрики"),
+    ("communication_patterns", "Распределение коммуникационных паттернов"),
+    ("emotional_dynamics", "Эмоциональная динамика"),
+    ("gottman_horsemen", "«Четыре всадника» Готтмана"),
+    ("transactional_flows", "Трансакционные взаимодействия"),
+    ("psychological_needs", "Динамика психологических потребностей"),
+]
+
+
+def _as_paragraphs(value: Any) -> List[str]:
+    """Accept either a list of paragraphs or one string with blank-line breaks."""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [p.strip() for p in re.split(r"\n\s*\n", value) if p.strip()]
+    if isinstance(value, list):
+        return [str(p).strip() for p in value if str(p).strip()]
+    return [str(value)]
+
+
+class Quote(BaseModel):
+    text: str
+    author: str = ""
+    emotion: str = ""
+    style: str = ""
+    analysis: str = ""
+
+
+class Recommendation(BaseModel):
+    title: str = ""
+    text: str = ""
+    participant: str = ""
+
+
+class Portrait(BaseModel):
+    participant: str
+    paragraphs: List[str] = Field(default_factory=list)
+
+    @field_validator("paragraphs", mode="before")
+    @classmethod
+    def _split_paragraphs(cls, value: Any) -> List[str]:
+        return _as_paragraphs(value)
+
+
+class MetaReportContent(BaseModel):
+    """Structured content of the meta report, as returned by settings.META_MODEL."""
+
+    overview: List[str] = Field(default_factory=list)
+    communication_patterns: List[str] = Field(default_factory=list)
+    emotional_analysis: List[str] = Field(default_factory=list)
+    toxic_interactions: List[str] = Field(default_factory=list)
+    key_quotes: List[Quote] = Field(default_factory=list)
+    psychological_insights: List[str] = Field(default_factory=list)
+    recommendations: List[Recommendation] = Field(default_factory=list)
+    quantitative_analysis: Dict[str, List[str]] = Field(default_factory=dict)
+    participant_portraits: List[Portrait] = Field(default_factory=list)
+
+    @field_validator(
+        "overview",
+        "communication_patterns",
+        "emotional_analysis",
+        "toxic_interactions",
+        "psychological_insights",
+        mode="before",
+    )
+    @classmethod
+    def _split_paragraphs(cls, value: Any) -> List[str]:
+        return _as_paragraphs(value)
+
+    @field_validator("quantitative_analysis", mode="before")
+    @classmethod
+    def _split_quantitative(cls, value: Any) -> Dict[str, List[str]]:
+        if not isinstance(value, dict):
+            return {}
+        return {str(k): _as_paragraphs(v) for k, v in value.items()}
+
+    def is_empty(self) -> bool:
+        return not any(getattr(self, key) for key, _ in SECTION_TITLES)
+
+
+def _strip_code_fences(raw: str) -> str:
+    raw = raw.strip()
+    if raw.startswith("```"):
+        raw = re.sub(r"^```[a-zA-Z]*\s*", "", raw)
+        raw = re.sub(r"\s*```$", "", raw)
+    return raw
+
+
+def close_truncated_json(raw: str) -> Optional[str]:
+    """
+    Cut a truncated JSON document back to its last complete element and close
+    all open containers. Used when the completion hit max_tokens mid-section.
+
+    Returns None if no complete element was found.
+    """
+    stack: List[str] = []
+    in_string = False
+    escape = False
+    # (cut position, open containers at that position)
+    last_safe: Optional[Tuple[int, str]] = None
+
+    for i, ch in enumerate(raw):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append(ch)
+        elif ch in "}]":
+            if not stack:
+                break
+            stack.pop()
+            last_safe = (i + 1, "".join(stack))
+            if not stack:
+                break
+        elif ch == "," and stack:
+            last_safe = (i, "".join(stack))
+
+    if last_safe is None:
+        return None
+    cut, open_containers = last_safe
+    closers = "".join("}" if c == "{" else "]" for c in reversed(open_containers))
+    return raw[:cut] + closers
+
+
+def parse_report_content(raw: str) -> Optional[MetaReportContent]:
+    """
+    Parse and validate the model output. Truncated JSON is repaired where possible;
+    missing sections fall back to empty defaults. Returns None if nothing usable
+    could be recovered.
+    """
+    if not raw:
+        return None
+    text = _strip_code_fences(raw)
+    if not text.startswith("{"):
+        return None
+
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        repaired = close_truncated_json(text)
+        if not repaired:
+            return None
+        try:
+            data = json.loads(repaired)
+        except json.JSONDecodeError as e:
+            logger.warning(f"Could not repair truncated meta report JSON: {e}")
+            return None
+        logger.warning("Meta report JSON was truncated; rendering the complete sections only")
+
+    if not isinstance(data, dict):
+        return None
+
+    try:
+        content = MetaReportContent.model_validate(data)
+    except ValidationError as e:
+        logger.warning(f"Meta report JSON failed schema validation: {e}")
+        return None
+
+    return None if content.is_empty() else content
+
+
+class SectionStreamTracker:
+    """
+    Incrementally scans a streamed JSON report and reports which top-level
+    section keys have started. A section is complete once the next one starts.
+    """
+
+    def __init__(self):
+        self.sections: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._chars: List[str] = []
+        self._pending_key: Optional[str] = None
+
+    def feed(self, text: str) -> List[str]:
+        """Consume the next piece of the stream; return the section keys started in it."""
+        started = []
+        for ch in text:
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._pending_key = "".join(self._chars)
+                    continue
+                if self._depth == 1:
+                    self._chars.append(ch)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._chars = []
+            elif ch == ":" and self._pending_key is not None:
+                self.sections.append(self._pending_key)
+                started.append(self._pending_key)
+                self._pending_key = None
+            elif ch in "{[":
+                self._depth += 1
+                self._pending_key = None
+            elif ch in "}]":
+                self._depth -= 1
+            elif not ch.isspace():
+                self._pending_key = None
+        return started
+
+    @property
+    def completed(self) -> int:
+        """Number of sections that are fully written."""
+        return max(0, len(self.sections) - 1)
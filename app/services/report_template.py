@@ -0,0 +1,157 @@
+from datetime import datetime
+from html import escape
+from string import Template
+from typing import Dict, List, Optional
+
+from app.services.report_schema import (
+    MetaReportContent,
+    SECTION_TITLES,
+    QUANTITATIVE_TITLES,
+)
+
+# Shared report stylesheet. Previously injected into the LLM-written HTML by
+# _inject_css; now part of the template so the model never has to emit styles.
+REPORT_CSS = """
+body { font-family: Arial, sans-serif; color: #2c3e50; margin: 30px; font-size: 16px; line-height: 1.7; }
+h1 { font-size: 28px; margin-bottom: 25px; color: #1e4271; }
+h2 { font-size: 22px; margin-top: 35px; margin-bottom: 15px; border-bottom: 2px solid #e8f4fd; padding-bottom: 5px; }
+h3 { font-size: 18px; margin-top: 25px; margin-bottom: 10px; }
+.report-date { color: #777; margin-top: -15px; }
+svg text { font-family: Arial, sans-serif; font-size: 12px; }
+.quote { border-left: 4px solid #3498db; padding: 10px 15px; margin: 20px 0; background-color: #f8f9fa; }
+.quote p { margin: 5px 0; }
+.quote-author { font-weight: bold; color: #555; }
+.quote-emotion { color: #777; font-size: 0.9em; }
+.recommendation { border-left: 4px solid #2ecc71; padding: 10px 15px; margin: 15px 0; background-color: #f4fbf6; }
+.chart-container { background-color: #f5f5f5; padding: 15px; border-radius: 5px; margin: 25px 0; overflow-x: auto; }
+.sample-note { background-color: #fff3cd; color: #856404; padding: 15px; margin-bottom: 20px; border-radius: 5px; border: 1px solid #ffeeba; }
+.messages-banner { background-color: #e8f4fd; color: #1e4271; padding: 12px; margin-bottom: 20px; border-left: 4px solid #3498db; }
+.report-note { background-color: #fdecea; color: #8a1f11; padding: 12px; margin-bottom: 20px; border-left: 4px solid #e74c3c; }
+.missing-section { color: #999; font-style: italic; }
+"""
+
+# Compiled once at import; only the substitution runs per report.
+_PAGE = Template("""<!DOCTYPE html>
+<html lang="ru">
+<head>
+<meta charset="UTF-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<title>Chat X-Ray: Подробный психологический анализ отношений</title>
+<style>$css</style>
+</head>
+<body>
+$banners<h1>Chat X-Ray: Подробный психологический анализ отношений</h1>
+<p class="report-date">$date</p>
+$sections
+</body>
+</html>
+""")
+_SECTION = Template('<section id="$key">\n<h2>$title</h2>\n$body</section>\n')
+_QUOTE = Template(
+    '<div class="quote">\n<p>"$text"</p>\n<p class="quote-author">$author</p>\n'
+    '<p class="quote-emotion">Эмоция: $emotion | Стиль общения: $style</p>\n'
+    "<p>Психологический анализ: $analysis</p>\n</div>\n"
+)
+_RECOMMENDATION = Template('<div class="recommendation">\n<h3>$title</h3>\n$body</div>\n')
+_CHART = Template('<div class="chart-container">$svg</div>\n')
+
+_MISSING = '<p class="missing-section">(Этот раздел не был сформирован.)</p>\n'
+
+
+def _paragraphs(paragraphs: List[str]) -> str:
+    return "".join(f"<p>{escape(p)}</p>\n" for p in paragraphs)
+
+
+def _render_quotes(content: MetaReportContent) -> str:
+    return "".join(
+        _QUOTE.substitute(
+            text=escape(q.text),
+            author=escape(q.author or "—"),
+            emotion=escape(q.emotion or "—"),
+            style=escape(q.style or "—"),
+            analysis=escape(q.analysis),
+        )
+        for q in content.key_quotes
+    )
+
+
+def _render_recommendations(content: MetaReportContent) -> str:
+    parts = []
+    for i, rec in enumerate(content.recommendations, 1):
+        title = rec.title or f"Рекомендация {i}"
+        if rec.participant:
+            title = f"{title} ({rec.participant})"
+        parts.append(_RECOMMENDATION.substitute(title=escape(title), body=_paragraphs([rec.text])))
+    return "".join(parts)
+
+
+def _render_quantitative(content: MetaReportContent, charts: Dict[str, List[str]]) -> str:
+    parts = []
+    for key, title in QUANTITATIVE_TITLES:
+        commentary = content.quantitative_analysis.get(key, [])
+        key_charts = charts.get(key, [])
+        if not commentary and not key_charts:
+            continue
+        parts.append(f"<h3>{escape(title)}</h3>\n")
+        parts.append(_paragraphs(commentary))
+        parts.extend(_CHART.substitute(svg=svg) for svg in key_charts)
+    return "".join(parts)
+
+
+def _render_portraits(content: MetaReportContent) -> str:
+    return "".join(
+        f"<h3>{escape(p.participant)}</h3>\n{_paragraphs(p.paragraphs)}"
+        for p in content.participant_portraits
+    )
+
+
+def render_report(
+    content: MetaReportContent,
+    charts: Optional[Dict[str, List[str]]] = None,
+    total_messages: Optional[int] = None,
+    sample_note: Optional[str] = None,
+    notes: Optional[List[str]] = None,
+) -> str:
+    """
+    Render structured meta report content into the final HTML document.
+
+    Args:
+        content: Validated LLM output
+        charts: SVG charts keyed by quantitative sub-section (see QUANTITATIVE_TITLES)
+        total_messages: Number of analysed messages, shown in the banner
+        sample_note: Optional plain-text note about sampling shown above the report
+        notes: Optional plain-text notices (e.g. an interrupted generation) shown above the report
+
+    Returns:
+        Complete HTML document
+    """
+    charts = charts or {}
+
+    banners = "".join(f'<div class="report-note">{escape(note)}</div>\n' for note in notes or [])
+    if sample_note:
+        banners += f'<div class="sample-note"><strong>Примечание о выборке:</strong> {escape(sample_note)}</div>\n'
+    if total_messages is not None:
+        banners += (
+            f'<div class="messages-banner">Отчёт подготовлен после анализа '
+            f"<b>{total_messages}</b> сообщений из вашего чата.</div>\n"
+        )
+
+    renderers = {
+        "key_quotes": _render_quotes,
+        "recommendations": _render_recommendations,
+        "quantitative_analysis": lambda c: _render_quantitative(c, charts),
+        "participant_portraits": _render_portraits,
+    }
+
+    sections = []
+    for key, title in SECTION_TITLES:
+        render = renderers.get(key)
+        body = render(content) if render else _paragraphs(getattr(content, key))
+        sections.append(_SECTION.substitute(key=key, title=escape(title), body=body or _MISSING))
+
+    return _PAGE.substitute(
+        css=REPORT_CSS,
+        banners=banners,
+        date=datetime.now().strftime("%d.%m.%Y"),
+        sections="".join(sections),
+    )
@@ -0,0 +1,225 @@
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, Dict, List, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from app.config import settings
+from app.utils import db
+
+logger = logging.getLogger(__name__)
+
+# State shared by every bot process on the host: aiogram FSM state and leases
+# (which process owns a job or an upload, which one set the webhook)
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm_state (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL DEFAULT '{}',
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    info TEXT
+);
+"""
+
+
+class SQLiteStorage(BaseStorage):
+    """aiogram FSM storage in the state DB, so conversation state survives restarts and is shared by replicas."""
+
+    def __init__(self, key_builder: Optional[DefaultKeyBuilder] = None):
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+    def _set(self, key: str, column: str, value: Optional[str]) -> None:
+        db.state_db.ensure_schema(_SCHEMA)
+        db.state_db.execute(
+            f"INSERT INTO fsm_state (key, {column}, updated_at) VALUES (?, ?, ?) "
+            f"ON CONFLICT(key) DO UPDATE SET {column} = excluded.{column}, updated_at = excluded.updated_at",
+            (key, value, time.time()),
+        )
+
+    def _get(self, key: str, column: str) -> Optional[str]:
+        db.state_db.ensure_schema(_SCHEMA)
+        rows = db.state_db.query(f"SELECT {column} FROM fsm_state WHERE key = ?", (key,))
+        return rows[0][column] if rows else None
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await db.state_db.run(self._set, self.key_builder.build(key), "state", value)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await db.state_db.run(self._get, self.key_builder.build(key), "state")
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await db.state_db.run(self._set, self.key_builder.build(key), "data", json.dumps(dict(data)))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        raw = await db.state_db.run(self._get, self.key_builder.build(key), "data")
+        return json.loads(raw) if raw else {}
+
+    async def close(self) -> None:
+        pass  # the state DB connection is shared and closed with it
+
+
+@dataclass
+class Lease:
+    name: str
+    owner: str
+    expires_at: float
+    info: Optional[str] = None
+
+
+class LeaseStore(ABC):
+    """
+    Named, expiring ownership records shared by bot processes.
+
+    A lease belongs to one owner until it is released or its TTL runs out without
+    a renewal, so work owned by a process that died is picked up again. Any store
+    with an atomic "set if absent or expired" can implement this (e.g. Redis
+    `SET name owner NX PX ttl` plus a compare-and-set script for renew/release).
+    """
+
+    @abstractmethod
+    async def acquire(self, name: str, owner: str, ttl: float, info: Optional[str] = None) -> bool:
+        """Take the lease if it is free, expired or already ours."""
+
+    @abstractmethod
+    async def renew(self, name: str, owner: str, ttl: float) -> bool:
+        """Extend our lease; False if it expired and was taken over."""
+
+    @abstractmethod
+    async def release(self, name: str, owner: str) -> None:
+        """Give up our lease (no-op if it is not ours)."""
+
+    @abstractmethod
+    async def clear(self, name: str) -> None:
+        """Remove the lease whoever holds it (for flags taken by another process)."""
+
+    @abstractmethod
+    async def get(self, name: str) -> Optional[Lease]:
+        """The live lease with this name, if any."""
+
+    @abstractmethod
+    async def list(self, prefix: str) -> List[Lease]:
+        """Live leases whose names start with `prefix`."""
+
+
+class SQLiteLeaseStore(LeaseStore):
+    """Leases in the state DB; shared by the processes of one host."""
+
+    def _acquire(self, name: str, owner: str, ttl: float, info: Optional[str]) -> bool:
+        db.state_db.ensure_schema(_SCHEMA)
+        now = time.time()
+        cursor = db.state_db.execute(
+            "INSERT INTO leases (name, owner, expires_at, info) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at, "
+            "info = excluded.info WHERE leases.owner = excluded.owner OR leases.expires_at <= ?",
+            (name, owner, now + ttl, info, now),
+        )
+        return cursor.rowcount == 1
+
+    def _renew(self, name: str, owner: str, ttl: float) -> bool:
+        db.state_db.ensure_schema(_SCHEMA)
+        now = time.time()
+        cursor = db.state_db.execute(
+            "UPDATE leases SET expires_at = ? WHERE name = ? AND owner = ? AND expires_at > ?",
+            (now + ttl, name, owner, now),
+        )
+        return cursor.rowcount == 1
+
+    def _release(self, name: str, owner: str) -> None:
+        db.state_db.ensure_schema(_SCHEMA)
+        db.state_db.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    def _clear(self, name: str) -> None:
+        db.state_db.ensure_schema(_SCHEMA)
+        db.state_db.execute("DELETE FROM leases WHERE name = ?", (name,))
+
+    def _select(self, where: str, params: tuple) -> List[Lease]:
+        db.state_db.ensure_schema(_SCHEMA)
+        rows = db.state_db.query(
+            f"SELECT name, owner, expires_at, info FROM leases WHERE {where} AND expires_at > ?",
+            (*params, time.time()),
+        )
+        return [Lease(**dict(row)) for row in rows]
+
+    async def acquire(self, name: str, owner: str, ttl: float, info: Optional[str] = None) -> bool:
+        return await db.state_db.run(self._acquire, name, owner, ttl, info)
+
+    async def renew(self, name: str, owner: str, ttl: float) -> bool:
+        return await db.state_db.run(self._renew, name, owner, ttl)
+
+    async def release(self, name: str, owner: str) -> None:
+        await db.state_db.run(self._release, name, owner)
+
+    async def clear(self, name: str) -> None:
+        await db.state_db.run(self._clear, name)
+
+    async def get(self, name: str) -> Optional[Lease]:
+        leases = await db.state_db.run(self._select, "name = ?", (name,))
+        return leases[0] if leases else None
+
+    async def list(self, prefix: str) -> List[Lease]:
+        return await db.state_db.run(self._select, "substr(name, 1, ?) = ?", (len(prefix), prefix))
+
+
+class MemoryLeaseStore(LeaseStore):
+    """Leases for a single process (STATE_BACKEND=memory and tests)."""
+
+    def __init__(self):
+        self._leases: Dict[str, Lease] = {}
+
+    def _live(self, name: str) -> Optional[Lease]:
+        lease = self._leases.get(name)
+        return lease if lease is not None and lease.expires_at > time.time() else None
+
+    async def acquire(self, name: str, owner: str, ttl: float, info: Optional[str] = None) -> bool:
+        lease = self._live(name)
+        if lease is not None and lease.owner != owner:
+            return False
+        self._leases[name] = Lease(name, owner, time.time() + ttl, info)
+        return True
+
+    async def renew(self, name: str, owner: str, ttl: float) -> bool:
+        lease = self._live(name)
+        if lease is None or lease.owner != owner:
+            return False
+        lease.expires_at = time.time() + ttl
+        return True
+
+    async def release(self, name: str, owner: str) -> None:
+        lease = self._leases.get(name)
+        if lease is not None and lease.owner == owner:
+            del self._leases[name]
+
+    async def clear(self, name: str) -> None:
+        self._leases.pop(name, None)
+
+    async def get(self, name: str) -> Optional[Lease]:
+        return self._live(name)
+
+    async def list(self, prefix: str) -> List[Lease]:
+        return [lease for name in list(self._leases) if name.startswith(prefix) and (lease := self._live(name))]
+
+
+def build_fsm_storage() -> BaseStorage:
+    if settings.STATE_BACKEND == "memory":
+        return MemoryStorage()
+    return SQLiteStorage()
+
+
+def build_lease_store() -> LeaseStore:
+    if settings.STATE_BACKEND == "memory":
+        return MemoryLeaseStore()
+    return SQLiteLeaseStore()
+
+
+leases = build_lease_store()
@@ -0,0 +1,64 @@
+import json
+import time
+from typing import Any, Dict, List
+
+from app.config import settings
+from app.utils import db, metrics
+
+# Metrics of the analysis worker processes (WORKERS > 0). Each worker keeps its
+# own registry and publishes a snapshot of it here under its pool (the bot
+# process that started it); /metrics in that bot process adds them to its own
+# values. Counters and histograms of workers that exited keep counting, so a
+# worker restart doesn't make totals drop; their gauges (jobs in flight etc.)
+# stop counting once the snapshot is no longer refreshed.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS worker_metrics (
+    owner TEXT PRIMARY KEY,
+    pool TEXT NOT NULL,
+    snapshot TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def _publish(pool: str, owner: str, snapshot: str) -> None:
+    db.state_db.ensure_schema(_SCHEMA)
+    db.state_db.execute(
+        "INSERT OR REPLACE INTO worker_metrics (owner, pool, snapshot, updated_at) VALUES (?, ?, ?, ?)",
+        (owner, pool, snapshot, time.time()),
+    )
+
+
+def _collect(pool: str, live_after: float) -> List[Dict[str, List[List[Any]]]]:
+    db.state_db.ensure_schema(_SCHEMA)
+    gauges = {metric.name for metric in metrics.REGISTRY if isinstance(metric, metrics.Gauge)}
+    snapshots = []
+    for row in db.state_db.query("SELECT snapshot, updated_at FROM worker_metrics WHERE pool = ?", (pool,)):
+        snapshot = json.loads(row["snapshot"])
+        if row["updated_at"] <= live_after:
+            snapshot = {name: values for name, values in snapshot.items() if name not in gauges}
+        snapshots.append(snapshot)
+    return snapshots
+
+
+def _prune(live_after: float) -> int:
+    db.state_db.ensure_schema(_SCHEMA)
+    return db.state_db.execute(
+        "DELETE FROM worker_metrics WHERE pool NOT IN (SELECT pool FROM worker_metrics WHERE updated_at > ?)",
+        (live_after,),
+    ).rowcount
+
+
+async def publish(pool: str, owner: str) -> None:
+    """Store this worker's current metrics; call more often than LEASE_TTL_SECONDS."""
+    await db.state_db.run(_publish, pool, owner, json.dumps(metrics.snapshot()))
+
+
+async def collect(pool: str) -> List[Dict[str, List[List[Any]]]]:
+    """Snapshots of the pool's workers, to merge into /metrics."""
+    return await db.state_db.run(_collect, pool, time.time() - settings.LEASE_TTL_SECONDS)
+
+
+async def prune() -> int:
+    """Forget pools none of whose workers is alive (bot processes that stopped)."""
+    return await db.state_db.run(_prune, time.time() - settings.LEASE_TTL_SECONDS)
@@ -5,6 +5,7 @@ from datetime import datetime
 from pathlib import Path
 
 from app.config import settings
+from app.utils.report_files import COMPRESSED_SUFFIXES, remove_compressed_variants
 
 logger = logging.getLogger(__name__)
 
@@ -81,6 +82,12 @@ async def clean_old_reports(hours: int = 72):
             # Skip metadata files, we'll delete them with their main files
             if filename.endswith('.meta'):
                 continue
+
+            # Precompressed variants go with their main file; drop orphans
+            if filename.endswith(COMPRESSED_SUFFIXES):
+                if not os.path.exists(os.path.splitext(file_path)[0]):
+                    os.unlink(file_path)
+                continue
                 
             # Check if it's a file (not a directory)
             if os.path.isfile(file_path):
@@ -97,6 +104,7 @@ async def clean_old_reports(hours: int = 72):
                         if current_time > expiration_time:
                             os.unlink(file_path)
                             os.unlink(meta_file)
+                            remove_compressed_variants(file_path)
                             count_deleted += 1
                             
                             # Also delete the corresponding HTML file if PDF
@@ -110,6 +118,7 @@ async def clean_old_reports(hours: int = 72):
                         
                         if file_age_hours > hours:
                             os.unlink(file_path)
+                            remove_compressed_variants(file_path)
                             count_deleted += 1
                             
                             # Also delete the corresponding HTML file if PDF
@@ -122,11 +131,39 @@ async def clean_old_reports(hours: int = 72):
                     logger.error(f"Error processing file {file_path}: {e}")
         
         logger.info(f"Cleanup complete. Deleted {count_deleted} files from reports directory.")
+
+        # Expired reports can no longer answer duplicate uploads
+        from app.services import report_index
+        pruned = await report_index.prune_expired()
+        logger.info(f"Removed {pruned} expired entries from the report index.")
+
+        # Stored analysis results are kept as long as the reports built from them
+        from app.services import checkpoints
+        pruned = await checkpoints.prune(older_than_hours=hours)
+        logger.info(f"Removed checkpoints of {pruned} old jobs.")
     
     except Exception as e:
         logger.exception(f"Error during reports cleanup: {e}")
 
 
+def remove_job_files(job_id: str) -> int:
+    """
+    Delete everything a job wrote to UPLOAD_DIR and REPORT_DIR right away (upload,
+    reports, sidecars, raw model output, partial renders). All of them are named
+    after the job id. Returns the number of files removed.
+    """
+    removed = 0
+    for directory in (settings.UPLOAD_DIR, settings.REPORT_DIR):
+        for pattern in (f"{job_id}*", f".{job_id}*"):
+            for path in Path(directory).glob(pattern):
+                try:
+                    path.unlink()
+                    removed += 1
+                except OSError as e:
+                    logger.error(f"Error removing {path}: {e}")
+    return removed
+
+
 if __name__ == "__main__":
     # This allows the script to be run directly for manual cleanup
     import asyncio
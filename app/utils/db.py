@@ -0,0 +1,94 @@
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator, List, Sequence, Set
+
+from app.config import settings
+from app.utils.executor import run_in_thread
+
+logger = logging.getLogger(__name__)
+
+
+class Database:
+    """
+    One SQLite file shared by the bot's persistent state (cost ledger, report
+    index, job queue...). A single connection in WAL mode, serialised by a lock;
+    async callers go through `run()` so queries never execute on the event loop.
+
+    Each feature owns its tables and creates them with `ensure_schema()` on first
+    use, so there is no central migration list to keep in sync.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._conn: sqlite3.Connection = None
+        self._lock = threading.RLock()
+        self._schemas: Set[str] = set()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._conn = conn
+        return self._conn
+
+    def ensure_schema(self, ddl: str) -> None:
+        """Run idempotent DDL (CREATE ... IF NOT EXISTS) once per process."""
+        if ddl in self._schemas:
+            return
+        with self._lock:
+            self._connection().executescript(ddl)
+            self._schemas.add(ddl)
+
+    def ensure_column(self, table: str, column: str, decl: str) -> None:
+        """Add a column to an existing table if an older schema lacks it."""
+        key = f"{table}.{column}"
+        if key in self._schemas:
+            return
+        with self._lock:
+            conn = self._connection()
+            columns = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+            self._schemas.add(key)
+
+    def execute(self, sql: str, params: Sequence[Any] = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._connection().execute(sql, params)
+
+    def query(self, sql: str, params: Sequence[Any] = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._connection().execute(sql, params).fetchall()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Hold the connection for several statements that must apply together."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Run a synchronous DB function off the event loop."""
+        return await run_in_thread(func, *args)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+                self._schemas.clear()
+
+
+state_db = Database(settings.STATE_DB_PATH)
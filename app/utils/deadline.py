@@ -0,0 +1,42 @@
+import logging
+import time
+from typing import Dict, List
+
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Deadline:
+    """
+    Time budget of one analysis job, passed down the pipeline.
+
+    Stages check `remaining()` against what later stages still need and degrade
+    instead of overrunning; each degradation is recorded with a user-facing note
+    so the report can say what was cut.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self._degradations: Dict[str, str] = {}
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def degrade(self, kind: str, note: str) -> None:
+        """Record that `kind` was degraded; the latest note per kind wins."""
+        if kind not in self._degradations:
+            metrics.JOB_DEGRADATIONS.inc(kind=kind)
+            logger.warning(f"Deadline degradation ({kind}), {self.remaining():.0f}s left: {note}")
+        self._degradations[kind] = note
+
+    def degraded(self, kind: str) -> bool:
+        return kind in self._degradations
+
+    def notes(self) -> List[str]:
+        return list(self._degradations.values())
@@ -0,0 +1,106 @@
+import asyncio
+import functools
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+from app.config import settings
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# CPU-bound pipeline steps run here instead of on the aiogram event loop.
+#
+# - threads: work that releases the GIL (file I/O, zlib/brotli) or needs
+#   unpicklable state (closures, open objects); cheap to hand over
+# - processes: pure-Python parsing of whole uploads (regex, BeautifulSoup) that
+#   would otherwise hold the GIL; arguments and results must be picklable
+
+_thread_pool = ThreadPoolExecutor(max_workers=settings.CPU_THREAD_WORKERS, thread_name_prefix="cpu")
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_process_pool() -> Optional[ProcessPoolExecutor]:
+    global _process_pool
+    if settings.CPU_PROCESS_WORKERS <= 0:
+        return None
+    if _process_pool is None:
+        # spawn: forking a process that already runs threads (aiohttp, renderer) is unsafe
+        _process_pool = ProcessPoolExecutor(
+            max_workers=settings.CPU_PROCESS_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+    return _process_pool
+
+
+def _init_worker() -> None:
+    # Import the parsing stack once per worker rather than on the first upload
+    import app.services.chunker  # noqa: F401
+
+
+def _ping() -> bool:
+    return True
+
+
+async def prewarm_process_pool() -> None:
+    """Start all process workers now, so the first upload doesn't pay for spawning them."""
+    pool = _get_process_pool()
+    if pool is None:
+        return
+    started = time.monotonic()
+    loop = asyncio.get_running_loop()
+    try:
+        await asyncio.gather(*(loop.run_in_executor(pool, _ping) for _ in range(settings.CPU_PROCESS_WORKERS)))
+        logger.info(f"{settings.CPU_PROCESS_WORKERS} CPU worker processes ready in {time.monotonic() - started:.1f}s")
+    except Exception as e:
+        logger.warning(f"CPU worker pre-warm failed: {e}")
+
+
+def _task_name(func: Callable) -> str:
+    return getattr(func, "__name__", type(func).__name__)
+
+
+async def run_in_thread(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run a blocking function on the shared CPU thread pool."""
+    loop = asyncio.get_running_loop()
+    started = time.monotonic()
+    try:
+        return await loop.run_in_executor(_thread_pool, functools.partial(func, *args, **kwargs))
+    finally:
+        metrics.CPU_TASK_SECONDS.observe(time.monotonic() - started, task=_task_name(func), pool="thread")
+
+
+async def run_in_process(func: Callable[..., Any], *args) -> Any:
+    """
+    Run a picklable, module-level function in the worker process pool.
+
+    Falls back to the thread pool when process workers are disabled
+    (CPU_PROCESS_WORKERS=0) or the pool has broken.
+    """
+    global _process_pool
+    pool = _get_process_pool()
+    if pool is None:
+        return await run_in_thread(func, *args)
+
+    loop = asyncio.get_running_loop()
+    started = time.monotonic()
+    try:
+        return await loop.run_in_executor(pool, func, *args)
+    except BrokenProcessPool:
+        logger.error(f"Process pool broken while running {_task_name(func)}; recreating it and using a thread")
+        _process_pool = None
+        return await run_in_thread(func, *args)
+    finally:
+        metrics.CPU_TASK_SECONDS.observe(time.monotonic() - started, task=_task_name(func), pool="process")
+
+
+def shutdown_executors() -> None:
+    global _process_pool
+    _thread_pool.shutdown(wait=False, cancel_futures=True)
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
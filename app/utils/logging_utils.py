@@ -11,13 +11,46 @@ json_handler.setFormatter(logging.Formatter("%(message)s"))
 json_logger.addHandler(json_handler)
 json_logger.propagate = False
 
-async def log_cost(user_id, chunks, cost):
-    """Log cost information in JSON format"""
+async def log_cost(user_id, chunks, cost, job_id=None, usage=None):
+    """Log cost information in JSON format (the per-call detail is in the cost ledger)"""
     if settings.ENABLE_COST_TRACKING:
         log_data = {
             "timestamp": datetime.now().isoformat(),
             "user_id": user_id,
             "chunks": chunks,
-            "cost_$": cost,
+            "cost_$": round(cost, 6),
         }
-        json_logger.info(json.dumps(log_data)) 
\ No newline at end of file
+        if job_id:
+            log_data["job_id"] = job_id
+        if usage is not None:
+            log_data.update({
+                "calls": usage.calls,
+                "prompt_tokens": usage.prompt_tokens,
+                "cached_tokens": usage.cached_tokens,
+                "completion_tokens": usage.completion_tokens,
+            })
+        json_logger.info(json.dumps(log_data)) 
+
+async def log_cancellation(user_id, job_id, tokens_spent, tokens_saved, cost_spent):
+    """Log a user-cancelled job with what it cost so far and the tokens it no longer needs"""
+    log_data = {
+        "timestamp": datetime.now().isoformat(),
+        "user_id": user_id,
+        "job_id": job_id,
+        "cancelled": True,
+        "tokens_spent": tokens_spent,
+        "tokens_saved": tokens_saved,
+        "cost_$": round(cost_spent, 6),
+    }
+    json_logger.info(json.dumps(log_data))
+
+async def log_timing(user_id, job_id, time_to_summary, total_time):
+    """Log perceived latency (upload to summary) separately from total job time"""
+    log_data = {
+        "timestamp": datetime.now().isoformat(),
+        "user_id": user_id,
+        "job_id": job_id,
+        "time_to_summary_s": round(time_to_summary, 2),
+        "total_job_time_s": round(total_time, 2),
+    }
+    json_logger.info(json.dumps(log_data))
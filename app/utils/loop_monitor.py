@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from app.config import settings
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class LoopWatchdog:
+    """
+    Captures what the event loop is doing while it is blocked.
+
+    The lag probe stamps a heartbeat on every wake-up. A daemon thread checks the
+    heartbeat and, once it is older than the threshold, grabs the loop thread's
+    current stack - i.e. the code holding the loop - while the stall is still in
+    progress. The probe attaches that stack to the stall it reports afterwards.
+    """
+
+    def __init__(self, max_events: int = 20):
+        self.events: Deque[Dict[str, Any]] = deque(maxlen=max_events)
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._stall_stack: Optional[str] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, max_gap: float) -> None:
+        """Watch the current thread's loop; a heartbeat older than `max_gap` seconds is a stall."""
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, args=(max_gap,), name="loop-watchdog", daemon=True)
+            self._thread.start()
+
+    def beat(self, stalled: bool = False) -> None:
+        self._heartbeat = time.monotonic()
+        if not stalled:
+            # A stack grabbed at the very edge of the threshold isn't worth keeping
+            self._stall_stack = None
+
+    def _watch(self, max_gap: float) -> None:
+        while True:
+            time.sleep(max_gap / 4)
+            if self._stall_stack is None and time.monotonic() - self._heartbeat > max_gap:
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is not None:
+                    self._stall_stack = "".join(traceback.format_stack(frame))
+
+    def record_stall(self, lag: float) -> None:
+        stack, self._stall_stack = self._stall_stack, None
+        self.events.append({"at": time.time(), "lag_ms": round(lag * 1000), "stack": stack})
+        if stack:
+            logger.warning(f"Event loop blocked for {lag * 1000:.0f} ms; loop thread was at:\n{stack}")
+        else:
+            logger.warning(f"Event loop blocked for {lag * 1000:.0f} ms (threshold {settings.LOOP_LAG_WARN_MS} ms)")
+
+    def recent(self) -> List[Dict[str, Any]]:
+        return list(self.events)
+
+
+loop_watchdog = LoopWatchdog()
+
+
+async def monitor_loop_lag(interval: float = 0.25) -> None:
+    """
+    Measure event-loop lag forever: sleep for `interval` and record how late the
+    wake-up was. Every sample goes to the lag histogram; a lag above
+    LOOP_LAG_WARN_MS is counted and logged with the stack the watchdog captured,
+    since every pending update waited that long behind whatever held the loop.
+    """
+    threshold = settings.LOOP_LAG_WARN_MS / 1000
+    loop = asyncio.get_running_loop()
+    if settings.ASYNCIO_DEBUG:
+        # asyncio's own slow-callback reports name the exact callback; costly, so opt-in
+        loop.set_debug(True)
+        loop.slow_callback_duration = threshold
+    # Heartbeats normally arrive every `interval`; anything later than that plus the threshold is a stall
+    loop_watchdog.start(interval + threshold)
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - expected)
+        metrics.EVENT_LOOP_LAG_SECONDS.observe(lag)
+        loop_watchdog.beat(stalled=lag > threshold)
+        if lag > threshold:
+            metrics.EVENT_LOOP_BLOCKED.inc()
+            loop_watchdog.record_stall(lag)
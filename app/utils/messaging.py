@@ -0,0 +1,48 @@
+import logging
+
+from aiogram.types import Message
+
+from app.utils.telegram_outbox import Priority, outbox
+
+logger = logging.getLogger(__name__)
+
+
+# Helper function to safely send messages in a task
+async def safe_send_message(message: Message, text: str, priority: Priority = Priority.NORMAL, **kwargs):
+    """Send a Telegram message through the rate-limited outbox; None if it failed."""
+    return await outbox.call(lambda: message.answer(text, **kwargs), message.chat.id, priority)
+
+
+
+def _message_key(message: Message):
+    """Outbox key of a message: pending edits and deletes of it coalesce."""
+    return ("message", message.chat.id, message.message_id)
+
+
+
+# Helper function to safely edit a message
+async def safe_edit_message(message: Message, text: str, priority: Priority = Priority.NORMAL, **kwargs):
+    """
+    Edit a message through the outbox. A queued edit of the same message is
+    replaced (latest text wins). Progress edits are only queued, not awaited.
+    None if there is no message to edit (e.g. its send failed).
+    """
+    if message is None:
+        return None
+    return await outbox.call(
+        lambda: message.edit_text(text, **kwargs),
+        message.chat.id,
+        priority,
+        key=_message_key(message),
+        wait=priority != Priority.PROGRESS,
+    )
+
+
+
+# Helper function to safely delete a message
+async def safe_delete_message(message: Message):
+    """Delete a Telegram message; replaces any edit of it still queued."""
+    if message is None:
+        return
+    await outbox.call(message.delete, message.chat.id, Priority.NORMAL, key=_message_key(message))
+
@@ -0,0 +1,293 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+# In-process metrics. Updates are a dict lookup and an add under a lock, so they
+# are cheap enough to call from any hot path, including the render thread.
+# Everything is formatted only when /metrics is scraped. Analysis worker
+# processes publish snapshot() of their registry, which the bot process merges
+# into its own values when rendering (see app/services/worker_metrics.py).
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+REGISTRY: List["Metric"] = []
+
+
+class Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _labels(self, key: LabelValues, extra: Sequence[Tuple[str, str]] = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def dump(self) -> List[List[Any]]:
+        """Current values as JSON-serialisable [label values, value] pairs."""
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def _merged(self, dumps: Sequence[List[List[Any]]]) -> Dict:
+        """This process's values plus those dumped by other processes."""
+        with self._lock:
+            values = dict(self._values)
+        for dump in dumps:
+            for key, value in dump:
+                key = tuple(key)
+                values[key] = values.get(key, 0) + value
+        return values
+
+    def _samples(self, values: Dict) -> Iterator[str]:
+        items = list(values.items())
+        if not items and not self.labelnames:
+            # Unlabelled series exist from the start, so rate() sees the first increment
+            items = [((), 0)]
+        for key, value in items:
+            yield f"{self.name}{self._labels(key)} {_number(value)}"
+
+    def expose(self, dumps: Sequence[List[List[Any]]] = ()) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples(self._merged(dumps)))
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels.get(name, "")) for name in self.labelnames), 0)
+
+
+class Gauge(Metric):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels.get(name, "")) for name in self.labelnames), 0)
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (per-bucket counts incl. +Inf, sum, count)
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0, 0)
+            counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observe the duration of the `with` block, whether or not it raises."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(tuple(str(labels.get(name, "")) for name in self.labelnames))
+        return entry[2] if entry else 0
+
+    def summary(self) -> List[Dict]:
+        """Count, sum and mean per label set, for debug output."""
+        return [
+            {**dict(zip(self.labelnames, key)), "count": count, "sum": round(total, 4),
+             "mean": round(total / count, 4) if count else 0}
+            for key, (_, total, count) in list(self._values.items())
+        ]
+
+    def dump(self) -> List[List[Any]]:
+        with self._lock:
+            return [[list(key), [list(counts), total, count]] for key, (counts, total, count) in self._values.items()]
+
+    def _merged(self, dumps: Sequence[List[List[Any]]]) -> Dict:
+        with self._lock:
+            values = {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+        for dump in dumps:
+            for key, (counts, total, count) in dump:
+                key = tuple(key)
+                if key in values:
+                    own_counts, own_total, own_count = values[key]
+                    counts = [a + b for a, b in zip(own_counts, counts)]
+                    total, count = own_total + total, own_count + count
+                values[key] = (list(counts), total, count)
+        return values
+
+    def _samples(self, values: Dict) -> Iterator[str]:
+        for key, (counts, total, count) in values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{self._labels(key, [('le', _number(float(bound)))])} {cumulative}"
+            yield f"{self.name}_sum{self._labels(key)} {_number(total)}"
+            yield f"{self.name}_count{self._labels(key)} {count}"
+
+
+def snapshot() -> Dict[str, List[List[Any]]]:
+    """Every registered metric's values, by name, for another process to merge."""
+    return {metric.name: metric.dump() for metric in REGISTRY}
+
+
+def render_prometheus(snapshots: Sequence[Dict[str, List[List[Any]]]] = ()) -> str:
+    """
+    All registered metrics in the Prometheus text exposition format (0.0.4),
+    with the values of other processes' snapshots added to this process's.
+    """
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.expose([snap[metric.name] for snap in snapshots if metric.name in snap]))
+    return "\n".join(lines) + "\n"
+
+
+# -- PDF rendering -----------------------------------------------------------
+WKHTMLTOPDF_RENDERS = Counter(
+    "chatxray_wkhtmltopdf_renders_total", "wkhtmltopdf fallback renders by outcome", ["outcome"]
+)
+WKHTMLTOPDF_SECONDS = Histogram(
+    "chatxray_wkhtmltopdf_render_seconds", "wkhtmltopdf fallback render time"
+)
+WKHTMLTOPDF_STDERR_LINES = Counter(
+    "chatxray_wkhtmltopdf_stderr_lines_total", "Warning/error lines written by wkhtmltopdf", ["level"]
+)
+
+# -- Event loop and CPU offloading -------------------------------------------
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "chatxray_event_loop_lag_seconds", "Delay of a scheduled event-loop wake-up",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+EVENT_LOOP_BLOCKED = Counter(
+    "chatxray_event_loop_blocked_total", "Event-loop lag samples above LOOP_LAG_WARN_MS"
+)
+CPU_TASK_SECONDS = Histogram(
+    "chatxray_cpu_task_seconds", "CPU-bound steps run off the event loop", ["task", "pool"]
+)
+
+# -- Report pipeline ---------------------------------------------------------
+PIPELINE_STAGE_SECONDS = Histogram(
+    "chatxray_pipeline_stage_seconds",
+    "Time spent per pipeline stage (primary_chunk is one chunk, primary_job all of them)",
+    ["stage"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+)
+JOBS_IN_FLIGHT = Gauge(
+    "chatxray_jobs_in_flight", "Uploads being analysed right now"
+)
+CHUNKS_FROM_CHECKPOINT = Counter(
+    "chatxray_chunks_from_checkpoint_total", "Primary chunks taken from a job's checkpoint instead of the model"
+)
+REPORTS_REGENERATED = Counter(
+    "chatxray_reports_regenerated_total", "Reports rendered again from stored analysis, without the model"
+)
+JOB_QUEUE_DEPTH = Gauge(
+    "chatxray_job_queue_depth", "Uploads waiting for an analysis worker (WORKERS > 0)"
+)
+WORKER_RESTARTS = Counter(
+    "chatxray_worker_restarts_total", "Analysis worker processes restarted after exiting unexpectedly"
+)
+JOB_DEGRADATIONS = Counter(
+    "chatxray_job_degradations_total", "Jobs degraded to meet their deadline, by what was cut", ["kind"]
+)
+JOBS_CANCELLED = Counter(
+    "chatxray_jobs_cancelled_total", "Jobs cancelled by the user"
+)
+JOBS_INTERRUPTED = Counter(
+    "chatxray_jobs_interrupted_total", "Jobs stopped by a shutdown and queued to resume"
+)
+CANCELLED_TOKENS_SAVED = Counter(
+    "chatxray_cancelled_tokens_saved_total", "Planned tokens not spent because the job was cancelled"
+)
+JOB_FAILURES = Counter(
+    "chatxray_job_failures_total", "Jobs that failed, by the stage they failed in", ["stage"]
+)
+LLM_TOKENS = Counter(
+    "chatxray_llm_tokens_total", "Tokens reported by the OpenAI usage field", ["model", "kind"]
+)
+LLM_RETRIES = Counter(
+    "chatxray_llm_retries_total", "OpenAI calls retried after an error", ["stage"]
+)
+LLM_RATE_LIMITED = Counter(
+    "chatxray_llm_rate_limited_total", "OpenAI calls rejected with HTTP 429", ["stage"]
+)
+CACHE_REQUESTS = Counter(
+    "chatxray_cache_requests_total", "Cache lookups by cache and result (hit/miss)", ["cache", "result"]
+)
+
+# -- Telegram updates ----------------------------------------------------------
+HANDLER_SECONDS = Histogram(
+    "chatxray_handler_seconds", "aiogram handler run time", ["handler"]
+)
+HANDLER_ERRORS = Counter(
+    "chatxray_handler_errors_total", "aiogram handlers that raised", ["handler"]
+)
+UPDATES_IN_FLIGHT = Gauge(
+    "chatxray_updates_in_flight", "Telegram updates being processed right now"
+)
+TELEGRAM_PENDING_UPDATES = Gauge(
+    "chatxray_telegram_pending_updates", "Updates waiting on Telegram's side (getWebhookInfo)"
+)
+TELEGRAM_OUTBOX_PENDING = Gauge(
+    "chatxray_telegram_outbox_pending", "Outgoing Telegram calls waiting for a rate-limit slot"
+)
+TELEGRAM_OUTBOX_WAIT_SECONDS = Histogram(
+    "chatxray_telegram_outbox_wait_seconds", "Time outgoing Telegram calls spent queued", ["priority"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+TELEGRAM_COALESCED = Counter(
+    "chatxray_telegram_coalesced_total", "Queued message edits replaced by a newer edit of the same message"
+)
+TELEGRAM_RETRY_AFTER = Counter(
+    "chatxray_telegram_retry_after_total", "Outgoing Telegram calls rejected by flood control (429)"
+)
@@ -0,0 +1,54 @@
+import gzip
+import logging
+import os
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:  # optional, gzip alone still works
+    brotli = None
+
+# Precompressed siblings picked up by aiohttp's FileResponse via Accept-Encoding
+COMPRESSED_SUFFIXES = (".br", ".gz")
+
+
+def write_compressed_variants(path: Path) -> None:
+    """
+    Store `<file>.gz` (and `<file>.br` when brotli is installed) next to `path`.
+
+    Done once at write time with the highest compression levels, so serving
+    costs nothing per request. A variant that isn't smaller is not kept.
+    """
+    data = Path(path).read_bytes()
+    variants = {".gz": lambda: gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants[".br"] = lambda: brotli.compress(data, quality=11, mode=brotli.MODE_TEXT)
+
+    for suffix, compress in variants.items():
+        target = Path(f"{path}{suffix}")
+        try:
+            compressed = compress()
+            if len(compressed) >= len(data):
+                continue
+            target.write_bytes(compressed)
+            # Same mtime as the original so the variant is never considered newer/stale
+            st = os.stat(path)
+            os.utime(target, ns=(st.st_atime_ns, st.st_mtime_ns))
+        except OSError as e:
+            logger.error(f"Could not write {target}: {e}")
+
+
+def write_report_html(path: Path, html_content: str) -> None:
+    """Write a report HTML file together with its precompressed variants."""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(html_content)
+    write_compressed_variants(path)
+
+
+def remove_compressed_variants(path: str) -> None:
+    for suffix in COMPRESSED_SUFFIXES:
+        variant = f"{path}{suffix}"
+        if os.path.exists(variant):
+            os.unlink(variant)
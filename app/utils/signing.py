@@ -0,0 +1,38 @@
+import hashlib
+import hmac
+import time
+from typing import Optional
+
+from app.config import settings
+
+
+def _key() -> bytes:
+    if settings.REPORT_URL_SECRET:
+        return settings.REPORT_URL_SECRET.encode()
+    # Derived from the bot token so signed links work without extra configuration
+    return hashlib.sha256(f"report-url:{settings.BOT_TOKEN}".encode()).digest()
+
+
+def sign_report_name(name: str, expires: int) -> str:
+    """HMAC-SHA256 signature of a report file name and its expiry timestamp."""
+    message = f"{name}:{expires}".encode()
+    return hmac.new(_key(), message, hashlib.sha256).hexdigest()
+
+
+def signed_query(name: str, expires: float) -> str:
+    """Query string granting access to `name` until `expires` (unix time)."""
+    expires = int(expires)
+    return f"exp={expires}&sig={sign_report_name(name, expires)}"
+
+
+def verify_report_signature(name: str, expires: Optional[str], signature: Optional[str]) -> bool:
+    """Check a signed report link; false for missing, forged or expired links."""
+    if not expires or not signature:
+        return False
+    try:
+        expires_at = int(expires)
+    except ValueError:
+        return False
+    if expires_at < time.time():
+        return False
+    return hmac.compare_digest(sign_report_name(name, expires_at), signature)
@@ -0,0 +1,262 @@
+import asyncio
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from app.config import settings
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    FINAL = 0  # summaries, reports and error messages: what the user is waiting for
+    NORMAL = 1  # replies and status changes
+    PROGRESS = 2  # progress bar edits; fire-and-forget, superseded by later edits
+
+
+class TokenBucket:
+    """`rate` calls per second on average, with bursts of up to `burst`."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready_at(self, now: float) -> float:
+        """When the next call may go out (`now` if it may go right away)."""
+        self._refill(now)
+        return now if self.tokens >= 1 else now + (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now: float) -> bool:
+        """Refilled to `burst`: no different from a new bucket."""
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+@dataclass
+class _Request:
+    call: Callable[[], Awaitable[Any]]
+    chat_id: int
+    priority: Priority
+    seq: int
+    key: Optional[Hashable] = None
+    not_before: float = 0.0
+    attempts: int = 0
+    enqueued: float = field(default_factory=time.monotonic)
+    waiters: List[asyncio.Future] = field(default_factory=list)
+
+
+class TelegramOutbox:
+    """
+    Process-wide scheduler for outgoing Telegram calls (sends, edits, deletes).
+
+    Calls go out within Telegram's limits: a global rate for the whole bot and a
+    smaller one per chat. Among calls that may go out, higher priority first, then
+    first come. A call queued with the key of a still-pending one (an edit of the
+    same message) replaces it; the latest state wins and everyone waiting gets its
+    result. A 429 pauses that chat for `retry_after` and the call is retried; other
+    errors are retried once, except those retrying cannot fix.
+    """
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: float, max_attempts: int = 2):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_attempts = max_attempts
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._paused_until: Dict[int, float] = {}
+        self._pending: List[_Request] = []
+        self._by_key: Dict[Hashable, _Request] = {}
+        # Keys with a call on the wire; the next call for the key waits for it, so
+        # edits of one message never overtake each other
+        self._sending_keys: Set[Hashable] = set()
+        self._sending: Set[asyncio.Task] = set()
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    async def call(
+        self,
+        call: Callable[[], Awaitable[Any]],
+        chat_id: int,
+        priority: Priority = Priority.NORMAL,
+        key: Optional[Hashable] = None,
+        wait: bool = True,
+    ) -> Any:
+        """
+        Queue a Telegram call and return its result, or None if it failed.
+        With wait=False the call is only queued and None is returned at once.
+        """
+        future = asyncio.get_running_loop().create_future()
+        request = _Request(call, chat_id, priority, next(self._seq), key, waiters=[future])
+        previous = self._by_key.get(key) if key is not None else None
+        if previous is not None:
+            # Latest state wins, but keeps the replaced call's place in line
+            self._pending.remove(previous)
+            request.waiters = previous.waiters + request.waiters
+            request.priority = min(previous.priority, priority)
+            request.seq = previous.seq
+            metrics.TELEGRAM_COALESCED.inc()
+        self._enqueue(request)
+        if not wait:
+            return None
+        return await future
+
+    def set_global_rate(self, rate: float) -> None:
+        """Change the bot-wide rate, e.g. to this process's share when several processes send."""
+        self._global = TokenBucket(rate, rate)
+
+    def pending(self) -> int:
+        return len(self._pending) + len(self._sending)
+
+    async def drain(self, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for every queued call to go out, then stop."""
+        deadline = time.monotonic() + timeout
+        while self.pending() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        drained = not self.pending()
+        if not drained:
+            logger.warning(f"Telegram outbox stopped with {self.pending()} calls not sent")
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        return drained
+
+    def _enqueue(self, request: _Request) -> None:
+        if request.key is not None:
+            self._by_key[request.key] = request
+        self._pending.append(request)
+        metrics.TELEGRAM_OUTBOX_PENDING.set(len(self._pending))
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _next(self, now: float) -> Tuple[Optional[_Request], Optional[float]]:
+        """The call to send now, or when the earliest one becomes sendable."""
+        global_ready = self._global.ready_at(now)
+        best: Optional[_Request] = None
+        earliest: Optional[float] = None
+        for request in self._pending:
+            if request.key is not None and request.key in self._sending_keys:
+                continue  # woken up again when the call on the wire finishes
+            ready = max(
+                global_ready,
+                request.not_before,
+                self._paused_until.get(request.chat_id, 0.0),
+                self._chat_bucket(request.chat_id).ready_at(now),
+            )
+            if ready <= now:
+                if best is None or (request.priority, request.seq) < (best.priority, best.seq):
+                    best = request
+            elif earliest is None or ready < earliest:
+                earliest = ready
+        return best, earliest
+
+    async def _run(self) -> None:
+        while True:
+            now = time.monotonic()
+            request, ready_at = self._next(now)
+            if request is None:
+                self._wakeup.clear()
+                timeout = None if ready_at is None else ready_at - now
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._pending.remove(request)
+            if request.key is not None:
+                if self._by_key.get(request.key) is request:
+                    del self._by_key[request.key]
+                self._sending_keys.add(request.key)
+            metrics.TELEGRAM_OUTBOX_PENDING.set(len(self._pending))
+            metrics.TELEGRAM_OUTBOX_WAIT_SECONDS.observe(now - request.enqueued, priority=request.priority.name.lower())
+            self._global.take(now)
+            self._chat_bucket(request.chat_id).take(now)
+            task = asyncio.create_task(self._send(request))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, request: _Request) -> None:
+        request.attempts += 1
+        try:
+            result = await request.call()
+        except TelegramRetryAfter as e:
+            # Flood control: nothing goes to this chat until Telegram says so
+            metrics.TELEGRAM_RETRY_AFTER.inc()
+            logger.warning(f"Telegram flood control in chat {request.chat_id}, retrying in {e.retry_after}s")
+            self._paused_until[request.chat_id] = time.monotonic() + e.retry_after
+            request.attempts -= 1
+            self._retry(request)
+        except (TelegramBadRequest, TelegramForbiddenError) as e:
+            # Message gone or not modified, bot blocked: retrying cannot help
+            logger.warning(f"Telegram call in chat {request.chat_id} rejected: {e}")
+            self._resolve(request, None)
+        except Exception as e:
+            if request.attempts < self.max_attempts:
+                logger.warning(f"Telegram call in chat {request.chat_id} failed: {e} – retrying once")
+                request.not_before = time.monotonic() + 0.5
+                self._retry(request)
+            else:
+                logger.error(f"Telegram call in chat {request.chat_id} failed again: {e}")
+                self._resolve(request, None)
+        else:
+            self._resolve(request, result)
+        finally:
+            self._sending_keys.discard(request.key)
+            self._forget_idle_chats(time.monotonic())
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+    def _forget_idle_chats(self, now: float) -> None:
+        """Drop per-chat state a new chat would start with anyway, so it doesn't grow with every chat served."""
+        for chat_id, bucket in list(self._chats.items()):
+            if bucket.full(now):
+                del self._chats[chat_id]
+        for chat_id, until in list(self._paused_until.items()):
+            if until <= now:
+                del self._paused_until[chat_id]
+
+    def _retry(self, request: _Request) -> None:
+        newer = self._by_key.get(request.key) if request.key is not None else None
+        if newer is not None:
+            # Superseded while on the wire; the newer call answers these waiters too
+            newer.waiters = request.waiters + newer.waiters
+            return
+        self._enqueue(request)
+
+    @staticmethod
+    def _resolve(request: _Request, result: Any) -> None:
+        for waiter in request.waiters:
+            if not waiter.done():
+                waiter.set_result(result)
+
+
+outbox = TelegramOutbox(
+    global_rate=settings.TELEGRAM_GLOBAL_RATE,
+    chat_rate=settings.TELEGRAM_CHAT_RATE,
+    chat_burst=settings.TELEGRAM_CHAT_BURST,
+)
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import multiprocessing
+import signal
+import sys
+import time
+from multiprocessing.process import BaseProcess
+from typing import List, Optional
+
+import sentry_sdk
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.enums import ParseMode
+
+from app.config import settings
+from app.services import job_queue, worker_metrics
+from app.services.jobs import jobs
+from app.services.pipeline import drain, lease_heartbeat, run_queued, runner_lease, spawn_background
+from app.services.state_store import leases
+from app.utils import metrics
+from app.utils.executor import prewarm_process_pool, shutdown_executors
+from app.utils.telegram_outbox import outbox
+
+logger = logging.getLogger(__name__)
+
+# With WORKERS > 0 the bot process only takes updates (webhook or polling),
+# answers commands and queues uploads; the analysis pipeline - parsing, LLM
+# calls, rendering - runs in separate worker processes that take uploads from
+# the job queue in the state DB and talk to Telegram themselves.
+
+
+async def serve(index: int, stop, pool: str) -> None:
+    """Take uploads from the queue and analyse them until `stop` is set."""
+    owner = f"{settings.INSTANCE_ID}-w{index}"
+    settings.INSTANCE_ID = jobs.owner = owner
+    # The bot-wide Telegram rate is shared by the front end and every worker
+    outbox.set_global_rate(settings.TELEGRAM_GLOBAL_RATE / (settings.WORKERS + 1))
+
+    bot = Bot(token=settings.BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    from app.services.render import pdf_renderer
+    spawn_background(pdf_renderer.prewarm())
+    spawn_background(prewarm_process_pool())
+    heartbeat = spawn_background(lease_heartbeat())
+
+    # Uploads held by workers that are gone (earlier runs of this one included) go back in the queue
+    await leases.acquire(runner_lease(owner), owner, settings.LEASE_TTL_SECONDS)
+    peers = [lease.owner for lease in await leases.list(runner_lease("")) if lease.owner != owner]
+    await job_queue.recover(peers)
+    logger.info(f"Analysis worker {owner} ready")
+
+    # SIGTERM sent to the worker itself (rather than via the front end) drains it too
+    terminated = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, terminated.set)
+
+    running: set = set()
+    renewed = time.monotonic()
+    while not (stop.is_set() or terminated.is_set()):
+        try:
+            if time.monotonic() - renewed > settings.LEASE_TTL_SECONDS / 3:
+                await leases.acquire(runner_lease(owner), owner, settings.LEASE_TTL_SECONDS)
+                await worker_metrics.publish(pool, owner)
+                renewed = time.monotonic()
+            if len(running) >= settings.WORKER_CONCURRENCY:
+                await asyncio.wait(running, timeout=settings.WORKER_POLL_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+                continue
+            queued = await job_queue.claim(owner)
+        except Exception as e:
+            logger.warning(f"Worker {owner}: job queue unavailable: {e}")
+            queued = None
+        if queued is None:
+            await asyncio.sleep(settings.WORKER_POLL_SECONDS)
+            continue
+        logger.info(f"Worker {owner} took queued upload {queued.id} (attempt {queued.attempts})")
+        task = asyncio.create_task(run_queued(bot, queued))
+        running.add(task)
+        task.add_done_callback(running.discard)
+
+    # Stopping: no new uploads; the jobs in progress get the grace period, the
+    # rest is queued to resume after the restart
+    logger.info(f"Worker {owner} stopping, {len(running)} jobs in progress")
+    await drain(settings.SHUTDOWN_GRACE_SECONDS)
+    if running:
+        await asyncio.wait(running, timeout=10)
+    heartbeat.cancel()
+    try:
+        await worker_metrics.publish(pool, owner)
+    except Exception as e:
+        logger.warning(f"Worker {owner}: could not publish final metrics: {e}")
+    await leases.release(runner_lease(owner), owner)
+    await outbox.drain(timeout=5)
+    shutdown_executors()
+    await bot.session.close()
+
+
+def run_worker(index: int, stop, pool: str) -> None:
+    """Entry point of a worker process (spawned by WorkerPool); `pool` is the bot process's INSTANCE_ID."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        stream=sys.stdout,
+    )
+    if settings.SENTRY_DSN:
+        sentry_sdk.init(dsn=settings.SENTRY_DSN, environment=settings.ENVIRONMENT, traces_sample_rate=0.1)
+    # Ctrl-C reaches the whole process group; the front end decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(serve(index, stop, pool))
+
+
+class WorkerPool:
+    """The analysis worker processes, started, restarted and stopped by the bot process."""
+
+    def __init__(self, count: int):
+        self.count = count
+        # spawn: the bot process already runs threads, forking it is unsafe
+        self._context = multiprocessing.get_context("spawn")
+        self._stop = self._context.Event()
+        self._processes: List[Optional[BaseProcess]] = [None] * count
+
+    def start(self) -> None:
+        for index in range(self.count):
+            self._spawn(index)
+
+    def _spawn(self, index: int) -> None:
+        process = self._context.Process(
+            target=run_worker, args=(index, self._stop, settings.INSTANCE_ID), name=f"analysis-worker-{index}"
+        )
+        process.start()
+        self._processes[index] = process
+        logger.info(f"Started analysis worker {index} (pid {process.pid})")
+
+    async def supervise(self) -> None:
+        """Restart workers that exited and put the uploads they held back in the queue."""
+        try:
+            await worker_metrics.prune()
+        except Exception as e:
+            logger.warning(f"Could not prune metrics of earlier worker pools: {e}")
+        while not self._stop.is_set():
+            await asyncio.sleep(settings.LEASE_TTL_SECONDS / 3)
+            if self._stop.is_set():
+                break
+            try:
+                for index, process in enumerate(self._processes):
+                    if process is not None and not process.is_alive():
+                        logger.error(f"Analysis worker {index} exited with code {process.exitcode}, restarting")
+                        metrics.WORKER_RESTARTS.inc()
+                        self._spawn(index)
+                live = [lease.owner for lease in await leases.list(runner_lease(""))]
+                requeued = await job_queue.recover(live)
+                if requeued:
+                    logger.warning(f"Requeued {requeued} uploads held by analysis workers that are gone")
+                metrics.JOB_QUEUE_DEPTH.set(await job_queue.depth())
+            except Exception as e:
+                logger.warning(f"Worker supervision failed: {e}")
+
+    def stop_claiming(self) -> None:
+        """Workers take no more uploads from the queue and start draining."""
+        self._stop.set()
+
+    async def stop(self, timeout: float) -> None:
+        """Let the workers drain and exit; terminate any still running after `timeout`."""
+        self.stop_claiming()
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            if process is not None:
+                await asyncio.to_thread(process.join, max(0.0, deadline - time.monotonic()))
+        for index, process in enumerate(self._processes):
+            if process is not None and process.is_alive():
+                logger.warning(f"Analysis worker {index} still busy after {timeout:.0f}s, terminating it")
+                process.terminate()
+                await asyncio.to_thread(process.join, 5)
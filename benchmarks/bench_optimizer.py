@@ -0,0 +1,55 @@
+"""
+Benchmark: report size optimizer. HTML size and optimisation cost always; PDF
+render time and size before/after when WeasyPrint (with Pango) is available.
+
+Usage:
+    BOT_TOKEN=x OPENAI_API_KEY=x python -m benchmarks.bench_optimizer [--quotes 40] [--repeat 5]
+"""
+import argparse
+import io
+import statistics
+import time
+
+from app.services.render import PdfRenderer
+from app.services.report_optimizer import optimize_report_html
+from benchmarks.bench_render import build_report
+
+
+def render(renderer: PdfRenderer, html_content: str):
+    buffer = io.BytesIO()
+    started = time.perf_counter()
+    renderer.render(html_content, buffer)
+    return (time.perf_counter() - started) * 1000, len(buffer.getvalue())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--quotes", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    original = build_report(args.quotes)
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        optimized = optimize_report_html(original)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    print(f"HTML size : {len(original.encode()) / 1024:7.1f} KiB -> {len(optimized.encode()) / 1024:7.1f} KiB")
+    print(f"optimize  : {statistics.median(timings):7.1f} ms (median)")
+
+    renderer = PdfRenderer()
+    try:
+        renderer.warm_up()
+    except Exception as e:
+        print(f"PDF render skipped, WeasyPrint unavailable: {e}")
+        return
+
+    before = [render(renderer, original) for _ in range(args.repeat)]
+    after = [render(renderer, optimized) for _ in range(args.repeat)]
+    print(f"render    : {statistics.median(t for t, _ in before):7.1f} ms -> {statistics.median(t for t, _ in after):7.1f} ms (median)")
+    print(f"PDF size  : {before[0][1] / 1024:7.1f} KiB -> {after[0][1] / 1024:7.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
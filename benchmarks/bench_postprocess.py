@@ -0,0 +1,108 @@
+"""
+Benchmark: legacy multi-pass report post-processing vs the single-pass transformer.
+
+The legacy pipeline is reproduced here as it ran in generate_meta_report plus
+bot.extract_insights_for_telegram: regex head injection, html.unescape, doctype
+search, two <body> substitutions, one re.sub per chart placeholder and a second
+full BeautifulSoup parse for the Telegram insights.
+
+Usage:
+    BOT_TOKEN=x OPENAI_API_KEY=x python -m benchmarks.bench_postprocess [--quotes 600] [--repeat 5]
+"""
+import argparse
+import html as _html_module
+import re
+import statistics
+import time
+
+from bs4 import BeautifulSoup
+
+from app.services.html_postprocess import postprocess_report_html
+from app.services.report_template import REPORT_CSS
+
+
+def build_report(quotes: int, charts: int) -> str:
+    parts = ["<!DOCTYPE html><html><head><meta charset='UTF-8'><title>Отчет</title></head><body>"]
+    parts.append("<h1>Chat X-Ray</h1><h2>Общий обзор</h2>")
+    parts.extend(f"<p>Абзац обзора {i} с текстом &laquo;анализа&raquo; отношений.</p>" for i in range(40))
+    parts.append("<h2>Паттерны общения</h2><p>Паттерны.</p><h2>Анализ эмоций</h2><p>Эмоции.</p>")
+    parts.append("<h2>Ключевые цитаты</h2>")
+    for i in range(quotes):
+        parts.append(
+            f'<div class="quote"><p>"Цитата номер {i}"</p><p class="quote-author">Автор {i % 2}</p>'
+            f'<p class="quote-emotion">Эмоция: грусть | Стиль общения: пассивный</p>'
+            f"<p>Психологический анализ: {'подробный разбор ' * 20}</p></div>"
+        )
+    parts.append("<h2>Рекомендации</h2>")
+    parts.extend(f'<div class="recommendation"><h3>Совет {i}</h3><p>{"текст " * 40}</p></div>' for i in range(20))
+    parts.append("<h2>Количественный анализ</h2>")
+    parts.extend(f'<p class="chart-placeholder">Здесь будет график {i}</p><p>Комментарий.</p>' for i in range(charts))
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+def legacy_pipeline(html_content: str, svgs, banner: str) -> str:
+    style_block = f"<style>{REPORT_CSS}</style>"
+    head_match = re.search(r"<head[^>]*>", html_content, re.IGNORECASE)
+    html_content = html_content[:head_match.end()] + style_block + html_content[head_match.end():]
+    html_content = _html_module.unescape(html_content)
+    m = re.search(r'(<!DOCTYPE html[\s\S]*|<html[\s\S]*)', html_content, re.IGNORECASE)
+    if m:
+        html_content = m.group(1).lstrip()
+    if "<meta name=\"viewport\"" not in html_content:
+        html_content = html_content.replace("<head>", "<head>\n<meta name=\"viewport\">", 1)
+    html_content = re.sub(r'<body[^>]*>', lambda m: m.group(0) + banner, html_content, count=1)
+    html_content = re.compile(r"<body[^>]*>", re.IGNORECASE).sub(lambda m: m.group(0) + banner, html_content, count=1)
+    for svg in svgs:
+        html_content = re.sub(r'<p class="chart-placeholder">[\s\S]*?</p>', f"<div class='chart-container'>{svg}</div>", html_content, count=1)
+    html_content = re.sub(r'<p class="chart-placeholder">[\s\S]*?</p>', '<p><i>(нет графика)</i></p>', html_content)
+
+    soup = BeautifulSoup(html_content, "html.parser")
+    overview = soup.find("h2", string=re.compile("Общий обзор", re.IGNORECASE))
+    if overview and overview.find_next("p"):
+        overview.find_next("p").text.strip()
+    recs = soup.find("h2", string=re.compile("Рекомендации", re.IGNORECASE))
+    if recs:
+        [r.text.strip() for r in recs.find_next_siblings("div", class_="recommendation")[:3]]
+    for q in soup.find_all("div", class_="quote")[:2]:
+        q.find("p").text.strip()
+    return html_content
+
+
+def single_pass(html_content: str, svgs, banner: str) -> str:
+    html_out, _ = postprocess_report_html(
+        html_content, head_html=f"<style>{REPORT_CSS}</style>", body_html=banner, charts=svgs
+    )
+    return html_out
+
+
+def timed(fn, *args, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quotes", type=int, default=600)
+    parser.add_argument("--charts", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    report = build_report(args.quotes, args.charts)
+    rects = '<rect x="1" y="2"/>' * 50
+    svgs = [f"<svg id='chart-{i}'>{rects}</svg>" for i in range(args.charts - 1)]
+    banner = "<div class='messages-banner'>Отчёт подготовлен после анализа <b>5000</b> сообщений.</div>"
+
+    legacy = timed(legacy_pipeline, report, svgs, banner, repeat=args.repeat)
+    single = timed(single_pass, report, svgs, banner, repeat=args.repeat)
+    print(f"report size: {len(report) / 1024:.0f} KiB, quotes: {args.quotes}, charts: {args.charts}")
+    print(f"legacy multi-pass + BeautifulSoup: {legacy * 1000:8.1f} ms")
+    print(f"single-pass transform + insights:  {single * 1000:8.1f} ms  ({legacy / single:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark: per-report PDF render time, legacy vs the warm PdfRenderer.
+
+- legacy: a fresh weasyprint.HTML(string=...).write_pdf() per report, parsing the
+  inline stylesheet and resolving fonts every time (what render_to_pdf used to do)
+- cold: the first render of a new PdfRenderer (import, API detection, font and
+  stylesheet loading included)
+- warm: subsequent renders on the same PdfRenderer
+
+Needs WeasyPrint with its system libraries (Pango). Usage:
+    BOT_TOKEN=x OPENAI_API_KEY=x python -m benchmarks.bench_render [--quotes 40] [--repeat 5]
+"""
+import argparse
+import io
+import json
+import statistics
+import time
+
+from app.services.graphics import generate_bar_chart_svg, generate_radar_chart_svg
+from app.services.render import PdfRenderer
+from app.services.report_schema import parse_report_content
+from app.services.report_template import render_report
+
+
+def build_report(quotes: int) -> str:
+    paragraph = "Подробный разбор динамики общения и эмоциональных реакций участников. " * 6
+    content = parse_report_content(json.dumps({
+        "overview": [paragraph] * 4,
+        "communication_patterns": [paragraph] * 4,
+        "emotional_analysis": [paragraph] * 4,
+        "toxic_interactions": [paragraph] * 2,
+        "key_quotes": [
+            {"text": f"Цитата {i}", "author": f"Автор {i % 2}", "emotion": "грусть",
+             "style": "пассивный", "analysis": paragraph}
+            for i in range(quotes)
+        ],
+        "psychological_insights": [paragraph] * 4,
+        "recommendations": [{"title": f"Совет {i}", "text": paragraph} for i in range(8)],
+        "quantitative_analysis": {"communication_metrics": [paragraph]},
+        "participant_portraits": [{"participant": "Автор 0", "paragraphs": [paragraph] * 3}],
+    }, ensure_ascii=False))
+    metrics = {
+        "Автор 0": {"toxicity": 0.2, "manipulation": 0.1, "assertiveness": 0.6, "empathy": 0.7},
+        "Автор 1": {"toxicity": 0.4, "manipulation": 0.3, "assertiveness": 0.4, "empathy": 0.5},
+    }
+    charts = {"communication_metrics": [
+        generate_radar_chart_svg(metrics),
+        generate_bar_chart_svg({a: m["toxicity"] for a, m in metrics.items()}, "Токсичность", chart_id="t"),
+    ]}
+    return render_report(content, charts=charts, total_messages=1200)
+
+
+def legacy_render(html_content: str) -> None:
+    import weasyprint
+    weasyprint.HTML(string=html_content).write_pdf(io.BytesIO())
+
+
+def timed(func, *args) -> float:
+    started = time.perf_counter()
+    func(*args)
+    return (time.perf_counter() - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--quotes", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    html_content = build_report(args.quotes)
+    print(f"Report size: {len(html_content) / 1024:.0f} KiB, {args.repeat} renders per variant")
+
+    renderer = PdfRenderer()
+    cold = timed(renderer.render, html_content, io.BytesIO())
+    warm = [timed(renderer.render, html_content, io.BytesIO()) for _ in range(args.repeat)]
+    legacy = [timed(legacy_render, html_content) for _ in range(args.repeat)]
+
+    print(f"legacy per report : {statistics.median(legacy):8.1f} ms (median)")
+    print(f"renderer cold     : {cold:8.1f} ms (first render)")
+    print(f"renderer warm     : {statistics.median(warm):8.1f} ms (median)")
+
+
+if __name__ == "__main__":
+    main()
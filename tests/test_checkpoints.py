@@ -0,0 +1,113 @@
+import pytest
+
+from app.services import checkpoints, llm_primary
+from app.utils import db
+
+
+@pytest.fixture
+def state_db(tmp_path, monkeypatch):
+    database = db.Database(tmp_path / "state.db")
+    monkeypatch.setattr(db, "state_db", database)
+    yield database
+    database.close()
+
+
+def _chunks(n):
+    return [[{"raw": f"m{i}", "author": "A", "timestamp": "t"}] for i in range(n)]
+
+
+@pytest.mark.asyncio
+async def test_second_run_only_sends_missing_chunks(state_db, monkeypatch):
+    sent = []
+    failures = {"m2": 1}
+
+    async def flaky_chunk(chunk, model=None):
+        sent.append(chunk[0]["raw"])
+        if failures.get(chunk[0]["raw"]):
+            failures[chunk[0]["raw"]] -= 1
+            return [{"error": "timeout", "raw_input": "m2"}], 5
+        return [{"author": "A", "text": chunk[0]["raw"]}], 10
+
+    monkeypatch.setattr(llm_primary, "process_chunk", flaky_chunk)
+    await checkpoints.start_job("job-1", "7", 10, "{}")
+
+    results, tokens = await llm_primary.process_chunks(_chunks(4), job_id="job-1")
+    assert tokens == 35
+    assert "error" in results[2]
+
+    # The failed chunk is the only one sent again
+    sent.clear()
+    results, tokens = await llm_primary.process_chunks(_chunks(4), job_id="job-1")
+    assert sent == ["m2"]
+    assert tokens == 10
+    assert [r["text"] for r in results] == ["m0", "m1", "m2", "m3"]
+
+
+@pytest.mark.asyncio
+async def test_changed_chunk_is_not_taken_from_checkpoint(state_db, monkeypatch):
+    sent = []
+
+    async def fake_chunk(chunk, model=None):
+        sent.append(chunk[0]["raw"])
+        return [{"text": chunk[0]["raw"]}], 1
+
+    monkeypatch.setattr(llm_primary, "process_chunk", fake_chunk)
+    await llm_primary.process_chunks(_chunks(2), job_id="job-1")
+    sent.clear()
+
+    rechunked = [[{"raw": "m0", "author": "A", "timestamp": "t"}, {"raw": "m1", "author": "A", "timestamp": "t"}]]
+    results, _ = await llm_primary.process_chunks(rechunked, job_id="job-1")
+    assert sent == ["m0"]
+    assert results == [{"text": "m0"}]
+
+
+@pytest.mark.asyncio
+async def test_primary_results_load_only_when_complete(state_db):
+    await checkpoints.start_job("job-1", "7", 10, "{}")
+    chunks = _chunks(2)
+    await checkpoints.save_chunk("job-1", 0, checkpoints.chunk_digest(chunks[0]), [{"text": "m0"}], 10)
+    await checkpoints.record_primary("job-1", chunks=2, total_messages=2)
+    assert await checkpoints.load_primary("job-1") is None
+
+    await checkpoints.save_chunk("job-1", 1, checkpoints.chunk_digest(chunks[1]), [{"text": "m1"}], 10)
+    primary = await checkpoints.load_primary("job-1")
+    assert primary.results == [{"text": "m0"}, {"text": "m1"}]
+    assert (primary.total_messages, primary.chunks) == (2, 2)
+
+    await checkpoints.delete("job-1")
+    assert await checkpoints.get_job("job-1") is None
+    assert await checkpoints.load_chunks("job-1") == {}
+
+
+@pytest.mark.asyncio
+async def test_recorded_primary_results_include_unsaved_chunks(state_db):
+    """A failed or aggregate-only chunk is not checkpointed, yet the stored analysis stays complete"""
+    await checkpoints.start_job("job-1", "7", 10, "{}")
+    chunks = _chunks(2)
+    await checkpoints.save_chunk("job-1", 0, checkpoints.chunk_digest(chunks[0]), [{"text": "m0"}], 10)
+    results = [{"text": "m0"}, {"error": "timeout", "raw_input": "m1"}]
+    await checkpoints.record_primary("job-1", chunks=2, total_messages=2, results=results)
+
+    primary = await checkpoints.load_primary("job-1")
+    assert primary.results == results
+    assert list(await checkpoints.load_chunks("job-1")) == [0]
+
+
+@pytest.mark.asyncio
+async def test_rerun_keeps_the_plan_of_the_first_run(state_db, monkeypatch):
+    from app.config import settings
+    from app.services.planner import plan_job
+
+    messages = [{"raw": f"[01.01.24 10:{i % 60:02d}] A: слово слово"} for i in range(100)]
+    await checkpoints.start_job("job-1", "7", 10, "{}")
+    await checkpoints.record_plan("job-1", 15, "gpt-3.5-turbo", 150)
+
+    # The planner's candidates changed since the first run
+    monkeypatch.setattr(settings, "PLANNER_CHUNK_SIZES", [40])
+    monkeypatch.setattr(settings, "PLANNER_PRIMARY_MODELS", ["gpt-4o-mini"])
+    first_run = await checkpoints.get_job("job-1")
+    plan, chunks = await plan_job(
+        messages, first_run.chunk_size, first_run.primary_model, first_run.meta_sample_size
+    )
+    assert (plan.chunk_size, plan.primary_model, plan.meta_sample_size) == (15, "gpt-3.5-turbo", 150)
+    assert len(chunks[0]) == 15
@@ -1,9 +1,10 @@
+import io
 import os
 import tempfile
 import pytest
 from pathlib import Path
 
-from app.services.chunker import extract_message_parts, split_chat, count_tokens
+from app.services.chunker import extract_message_parts, extract_messages, split_chat, count_tokens
 from app.config import settings
 
 
@@ -93,4 +94,22 @@ def test_split_chat():
         os.unlink(temp_file_path)
         # Restore original settings
         settings.MAX_MESSAGES_PER_CHUNK = original_max_messages
-        settings.MAX_TOKENS_PER_CHUNK = original_max_tokens 
\ No newline at end of file
+        settings.MAX_TOKENS_PER_CHUNK = original_max_tokens 
+
+
+def test_extract_messages_from_memory(tmp_path):
+    """Paths, raw bytes and streams parse the same; the file name picks the format"""
+    chat = "".join(f"[2023-05-01 10:{i:02d}:00] {'Alice' if i % 2 else 'Bob'}: message {i}\n" for i in range(60))
+    path = tmp_path / "chat.txt"
+    path.write_text(chat, encoding="utf-8")
+    data = chat.encode("utf-8")
+
+    from_path = extract_messages(path)
+    assert len(from_path) == 60
+    assert extract_messages(data, "upload.txt") == from_path
+    assert extract_messages(io.BytesIO(data)) == from_path
+    assert extract_messages(io.StringIO(chat)) == from_path
+
+    html = b"<div class='message'><div class='message-header'><span class='message-author'>Alice</span></div>" \
+           b"<div class='message-content'>hi</div></div>"
+    assert extract_messages(html, "chat.html")[0]["author"] == "Alice"
@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.config import settings
+from app.services import cost_ledger
+from app.utils import db
+
+
+def _usage(prompt, completion, cached=0):
+    return SimpleNamespace(
+        prompt_tokens=prompt,
+        completion_tokens=completion,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=cached),
+    )
+
+
+@pytest.fixture
+def ledger_db(tmp_path, monkeypatch):
+    database = db.Database(tmp_path / "state.db")
+    monkeypatch.setattr(db, "state_db", database)
+    yield database
+    database.close()
+
+
+@pytest.mark.asyncio
+async def test_usage_priced_per_model_and_aggregated(ledger_db, monkeypatch):
+    """Calls are priced by model prefix, cached input is discounted, totals group by job/stage"""
+    monkeypatch.setattr(settings, "MODEL_PRICES_PER_1K", {"gpt-4-turbo": {"input": 0.01, "output": 0.03}})
+    monkeypatch.setattr(settings, "COST_PER_1K_TOKENS_GPT35_TURBO", 0.001)
+    monkeypatch.setattr(settings, "CACHED_INPUT_PRICE_RATIO", 0.5)
+
+    with cost_ledger.job_context("job-1", "42"):
+        assert await cost_ledger.record_usage(_usage(1000, 100), "gpt-3.5-turbo-0125", stage="primary") == 1100
+        await cost_ledger.record_usage(_usage(2000, 1000, cached=1000), "gpt-4-turbo-2024-04-09", stage="meta")
+    await cost_ledger.record_usage(_usage(500, 0), "gpt-3.5-turbo", stage="primary")
+
+    job = await cost_ledger.job_totals("job-1")
+    assert job.calls == 2
+    assert job.cached_tokens == 1000
+    # 1.1K tokens at $0.001, then 1K input + 1K cached at half price + 1K output
+    assert job.cost_usd == pytest.approx(0.0011 + 0.01 + 0.005 + 0.03)
+
+    stages = await cost_ledger.job_stage_totals("job-1")
+    assert stages["meta"].completion_tokens == 1000
+    assert (await cost_ledger.user_totals("42")).total_tokens == 4100
+    assert (await cost_ledger.stage_totals())["primary"].calls == 2
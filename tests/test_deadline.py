@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from app.services import llm_primary
+from app.utils.deadline import Deadline
+
+
+@pytest.mark.asyncio
+async def test_chunks_past_the_deadline_get_aggregate_only_results(monkeypatch):
+    """Calls still running at the deadline are abandoned and nothing new is sent"""
+    calls = []
+
+    async def slow_chunk(chunk, model=None):
+        calls.append(chunk[0]["raw"])
+        await asyncio.sleep(0.05 if len(calls) == 1 else 10)
+        return [{"author": "A", "toxicity": 0.1}], 10
+
+    monkeypatch.setattr(llm_primary, "process_chunk", slow_chunk)
+    chunks = [[{"raw": f"m{i}", "author": "B" if i == 2 else "A", "timestamp": "t"}] for i in range(4)]
+    deadline = Deadline(1.0)
+
+    results, tokens = await asyncio.wait_for(
+        llm_primary.process_chunks(chunks, deadline=deadline, reserve_seconds=0.8), timeout=2
+    )
+
+    assert tokens == 10
+    assert results[0] == {"author": "A", "toxicity": 0.1}
+    assert [r.get("coverage") for r in results[1:]] == ["aggregate_only"] * 3
+    assert results[2]["messages_per_author"] == {"B": 1}
+    assert deadline.degraded("primary")
+    assert "3 из 4" in deadline.notes()[0]
+
+
+@pytest.mark.asyncio
+async def test_meta_stream_timeout_without_deadline_keeps_complete_sections(monkeypatch):
+    import json
+
+    from app.services import llm_meta
+
+    raw = json.dumps({"overview": ["Обзор."], "communication_patterns": ["Паттерны."]}, ensure_ascii=False)
+
+    async def stalled_stream(messages, request_kwargs, parts, tracker, *args):
+        # Cut off inside the second section
+        partial = raw[: raw.index("Паттерны")]
+        parts.append(partial)
+        tracker.feed(partial)
+        raise asyncio.TimeoutError()
+
+    monkeypatch.setattr(llm_meta, "_stream_meta_completion", stalled_stream)
+    report = await llm_meta.generate_meta_report([{"author": "A", "toxicity": 0.1}], 1)
+
+    assert "Обзор." in report.html
+    assert report.content is not None
+    assert report.error is None
+
+
+@pytest.mark.asyncio
+async def test_unparseable_meta_output_is_reported_as_an_error(monkeypatch):
+    """The pipeline must not deliver or index the error page as a report"""
+    from app.services import llm_meta
+
+    async def garbled_stream(messages, request_kwargs, parts, tracker, *args):
+        parts.append("Извините, не могу помочь.")
+
+    monkeypatch.setattr(llm_meta, "_stream_meta_completion", garbled_stream)
+    report = await llm_meta.generate_meta_report([{"author": "A", "toxicity": 0.1}], 1)
+
+    assert report.error is not None
+    assert report.raw_content == ""
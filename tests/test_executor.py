@@ -0,0 +1,36 @@
+import asyncio
+import math
+import threading
+import time
+
+import pytest
+
+from app.config import settings
+from app.utils import executor, metrics
+from app.utils.loop_monitor import monitor_loop_lag
+
+
+@pytest.mark.asyncio
+async def test_run_in_thread_and_process_fallback(monkeypatch):
+    """Work leaves the loop thread; without process workers it uses threads"""
+    loop_thread = threading.get_ident()
+    assert await executor.run_in_thread(threading.get_ident) != loop_thread
+
+    monkeypatch.setattr(settings, "CPU_PROCESS_WORKERS", 0)
+    assert await executor.run_in_process(math.factorial, 10) == 3628800
+    assert metrics.CPU_TASK_SECONDS.count(task="factorial", pool="thread") >= 1
+
+
+@pytest.mark.asyncio
+async def test_loop_lag_monitor_counts_blocking(monkeypatch):
+    """A synchronous stall longer than the threshold is counted"""
+    monkeypatch.setattr(settings, "LOOP_LAG_WARN_MS", 50)
+    before = metrics.EVENT_LOOP_BLOCKED.value()
+    monitor = asyncio.create_task(monitor_loop_lag(interval=0.01))
+    try:
+        await asyncio.sleep(0.02)
+        time.sleep(0.2)  # block the loop
+        await asyncio.sleep(0.05)
+    finally:
+        monitor.cancel()
+    assert metrics.EVENT_LOOP_BLOCKED.value() > before
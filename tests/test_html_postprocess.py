@@ -0,0 +1,48 @@
+from app.services.html_postprocess import postprocess_report_html, extract_report_insights
+
+
+LEGACY_REPORT = """Вот ваш отчет:
+<!DOCTYPE html>
+<html><head><title>Отчет</title></head>
+<body>
+<h2>Общий обзор</h2>
+<p>Отношения стабильны &amp; теплые.</p>
+<p class="chart-placeholder">Здесь будет график 1</p>
+<h2>Рекомендации</h2>
+<div class="recommendation">Слушайте друг друга</div>
+<div class="recommendation">Делайте паузы</div>
+<div class="quote"><p>"Я рядом"</p><p class="quote-author">Анна</p></div>
+<p class="chart-placeholder">Здесь будет график 2</p>
+</body></html>"""
+
+
+def test_postprocess_applies_all_injections_in_one_pass():
+    """CSS, banner, viewport and charts are injected; the preamble is dropped"""
+    html, insights = postprocess_report_html(
+        LEGACY_REPORT,
+        head_html="<style>.x{}</style>",
+        body_html="<div class='banner'>b</div>",
+        charts=["<svg id='c1'></svg>"],
+    )
+
+    assert html.startswith("<!DOCTYPE html>")
+    assert "<head><style>.x{}</style>" in html
+    assert 'name="viewport"' in html
+    assert "<body><div class='banner'>b</div>" in html
+    assert "<div class='chart-container'><svg id='c1'></svg></div>" in html
+    assert "Визуализация для этого раздела не была сгенерирована" in html
+    assert "chart-placeholder" not in html
+    assert "стабильны &amp; теплые" in html
+
+    assert insights.overview == "Отношения стабильны & теплые."
+    assert insights.recommendations == ["Слушайте друг друга", "Делайте паузы"]
+    assert insights.quotes == [('"Я рядом"', "Анна")]
+
+
+def test_postprocess_wraps_fragments():
+    """Output without a document wrapper gets one"""
+    html, _ = postprocess_report_html("<p>Только текст</p>", body_html="<div>b</div>")
+    assert html.startswith("<!DOCTYPE html>")
+    assert "<div>b</div>" in html
+    assert "<p>Только текст</p>" in html
+    assert extract_report_insights(html).overview == ""
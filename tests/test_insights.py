@@ -0,0 +1,28 @@
+import json
+
+from app.services.insights import insights_from_content, format_telegram_insights, ReportInsights
+from app.services.report_schema import parse_report_content
+
+
+def test_insights_from_structured_content():
+    """The summary is built from report content and metrics, no HTML involved"""
+    content = parse_report_content(json.dumps({
+        "overview": ["Обзор <важный>."],
+        "communication_patterns": ["Паттерны."],
+        "recommendations": [{"title": "Пауза", "text": "..."}, {"text": "Без названия"}],
+        "key_quotes": [{"text": "Я рядом", "author": "Анна"}],
+    }, ensure_ascii=False))
+    insights = insights_from_content(content, {"Анна": {"toxicity": 0.12, "empathy": 0.8}})
+
+    assert insights.overview == "Обзор <важный>."
+    assert insights.recommendations == ["Пауза", "Без названия"]
+
+    text = format_telegram_insights(insights)
+    assert "Обзор &lt;важный&gt;." in text
+    assert "Анна: токсичность 12%, эмпатия 80%" in text
+    assert "«Я рядом»</i> — Анна" in text
+
+
+def test_format_empty_insights():
+    """An empty summary points the user to the full report"""
+    assert "Не удалось извлечь" in format_telegram_insights(ReportInsights())
@@ -0,0 +1,62 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from app.config import settings
+from app.handlers.debug import setup_debug_routes
+from app.handlers.instrumentation import HandlerTimingMiddleware
+from app.utils import loop_monitor, metrics
+
+
+def _blocking_call():
+    time.sleep(0.3)
+
+
+@pytest.mark.asyncio
+async def test_stall_recorded_with_blocking_stack(monkeypatch):
+    """The watchdog captures the stack of the code holding the loop"""
+    watchdog = loop_monitor.LoopWatchdog()
+    monkeypatch.setattr(loop_monitor, "loop_watchdog", watchdog)
+    monkeypatch.setattr(settings, "LOOP_LAG_WARN_MS", 50)
+
+    monitor = asyncio.create_task(loop_monitor.monitor_loop_lag(interval=0.02))
+    try:
+        await asyncio.sleep(0.05)
+        _blocking_call()
+        await asyncio.sleep(0.05)
+    finally:
+        monitor.cancel()
+
+    stall = watchdog.recent()[-1]
+    assert stall["lag_ms"] >= 200
+    assert "_blocking_call" in stall["stack"]
+
+
+@pytest.mark.asyncio
+async def test_handler_timing_and_debug_dump(monkeypatch):
+    """Handlers are timed by name; the dump endpoint needs the configured token"""
+    async def handle_something(event, data):
+        return "ok"
+
+    middleware = HandlerTimingMiddleware()
+    data = {"handler": SimpleNamespace(callback=handle_something)}
+    assert await middleware(handle_something, object(), data) == "ok"
+    assert metrics.HANDLER_SECONDS.count(handler="handle_something") >= 1
+
+    monkeypatch.setattr(settings, "DEBUG_DUMP_TOKEN", "secret")
+    app = web.Application()
+    setup_debug_routes(app)
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    try:
+        assert (await client.get("/debug/loop?token=wrong")).status == 404
+        resp = await client.get("/debug/loop?token=secret")
+        dump = await resp.json()
+        assert any(h["handler"] == "handle_something" for h in dump["handlers"])
+        assert "recent_stalls" in dump["event_loop"]
+    finally:
+        await client.close()
@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+from aiogram.types import Message
+
+from app.config import settings
+from app.services import job_queue
+from app.utils import db
+
+
+@pytest.fixture
+def state_db(tmp_path, monkeypatch):
+    database = db.Database(tmp_path / "state.db")
+    monkeypatch.setattr(db, "state_db", database)
+    yield database
+    database.close()
+
+
+def _upload_message() -> Message:
+    return Message.model_validate({
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": 10, "type": "private"},
+        "from": {"id": 7, "is_bot": False, "first_name": "A"},
+        "document": {"file_id": "F", "file_unique_id": "U", "file_name": "chat.txt", "file_size": 100},
+    })
+
+
+def _status(database, queue_id):
+    return database.query("SELECT status FROM job_queue WHERE id = ?", (queue_id,))[0]["status"]
+
+
+@pytest.mark.asyncio
+async def test_uploads_are_claimed_once_in_order(state_db):
+    first, ahead = await job_queue.enqueue("{}", "1", 10)
+    assert ahead == 0
+    second, ahead = await job_queue.enqueue("{}", "2", 20)
+    assert ahead == 1
+
+    claimed = await job_queue.claim("worker-a")
+    assert (claimed.id, claimed.user_id, claimed.attempts) == (first, "1", 1)
+    # A running upload still counts as ahead of new ones
+    _, ahead = await job_queue.enqueue("{}", "3", 30)
+    assert ahead == 2
+
+    assert (await job_queue.claim("worker-b")).id == second
+    await job_queue.finish(first)
+    assert _status(state_db, first) == job_queue.DONE
+    assert await job_queue.depth() == 1
+
+
+@pytest.mark.asyncio
+async def test_cancel_only_drops_uploads_not_started(state_db):
+    running, _ = await job_queue.enqueue("{}", "1", 10)
+    await job_queue.claim("worker-a")
+    waiting, _ = await job_queue.enqueue("{}", "1", 10)
+
+    assert await job_queue.cancel_queued("1") == 1
+    assert _status(state_db, waiting) == job_queue.CANCELLED
+    assert _status(state_db, running) == job_queue.RUNNING
+    assert await job_queue.claim("worker-a") is None
+
+
+@pytest.mark.asyncio
+async def test_uploads_of_a_dead_worker_are_requeued_then_failed(state_db, monkeypatch):
+    monkeypatch.setattr(settings, "QUEUE_MAX_ATTEMPTS", 2)
+    queue_id, _ = await job_queue.enqueue("{}", "1", 10)
+    await job_queue.claim("worker-a")
+
+    # worker-a still holds its lease: nothing to recover
+    assert await job_queue.recover(["worker-a"]) == 0
+    assert await job_queue.recover(["worker-b"]) == 1
+    assert _status(state_db, queue_id) == job_queue.QUEUED
+
+    # Started twice and lost twice: given up rather than retried forever
+    assert (await job_queue.claim("worker-b")).attempts == 2
+    assert await job_queue.recover([]) == 0
+    assert _status(state_db, queue_id) == job_queue.FAILED
+
+
+def test_queued_message_round_trips():
+    message = _upload_message()
+    restored = Message.model_validate_json(message.model_dump_json(exclude_none=True))
+    assert restored.from_user.id == 7
+    assert restored.document.file_unique_id == "U"
+
+
+@pytest.mark.asyncio
+async def test_drain_queues_unfinished_jobs_for_resume(state_db, monkeypatch):
+    from app.services import pipeline
+    from app.services.jobs import JobRegistry
+
+    registry = JobRegistry()
+    sent = []
+
+    async def fake_send(message, text, *args, **kwargs):
+        sent.append((message.chat.id, text))
+
+    monkeypatch.setattr(pipeline, "jobs", registry)
+    monkeypatch.setattr(pipeline, "safe_send_message", fake_send)
+    monkeypatch.setattr(pipeline, "_draining", False)
+
+    message = _upload_message()
+    slow = asyncio.create_task(asyncio.sleep(30))
+    job = registry.register("job-1", 7, slow)
+    job.message = message
+
+    assert await pipeline.drain(grace=0.1) == 1
+    assert pipeline.draining()
+    assert job.cancelled and slow.cancelled()
+    assert sent and sent[0][0] == 10
+
+    queued = await job_queue.claim("worker-a")
+    assert (queued.job_id, queued.user_id, queued.chat_id) == ("job-1", "7", 10)
+    assert Message.model_validate_json(queued.message).document.file_id == "F"
+
+
+@pytest.mark.asyncio
+async def test_restarting_replica_leaves_uploads_of_live_replicas(state_db, monkeypatch):
+    """Single-process replicas hold a runner lease, so a peer's restart doesn't run their uploads twice"""
+    from app.services import pipeline
+    from app.services.state_store import SQLiteLeaseStore
+
+    store = SQLiteLeaseStore()
+    monkeypatch.setattr(pipeline, "leases", store)
+    monkeypatch.setattr(pipeline, "_draining", True)  # recover only; run nothing
+    live, _ = await job_queue.enqueue("{}", "1", 10)
+    await job_queue.claim("bot-a")
+    await store.acquire(pipeline.runner_lease("bot-a"), "bot-a", 60)
+    lost, _ = await job_queue.enqueue("{}", "2", 20)
+    await job_queue.claim("bot-old")
+
+    monkeypatch.setattr(settings, "INSTANCE_ID", "bot-b")
+    await pipeline.resume_interrupted(bot=None)
+
+    assert _status(state_db, live) == job_queue.RUNNING
+    assert _status(state_db, lost) == job_queue.QUEUED
+    assert (await store.get(pipeline.runner_lease("bot-b"))).owner == "bot-b"
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+from app.config import settings
+from app.services.jobs import JobRegistry
+from app.utils.cleanup import remove_job_files
+
+
+@pytest.mark.asyncio
+async def test_cancel_stops_every_task_of_the_job():
+    registry = JobRegistry()
+    started = asyncio.Event()
+
+    async def pipeline():
+        started.set()
+        await asyncio.sleep(30)  # stands in for an OpenAI request
+
+    main = asyncio.create_task(pipeline())
+    job = registry.register("job-1", user_id=7, task=main)
+    delivery = asyncio.create_task(asyncio.sleep(30))
+    registry.attach("job-1", delivery)
+    await started.wait()
+
+    assert registry.for_user(7) is job
+    assert await registry.cancel(job)
+    assert main.cancelled() and delivery.cancelled()
+    assert registry.get("job-1") is None
+    assert not await registry.cancel(job)
+
+
+def test_remove_job_files_only_touches_that_job(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_DIR", tmp_path / "uploads")
+    monkeypatch.setattr(settings, "REPORT_DIR", tmp_path / "reports")
+    settings.UPLOAD_DIR.mkdir()
+    settings.REPORT_DIR.mkdir()
+    for path in (
+        settings.UPLOAD_DIR / "abc.txt",
+        settings.REPORT_DIR / "abc_meta.json",
+        settings.REPORT_DIR / "abc_report.html.gz",
+        settings.REPORT_DIR / ".abc.partial.pdf",
+        settings.REPORT_DIR / "other_report.html",
+    ):
+        path.write_text("x")
+
+    assert remove_job_files("abc") == 4
+    assert [p.name for p in settings.REPORT_DIR.iterdir()] == ["other_report.html"]
@@ -0,0 +1,80 @@
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from app.config import settings
+from app.handlers.metrics import setup_metrics_routes
+from app.utils import metrics
+
+
+def test_histogram_exposition_is_cumulative():
+    """Buckets are cumulative and end with +Inf, followed by _sum and _count"""
+    histogram = metrics.Histogram("test_stage_seconds", "test", ["stage"], buckets=(1, 5))
+    metrics.REGISTRY.remove(histogram)
+    histogram.observe(0.5, stage="parse")
+    histogram.observe(3, stage="parse")
+    with histogram.time(stage="chunk"):
+        pass
+
+    lines = histogram.expose()
+    assert lines[:2] == ["# HELP test_stage_seconds test", "# TYPE test_stage_seconds histogram"]
+    assert 'test_stage_seconds_bucket{stage="parse",le="1.0"} 1' in lines
+    assert 'test_stage_seconds_bucket{stage="parse",le="5.0"} 2' in lines
+    assert 'test_stage_seconds_bucket{stage="parse",le="+Inf"} 2' in lines
+    assert 'test_stage_seconds_sum{stage="parse"} 3.5' in lines
+    assert 'test_stage_seconds_count{stage="chunk"} 1' in lines
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint_requires_token_when_configured(monkeypatch):
+    metrics.LLM_TOKENS.inc(120, model="gpt-4-turbo", kind="prompt")
+    monkeypatch.setattr(settings, "METRICS_TOKEN", "scrape")
+    app = web.Application()
+    setup_metrics_routes(app)
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    try:
+        assert (await client.get("/metrics")).status == 401
+        resp = await client.get("/metrics", headers={"Authorization": "Bearer scrape"})
+        body = await resp.text()
+        assert resp.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+        assert "# TYPE chatxray_pipeline_stage_seconds histogram" in body
+        assert 'chatxray_llm_tokens_total{model="gpt-4-turbo",kind="prompt"}' in body
+        assert "chatxray_jobs_in_flight 0" in body
+    finally:
+        await client.close()
+
+
+@pytest.mark.asyncio
+async def test_worker_metrics_are_merged(tmp_path, monkeypatch):
+    """Worker snapshots add to the bot's own values; gauges of workers that stopped don't"""
+    from app.services import worker_metrics
+    from app.utils import db
+
+    database = db.Database(tmp_path / "state.db")
+    monkeypatch.setattr(db, "state_db", database)
+    monkeypatch.setattr(settings, "WORKERS", 2)
+    monkeypatch.setattr(settings, "METRICS_TOKEN", None)
+    in_flight = metrics.JOBS_IN_FLIGHT.value()
+    metrics.JOBS_IN_FLIGHT.inc()
+    metrics.REPORTS_REGENERATED.inc()
+    published = metrics.REPORTS_REGENERATED.value()
+    await worker_metrics.publish(settings.INSTANCE_ID, "w0")
+    await worker_metrics.publish(settings.INSTANCE_ID, "w1")
+    await worker_metrics.publish("another-bot", "x0")
+    metrics.JOBS_IN_FLIGHT.dec()
+    # w1 exited long ago
+    database.execute("UPDATE worker_metrics SET updated_at = 0 WHERE owner = 'w1'")
+
+    app = web.Application()
+    setup_metrics_routes(app)
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    try:
+        body = await (await client.get("/metrics")).text()
+    finally:
+        await client.close()
+        database.close()
+    regenerated = metrics._number(published * 3)
+    assert f"chatxray_reports_regenerated_total {regenerated}" in body
+    assert f"chatxray_jobs_in_flight {metrics._number(in_flight * 2 + 1)}" in body
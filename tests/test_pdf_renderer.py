@@ -0,0 +1,49 @@
+import io
+import sys
+import types
+
+from app.services.render import PdfRenderer
+from app.services.report_template import REPORT_CSS
+
+
+def _fake_weasyprint(calls):
+    """Minimal stand-in recording how the renderer drives WeasyPrint"""
+    module = types.ModuleType("weasyprint")
+    module.__version__ = "fake"
+
+    class CSS:
+        def __init__(self, string, font_config=None):
+            calls.append(("css", string))
+
+    class HTML:
+        def __init__(self, string):
+            self.string = string
+
+        def write_pdf(self, target=None, stylesheets=None, font_config=None):
+            calls.append(("render", self.string, stylesheets, font_config))
+
+    fonts = types.ModuleType("weasyprint.text.fonts")
+    fonts.FontConfiguration = lambda: object()
+    module.CSS, module.HTML = CSS, HTML
+    return module, fonts
+
+
+def test_renderer_loads_once_and_reuses_stylesheet(monkeypatch):
+    """The report CSS is parsed once and swapped in for the inline block"""
+    calls = []
+    module, fonts = _fake_weasyprint(calls)
+    monkeypatch.setitem(sys.modules, "weasyprint", module)
+    monkeypatch.setitem(sys.modules, "weasyprint.text", types.ModuleType("weasyprint.text"))
+    monkeypatch.setitem(sys.modules, "weasyprint.text.fonts", fonts)
+
+    renderer = PdfRenderer()
+    report = f"<html><head><style>{REPORT_CSS}</style></head><body>A</body></html>"
+    renderer.render(report, io.BytesIO())
+    renderer.render("<html><body>B</body></html>", io.BytesIO())
+
+    assert [c[0] for c in calls] == ["css", "render", "render"]
+    first, second = calls[1], calls[2]
+    assert REPORT_CSS not in first[1]
+    assert first[2] is not None and first[3] is second[3] is not None
+    # Documents without the standard stylesheet are rendered as they are
+    assert second[2] is None
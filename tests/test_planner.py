@@ -0,0 +1,42 @@
+from app.config import settings
+from app.services.planner import DEFAULT_THROUGHPUT, Throughput, choose_plan, format_eta
+
+
+def _messages(count, words=8):
+    return [{"raw": f"[01.01.24 10:{i % 60:02d}] A: " + "слово " * words} for i in range(count)]
+
+
+def test_cheapest_plan_without_truncation_wins(monkeypatch):
+    """Bigger chunks are cheaper, but not once the primary prompt would cut text off"""
+    monkeypatch.setattr(settings, "PLANNER_CHUNK_SIZES", [15, 25, 40])
+    monkeypatch.setattr(settings, "PLANNER_META_SAMPLE_SIZES", [400])
+    monkeypatch.setattr(settings, "JOB_SLA_SECONDS", 10_000)
+    monkeypatch.setattr(settings, "JOB_BUDGET_USD", 100)
+    primary = {"gpt-3.5-turbo": DEFAULT_THROUGHPUT["primary"]}
+
+    plan, chunks = choose_plan(_messages(600, words=8), primary, DEFAULT_THROUGHPUT["meta"])
+    assert plan.chunk_size == 40 and plan.coverage == 1.0
+    assert sum(len(c) for c in chunks) == 600
+
+    # ~125 characters per message: 40 of them no longer fit MAX_CHUNK_CHARS
+    plan, _ = choose_plan(_messages(600, words=18), primary, DEFAULT_THROUGHPUT["meta"])
+    assert plan.chunk_size == 25
+
+
+def test_sla_shrinks_plan_and_eta(monkeypatch):
+    """A tight SLA trades chunk granularity for fewer primary waves"""
+    monkeypatch.setattr(settings, "PLANNER_CHUNK_SIZES", [15, 40])
+    monkeypatch.setattr(settings, "PLANNER_META_SAMPLE_SIZES", [400])
+    monkeypatch.setattr(settings, "OPENAI_CONCURRENCY_LIMIT", 5)
+    monkeypatch.setattr(settings, "JOB_BUDGET_USD", 100)
+    monkeypatch.setattr(settings, "JOB_SLA_SECONDS", 50)
+    primary = {"gpt-3.5-turbo": Throughput(seconds_per_call=5, completion_tokens_per_call=200)}
+    meta = Throughput(seconds_per_call=30, completion_tokens_per_call=2000)
+
+    plan, _ = choose_plan(_messages(400, words=4), primary, meta)
+    # 10 chunks of 40 = 2 waves; 27 chunks of 15 = 6 waves
+    assert plan.chunk_size == 40
+    assert plan.estimated_seconds == 2 * 5 + 30
+    assert plan.within_limits
+    assert format_eta(plan.estimated_seconds) == "меньше минуты"
+    assert format_eta(130) == "~3 мин"
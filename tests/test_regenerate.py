@@ -0,0 +1,118 @@
+import json
+
+import pytest
+
+from app.config import settings
+from app.services import checkpoints, llm_meta, regenerate, report_index
+from app.utils import db
+
+CONTENT = {
+    "overview": ["Первый абзац обзора."],
+    "key_quotes": [{"author": "A", "text": "Привет", "comment": "Тёплое начало"}],
+    "recommendations": [{"title": "Говорите", "text": "Обсуждайте чувства."}],
+}
+
+
+@pytest.fixture
+def state_db(tmp_path, monkeypatch):
+    database = db.Database(tmp_path / "state.db")
+    monkeypatch.setattr(db, "state_db", database)
+    monkeypatch.setattr(settings, "REPORT_DIR", tmp_path)
+    yield database
+    database.close()
+
+
+async def _store_job(job_id: str) -> None:
+    chunks = [[{"raw": "m0", "author": "A", "timestamp": "t"}]]
+    await checkpoints.start_job(job_id, "7", 10, "{}")
+    await checkpoints.save_chunk(job_id, 0, checkpoints.chunk_digest(chunks[0]), [{"author": "A", "toxicity": 0.2}], 10)
+    await checkpoints.record_primary(job_id, chunks=1, total_messages=1)
+
+
+@pytest.mark.asyncio
+async def test_report_rendered_again_from_stored_analysis(state_db, monkeypatch):
+    # Any model call would fail the test
+    monkeypatch.setattr(llm_meta, "client", None)
+    await _store_job("job-1")
+    assert await regenerate.regenerate_report("job-1") is None
+
+    await checkpoints.record_meta("job-1", json.dumps(CONTENT, ensure_ascii=False), None, ["Сокращённая выборка."])
+    assert await checkpoints.rendered_jobs() == ["job-1"]
+
+    html_path = settings.REPORT_DIR / "job-1_report.html"
+    html_path.write_text("<html>old</html>")
+    (settings.REPORT_DIR / "job-1_report.html.meta").write_text("4102444800")
+    (settings.REPORT_DIR / "job-1.pdf").write_bytes(b"%PDF-old")
+
+    result = await regenerate.regenerate_report("job-1")
+    html = html_path.read_text(encoding="utf-8")
+    assert "Первый абзац обзора." in html and "Сокращённая выборка." in html
+    assert "chart-toxicity" in html
+    # Links keep their expiry; the stale PDF is rendered again on next download
+    assert float((settings.REPORT_DIR / "job-1_report.html.meta").read_text()) == 4102444800
+    assert not (settings.REPORT_DIR / "job-1.pdf").exists()
+    assert result.pdf_path is None and "Привет" in result.insights
+
+
+@pytest.mark.asyncio
+async def test_regeneration_refreshes_indexed_summary(state_db, monkeypatch):
+    await _store_job("job-1")
+    await checkpoints.record_meta("job-1", json.dumps(CONTENT, ensure_ascii=False), None, [])
+    html_path = settings.REPORT_DIR / "job-1_report.html"
+    html_path.write_text("<html>old</html>")
+    await report_index.record_report(report_index.ReportEntry(
+        job_id="job-1", user_id="7", file_unique_id="U", content_sha256=None, insights="old",
+        html_path=html_path, pdf_path=settings.REPORT_DIR / "job-1.pdf",
+        created_at=0, expires_at=4102444800,
+    ))
+
+    assert await regenerate.regenerate_reports(["job-1", "missing"]) == 1
+    entry = await report_index.find_by_file("U")
+    assert entry.insights != "old" and "Привет" in entry.insights
+
+
+@pytest.mark.asyncio
+async def test_job_with_a_failed_chunk_can_be_regenerated(state_db, monkeypatch):
+    """Failed chunks are not checkpointed, but the merged results the meta stage got are"""
+    from app.services import llm_primary
+
+    async def flaky_chunk(chunk, model=None):
+        if chunk[0]["raw"] == "m1":
+            raise RuntimeError("upstream error")
+        return [{"author": "A", "toxicity": 0.2}], 10
+
+    monkeypatch.setattr(llm_primary, "process_chunk", flaky_chunk)
+    monkeypatch.setattr(llm_meta, "client", None)
+    chunks = [[{"raw": f"m{i}", "author": "A", "timestamp": "t"}] for i in range(2)]
+    await checkpoints.start_job("job-1", "7", 10, "{}")
+    results, _ = await llm_primary.process_chunks(chunks, job_id="job-1")
+    assert list(await checkpoints.load_chunks("job-1")) == [0]
+    await checkpoints.record_primary("job-1", chunks=2, total_messages=2, results=results)
+    await checkpoints.record_meta("job-1", json.dumps(CONTENT, ensure_ascii=False), None, [])
+
+    analysis = await checkpoints.load_analysis("job-1")
+    assert analysis.primary.results == results and "error" in results[1]
+    assert await regenerate.regenerate_report("job-1") is not None
+
+
+@pytest.mark.asyncio
+async def test_pdf_render_overtaken_by_regeneration_is_not_kept(tmp_path, monkeypatch):
+    from app.services import render
+
+    html_path = tmp_path / "job-1_report.html"
+    html_path.write_text("<html>old</html>", encoding="utf-8")
+    calls = []
+
+    def fake_render(html_content, target):
+        calls.append(html_content)
+        if len(calls) == 1:
+            # The report is regenerated while its old version renders
+            html_path.write_text("<html>regenerated</html>", encoding="utf-8")
+        with open(target, "w", encoding="utf-8") as f:
+            f.write(html_content)
+
+    monkeypatch.setattr(render.pdf_renderer, "render", fake_render)
+    await render.render_pdf_file(html_path, tmp_path / "job-1.pdf")
+
+    assert calls == ["<html>old</html>", "<html>regenerated</html>"]
+    assert (tmp_path / "job-1.pdf").read_text(encoding="utf-8") == "<html>regenerated</html>"
@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services import report_index
+from app.services.jobs import JobRegistry
+from app.utils import db
+
+
+@pytest.fixture
+def index_db(tmp_path, monkeypatch):
+    database = db.Database(tmp_path / "state.db")
+    monkeypatch.setattr(db, "state_db", database)
+    yield database
+    database.close()
+
+
+def _entry(tmp_path, job_id, expires_in=3600, **kwargs):
+    html_path = tmp_path / f"{job_id}_report.html"
+    html_path.write_text("<html></html>")
+    fields = dict(
+        job_id=job_id,
+        user_id="42",
+        file_unique_id="U1",
+        content_sha256="abc",
+        insights="<b>Выводы</b>",
+        html_path=html_path,
+        pdf_path=tmp_path / f"{job_id}.pdf",
+        created_at=time.time(),
+        expires_at=time.time() + expires_in,
+    )
+    fields.update(kwargs)
+    return report_index.ReportEntry(**fields)
+
+
+@pytest.mark.asyncio
+async def test_finds_retained_reports_by_file_or_content(index_db, tmp_path):
+    await report_index.record_report(_entry(tmp_path, "old", expires_in=-1))
+    await report_index.record_report(_entry(tmp_path, "live", file_unique_id="U2"))
+
+    assert (await report_index.find_by_content("abc")).job_id == "live"
+    assert (await report_index.find_by_file("U2")).job_id == "live"
+    # Expired rows don't match and are pruned
+    assert await report_index.find_by_file("U1") is None
+    assert await report_index.prune_expired() == 1
+
+    # A report whose files are gone (e.g. removed by hand) is not reused
+    (tmp_path / "live_report.html").unlink()
+    assert await report_index.find_by_content("abc") is None
+
+
+@pytest.mark.asyncio
+async def test_identical_upload_attaches_to_running_job():
+    registry = JobRegistry()
+    first = registry.register("job-1", user_id=7)
+    registry.claim(first, "sha256:abc")
+    second = registry.register("job-2", user_id=7)
+
+    assert registry.find("sha256:abc", exclude=second) is first
+    assert registry.find("sha256:abc", exclude=first) is None
+
+    waiter = asyncio.ensure_future(registry.find("sha256:abc").outcome())
+    registry.finish("job-1", "report")
+    assert await waiter == "report"
+    assert registry.find("sha256:abc") is None
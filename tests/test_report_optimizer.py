@@ -0,0 +1,41 @@
+from app.services.report_optimizer import optimize_report_html
+
+
+def test_svg_precision_and_line_merging():
+    """Coordinates lose excess precision and same-styled adjacent lines become one path"""
+    html = (
+        '<html><head></head><body><svg viewBox="0 0 10.123 10">\n'
+        '  <line x1="1.2345" y1="2" x2="3.06" y2="4" stroke="#ccc" />\n'
+        '  <line x1="5" y1="6" x2="7" y2="8" stroke="#ccc" />\n'
+        '  <line x1="5" y1="6" x2="7" y2="8" stroke="#f00" />\n'
+        '  <text x="1.25" y="2" font-family="Arial">a  b</text>\n'
+        "</svg></body></html>"
+    )
+    out = optimize_report_html(html)
+
+    assert 'viewBox="0 0 10.1 10"' in out
+    assert '<path d="M1.2 2L3.1 4M5 6L7 8" stroke="#ccc"/>' in out
+    assert 'stroke="#f00"' in out and out.count("<line") == 1
+    assert '<text x="1.2" y="2">a b</text>' in out
+
+
+def test_inline_styles_hoisted_and_raw_blocks_kept():
+    """Repeated inline styles become classes; <pre>/<style> content is untouched"""
+    html = (
+        "<html><head><style>p  { margin: 0 }</style></head><body>\n"
+        '  <div style="color: red; padding: 4px">a</div>\n'
+        '  <p class="note" style="color: red; padding: 4px">b</p>\n'
+        '  <p style="margin: 1px">once</p>\n'
+        "  <!-- dropped -->\n"
+        "  <pre>  keep\n  me </pre>\n"
+        "</body></html>"
+    )
+    out = optimize_report_html(html)
+
+    assert '<div class="xs1">a</div>' in out
+    assert '<p class="note xs1">b</p>' in out
+    assert '<p style="margin: 1px">once</p>' in out
+    assert ".xs1{color: red !important;padding: 4px !important}" in out
+    assert "<style>p  { margin: 0 }</style>" in out
+    assert "<pre>  keep\n  me </pre>" in out
+    assert "dropped" not in out
@@ -0,0 +1,117 @@
+import asyncio
+import time
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from app.config import settings
+from app.handlers import reports
+from app.utils.report_files import write_report_html
+from app.utils.signing import signed_query
+
+
+@pytest.fixture
+def report_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "REPORT_DIR", tmp_path)
+    return tmp_path
+
+
+def _url(name: str, expires: float = None) -> str:
+    return f"/reports/{name}?{signed_query(name, expires or time.time() + 3600)}"
+
+
+async def _client() -> TestClient:
+    app = web.Application()
+    reports.setup_report_routes(app)
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    return client
+
+
+@pytest.mark.asyncio
+async def test_pdf_rendered_once_for_concurrent_requests(report_dir, monkeypatch):
+    """Concurrent first requests share one render; later hits come from disk"""
+    (report_dir / "abc_report.html").write_text("<html></html>")
+    expiry = time.time() + 3600
+    (report_dir / "abc_report.html.meta").write_text(str(expiry))
+
+    calls = []
+
+    async def fake_render(html_path, pdf_path):
+        calls.append(html_path)
+        await asyncio.sleep(0.05)
+        pdf_path.write_bytes(b"%PDF-1.7 test")
+
+    monkeypatch.setattr(reports, "render_pdf_file", fake_render)
+
+    client = await _client()
+    try:
+        responses = await asyncio.gather(*(client.get(_url("abc.pdf")) for _ in range(3)))
+        assert [r.status for r in responses] == [200, 200, 200]
+        assert await responses[0].read() == b"%PDF-1.7 test"
+
+        again = await client.get(_url("abc.pdf"))
+        assert again.status == 200
+        assert len(calls) == 1
+        # The cached PDF inherits the report's expiry
+        assert float((report_dir / "abc.pdf.meta").read_text()) == expiry
+    finally:
+        await client.close()
+
+
+@pytest.mark.asyncio
+async def test_missing_expired_and_private_files(report_dir):
+    """Unknown, expired and non-report files are not served"""
+    (report_dir / "old_report.html").write_text("<html></html>")
+    (report_dir / "old_report.html.meta").write_text(str(time.time() - 1))
+    (report_dir / "x_meta.json").write_text("{}")
+
+    client = await _client()
+    try:
+        for name in ("nope.pdf", "old.pdf", "old_report.html", "x_meta.json", "old_report.html.meta"):
+            assert (await client.get(_url(name))).status == 404
+    finally:
+        await client.close()
+
+
+@pytest.mark.asyncio
+async def test_unsigned_and_expired_links_rejected(report_dir):
+    """Links need a valid, unexpired signature for that exact file"""
+    (report_dir / "abc_report.html").write_text("<html></html>")
+
+    client = await _client()
+    try:
+        assert (await client.get("/reports/abc_report.html")).status == 403
+        assert (await client.get(_url("abc_report.html", time.time() - 10))).status == 403
+        forged = _url("other_report.html").replace("other_report.html", "abc_report.html", 1)
+        assert (await client.get(forged)).status == 403
+        assert (await client.get(_url("abc_report.html"))).status == 200
+    finally:
+        await client.close()
+
+
+@pytest.mark.asyncio
+async def test_precompressed_cached_and_ranged_responses(report_dir):
+    """HTML comes precompressed with validators; PDFs support Range"""
+    html = "<html><body>" + "<p>Отчёт</p>" * 2000 + "</body></html>"
+    write_report_html(report_dir / "abc_report.html", html)
+    assert (report_dir / "abc_report.html.gz").exists()
+    (report_dir / "abc.pdf").write_bytes(b"0123456789")
+
+    client = await _client()
+    try:
+        resp = await client.get(_url("abc_report.html"), headers={"Accept-Encoding": "gzip"})
+        assert resp.headers["Content-Encoding"] == "gzip"
+        assert "no-cache" in resp.headers["Cache-Control"]
+        assert (await resp.text()) == html
+
+        etag = resp.headers["ETag"]
+        cached = await client.get(_url("abc_report.html"), headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+        assert cached.status == 304
+
+        part = await client.get(_url("abc.pdf"), headers={"Range": "bytes=2-5"})
+        assert part.status == 206
+        assert await part.read() == b"2345"
+    finally:
+        await client.close()
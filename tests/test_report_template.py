@@ -0,0 +1,75 @@
+import json
+
+from app.services.report_schema import (
+    parse_report_content,
+    close_truncated_json,
+    SectionStreamTracker,
+)
+from app.services.report_template import render_report
+
+
+SAMPLE_CONTENT = {
+    "overview": ["Первый абзац обзора.", "Второй абзац."],
+    "communication_patterns": "Абзац один.\n\nАбзац два.",
+    "key_quotes": [
+        {"text": "Я <очень> устал", "author": "Анна", "emotion": "грусть", "style": "пассивный", "analysis": "Анализ."}
+    ],
+    "recommendations": [{"title": "Активное слушание", "text": "Описание.", "participant": ""}],
+    "quantitative_analysis": {"communication_metrics": ["Комментарий к метрикам."]},
+    "participant_portraits": [{"participant": "Анна", "paragraphs": ["Портрет."]}],
+}
+
+
+def test_parse_report_content_validates_schema():
+    """Paragraph strings are split and quotes are parsed into models"""
+    content = parse_report_content(json.dumps(SAMPLE_CONTENT, ensure_ascii=False))
+    assert content is not None
+    assert content.communication_patterns == ["Абзац один.", "Абзац два."]
+    assert content.key_quotes[0].author == "Анна"
+
+    assert parse_report_content("<html>not json</html>") is None
+    assert parse_report_content("{}") is None
+
+
+def test_parse_report_content_repairs_truncated_output():
+    """A completion cut off by max_tokens keeps its complete sections"""
+    raw = json.dumps(SAMPLE_CONTENT, ensure_ascii=False)
+    truncated = raw[: raw.index('"recommendations"') + 30]
+    assert close_truncated_json(truncated) is not None
+
+    content = parse_report_content(truncated)
+    assert content is not None
+    assert content.overview == SAMPLE_CONTENT["overview"]
+    assert content.key_quotes
+    assert not content.participant_portraits
+
+
+def test_render_report_inserts_charts_and_banners():
+    """Charts, banners and escaped content end up in one HTML document"""
+    content = parse_report_content(json.dumps(SAMPLE_CONTENT, ensure_ascii=False))
+    html = render_report(
+        content,
+        charts={"communication_metrics": ["<svg id='chart-2'></svg>"]},
+        total_messages=120,
+        sample_note="Выборка",
+    )
+
+    assert html.startswith("<!DOCTYPE html>")
+    assert "<svg id='chart-2'></svg>" in html
+    assert "<b>120</b>" in html
+    assert 'class="sample-note"' in html
+    assert "Я &lt;очень&gt; устал" in html
+    assert '<div class="recommendation">' in html
+    assert "chart-placeholder" not in html
+
+
+def test_section_stream_tracker_detects_sections_across_chunks():
+    """Top-level keys are detected even when split between stream deltas"""
+    raw = json.dumps(SAMPLE_CONTENT, ensure_ascii=False)
+    tracker = SectionStreamTracker()
+    started = []
+    for i in range(0, len(raw), 7):
+        started.extend(tracker.feed(raw[i:i + 7]))
+
+    assert started == list(SAMPLE_CONTENT.keys())
+    assert tracker.completed == len(SAMPLE_CONTENT) - 1
@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
+
+from app.services.jobs import JobRegistry
+from app.services.state_store import SQLiteLeaseStore, SQLiteStorage
+from app.utils import db
+
+
+class Form(StatesGroup):
+    waiting = State()
+
+
+@pytest.fixture
+def state_db(tmp_path, monkeypatch):
+    database = db.Database(tmp_path / "state.db")
+    monkeypatch.setattr(db, "state_db", database)
+    yield database
+    database.close()
+
+
+@pytest.mark.asyncio
+async def test_fsm_state_and_data_survive_a_new_storage(state_db):
+    key = StorageKey(bot_id=1, chat_id=2, user_id=3)
+    storage = SQLiteStorage()
+    await storage.set_state(key, Form.waiting)
+    await storage.update_data(key, {"file": "chat.txt"})
+
+    # Another process (or a restart) sees the same state
+    other = SQLiteStorage()
+    assert await other.get_state(key) == Form.waiting.state
+    assert await other.get_data(key) == {"file": "chat.txt"}
+    assert await other.get_data(StorageKey(bot_id=1, chat_id=2, user_id=4)) == {}
+
+
+@pytest.mark.asyncio
+async def test_lease_has_one_owner_until_released_or_expired(state_db):
+    store = SQLiteLeaseStore()
+    assert await store.acquire("job:1", "a", ttl=30, info="42")
+    assert not await store.acquire("job:1", "b", ttl=30)
+    assert await store.acquire("job:1", "a", ttl=30, info="42")  # re-acquiring our own lease
+    assert not await store.renew("job:1", "b", ttl=30)
+    assert [lease.owner for lease in await store.list("job:")] == ["a"]
+
+    await store.release("job:1", "b")  # not b's to release
+    assert (await store.get("job:1")).owner == "a"
+    await store.release("job:1", "a")
+    assert await store.acquire("job:1", "b", ttl=0.05)
+
+    await asyncio.sleep(0.1)
+    # Expired: the owner can no longer renew it and anyone may take it
+    assert await store.get("job:1") is None
+    assert not await store.renew("job:1", "b", ttl=30)
+    assert await store.acquire("job:1", "a", ttl=30)
+
+
+@pytest.mark.asyncio
+async def test_job_cancelled_from_another_process(state_db):
+    store = SQLiteLeaseStore()
+    runner, front = JobRegistry(store, "proc-a"), JobRegistry(store, "proc-b")
+    job = runner.register("job-1", user_id=7)
+    await runner.lease(job)
+
+    assert await runner.claim_shared(job, "sha256:abc") is None
+    assert (await front.claim_shared(front.register("job-2", user_id=8), "sha256:abc")).owner == "proc-a"
+
+    assert await front.request_cancel(8) is None
+    assert await front.request_cancel(7) == "job-1"
+    assert await runner.cancel_requests() == [job]
+
+    runner.finish("job-1")
+    await asyncio.sleep(0)
+    assert await front.wait_released("sha256:abc", timeout=1, poll=0.01)
+
+    # A retry of the same job id is not stopped by the earlier cancellation
+    retry = runner.register("job-1", user_id=7)
+    await runner.lease(retry)
+    assert await runner.cancel_requests() == []
@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from app.utils.telegram_outbox import Priority, TelegramOutbox
+
+
+def _outbox(**kwargs):
+    return TelegramOutbox(**{"global_rate": 30, "chat_rate": 1, "chat_burst": 1, **kwargs})
+
+
+@pytest.mark.asyncio
+async def test_pending_edits_of_a_message_coalesce_to_the_latest():
+    outbox = _outbox()
+    sent = []
+
+    def edit(text):
+        async def call():
+            sent.append(text)
+            return text
+        return call
+
+    first = asyncio.create_task(outbox.call(edit("send"), chat_id=1))
+    await asyncio.sleep(0)
+    # The chat's only token went to the send; these edits wait and collapse into one
+    await outbox.call(edit("1/3"), chat_id=1, priority=Priority.PROGRESS, key="m", wait=False)
+    await outbox.call(edit("2/3"), chat_id=1, priority=Priority.PROGRESS, key="m", wait=False)
+    last = await outbox.call(edit("done"), chat_id=1, key="m")
+
+    assert await first == "send"
+    assert last == "done"
+    assert sent == ["send", "done"]
+    await outbox.drain(timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_final_deliveries_go_before_progress_updates():
+    outbox = _outbox(global_rate=1)
+    sent = []
+
+    def call(name):
+        async def send():
+            sent.append(name)
+        return send
+
+    await outbox.call(call("first"), chat_id=1)
+    progress = [
+        asyncio.create_task(outbox.call(call(f"progress {chat}"), chat_id=chat, priority=Priority.PROGRESS))
+        for chat in (2, 3)
+    ]
+    final = asyncio.create_task(outbox.call(call("summary"), chat_id=4, priority=Priority.FINAL))
+    await asyncio.gather(final, *progress)
+    assert sent[:2] == ["first", "summary"]
+    await outbox.drain(timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_retry_after_pauses_the_chat_and_retries():
+    outbox = _outbox(chat_burst=5)
+    attempts = []
+
+    async def flood_once():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise TelegramRetryAfter(method=SendMessage(chat_id=1, text="x"), message="Too Many Requests", retry_after=1)
+        return "ok"
+
+    async def rejected():
+        raise TelegramBadRequest(method=SendMessage(chat_id=1, text="x"), message="message is not modified")
+
+    assert await outbox.call(flood_once, chat_id=1) == "ok"
+    assert attempts[1] - attempts[0] >= 0.95
+    assert outbox._paused_until == {}
+    # Errors a retry cannot fix are not retried
+    assert await outbox.call(rejected, chat_id=1) is None
+    await outbox.drain(timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_chats_are_forgotten_once_their_bucket_refills():
+    outbox = _outbox(chat_rate=20)
+
+    async def send():
+        return "ok"
+
+    for chat_id in range(3):
+        assert await outbox.call(send, chat_id=chat_id) == "ok"
+    await asyncio.sleep(0.1)
+    assert await outbox.call(send, chat_id=99) == "ok"
+    # Only the chat whose token was just taken still needs its bucket
+    assert list(outbox._chats) == [99]
+    await outbox.drain(timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_edit_of_a_message_never_sent_is_skipped():
+    from app.utils.messaging import safe_edit_message
+
+    # safe_send_message returns None when the outbox gave up on the send
+    assert await safe_edit_message(None, "1/3", Priority.PROGRESS) is None
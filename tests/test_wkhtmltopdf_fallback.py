@@ -0,0 +1,51 @@
+import os
+import stat
+
+import pytest
+
+from app.config import settings
+from app.services import render
+from app.utils import metrics
+
+
+def _install_fake_wkhtmltopdf(bin_dir, monkeypatch, body: str):
+    script = bin_dir / "wkhtmltopdf"
+    script.write_text("#!/bin/sh\n" + body)
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+    def weasyprint_unavailable(html_content, target):
+        raise OSError("cannot load library 'libpango-1.0-0'")
+
+    monkeypatch.setattr(render.pdf_renderer, "render", weasyprint_unavailable)
+
+
+@pytest.mark.asyncio
+async def test_fallback_reads_stdin_and_records_stderr(tmp_path, monkeypatch):
+    """The HTML goes in through stdin; stderr lines are counted"""
+    # Copy stdin to the output path (last argument) and warn once
+    _install_fake_wkhtmltopdf(tmp_path, monkeypatch, 'for last; do :; done\ncat > "$last"\necho "Warning: slow" >&2\n')
+    html_path = tmp_path / "r_report.html"
+    html_path.write_text("<html>отчёт</html>", encoding="utf-8")
+    warnings_before = metrics.WKHTMLTOPDF_STDERR_LINES.value(level="warning")
+
+    await render.render_pdf_file(html_path, tmp_path / "r.pdf")
+
+    assert (tmp_path / "r.pdf").read_text(encoding="utf-8") == "<html>отчёт</html>"
+    assert metrics.WKHTMLTOPDF_STDERR_LINES.value(level="warning") == warnings_before + 1
+
+
+@pytest.mark.asyncio
+async def test_fallback_killed_on_timeout(tmp_path, monkeypatch):
+    """A hung wkhtmltopdf is killed and no partial PDF is left behind"""
+    _install_fake_wkhtmltopdf(tmp_path, monkeypatch, "exec sleep 30\n")
+    monkeypatch.setattr(settings, "WKHTMLTOPDF_TIMEOUT_SECONDS", 0.2)
+    html_path = tmp_path / "r_report.html"
+    html_path.write_text("<html></html>")
+    timeouts_before = metrics.WKHTMLTOPDF_RENDERS.value(outcome="timeout")
+
+    with pytest.raises(Exception, match="timed out"):
+        await render.render_pdf_file(html_path, tmp_path / "r.pdf")
+
+    assert metrics.WKHTMLTOPDF_RENDERS.value(outcome="timeout") == timeouts_before + 1
+    assert [p.name for p in tmp_path.iterdir() if p.suffix == ".pdf"] == []